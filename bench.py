@@ -0,0 +1,301 @@
+"""
+Benchmarks of the simulator core, on fixed scenarios, against a baseline.
+
+Every scenario is a fixed seed simulation run for a fixed number of events,
+from 10 nodes to 5,000, on dense & sparse networks and with different
+transaction / block interarrival times. Each one runs in a fresh process,
+so that its peak memory is its own, and reports:
+
+    events_per_sec   events run per second of wall time (the best of --repeat)
+    peak_rss_mb      peak resident memory of the process
+    queue_depth      events left in the queue at the end
+    peak_queue_depth highest queue depth seen (sampled every 1/SLICES of the run)
+    setup            seconds spent creating the nodes, picking their peers,
+                     setting up the latency engine & seeding the queue
+
+Results are written to a JSON file, and compared with a baseline (saved by
+an earlier --save-baseline, on the same machine): the scenarios that got
+slower, or use more memory, by more than --threshold are flagged, and the
+exit status is 1 if there are any.
+
+For eg: python3 bench.py --scenarios n100-sparse n1000-sparse --repeat 3
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import contextlib
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+from simulation import OUT_DIR, Simulator
+
+# Fixed seed of every scenario
+SEED = 1
+
+# Scenarios by name: parameters of the Simulator, and events to run
+SCENARIOS = {
+    "n10-dense": dict(n=10, z=0.3, tm=3, bm=10, topology="dense", events=200000),
+    "n10-sparse": dict(n=10, z=0.3, tm=3, bm=10, topology="regular", degree=4,
+                       events=200000),
+    "n100-dense": dict(n=100, z=0.3, tm=3, bm=10, topology="dense", events=200000),
+    "n100-sparse": dict(n=100, z=0.3, tm=3, bm=10, topology="regular", events=200000),
+
+    # Transactions far more often than blocks, and blocks about as often as
+    # they can spread (so lots of forks)
+    "n100-tx-heavy": dict(n=100, z=0.3, tm=0.5, bm=50, topology="regular",
+                          events=200000),
+    "n100-block-heavy": dict(n=100, z=0.3, tm=20, bm=0.5, topology="regular",
+                             events=200000),
+
+    # Every message here goes to ~750 peers, so the queue grows by millions
+    "n1000-dense": dict(n=1000, z=0.3, tm=3, bm=10, topology="dense", events=50000),
+    "n1000-sparse": dict(n=1000, z=0.3, tm=3, bm=10, topology="regular", events=200000),
+
+    # The original dense topology costs O(n^2), too much for 5,000 nodes
+    "n5000-sparse": dict(n=5000, z=0.3, tm=3, bm=10, topology="regular", events=200000),
+}
+
+# Number of pieces a run is split in, to sample the depth of the queue
+SLICES = 50
+
+# Results compared with the baseline: larger is better for events/sec, and
+# worse for the rest
+HIGHER_IS_BETTER = {"events_per_sec": True, "peak_rss_mb": False, "setup_total": False}
+
+# Setups quicker than this (in seconds) are too noisy to compare
+MIN_SETUP = 0.05
+
+
+def peak_rss_mb():
+    """Return the peak resident memory of this process, in MB."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports it in KB, macOS in bytes
+    return peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+def run_scenario(name, repeat=1, events=None):
+    """Run a scenario (in a fresh worker process), return its results."""
+
+    params = dict(SCENARIOS[name])
+    events = events or params.pop("events")
+    params.pop("events", None)
+
+    n, z, tm, bm = (params.pop(p) for p in ("n", "z", "tm", "bm"))
+
+    best = None
+
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            sim = Simulator(n, z, tm, bm, seed=SEED, **params)
+
+            done, wall = 0, 0.0
+            peak_depth = len(sim.events)
+            chunk = max(1, events // SLICES)
+
+            # Runs pick up where the last one stopped
+            while done < events:
+                summary = sim.run(min(chunk, events - done), quiet=True)
+
+                done += summary["events"]
+                wall += summary["wall_time"]
+                peak_depth = max(peak_depth, len(sim.events))
+
+                if summary["stopped_by"] != "events":
+                    break
+
+        result = {
+            "scenario": name,
+            "events": done,
+            "sim_time": sim.curr_time,
+            "wall_time": wall,
+            "events_per_sec": done / wall if wall else 0.0,
+            "queue_depth": len(sim.events),
+            "peak_queue_depth": peak_depth,
+            "setup": dict(sim.setup_time),
+            "setup_total": sum(sim.setup_time.values()),
+        }
+
+        if best is None or result["events_per_sec"] > best["events_per_sec"]:
+            best = result
+
+        del sim
+
+    best["peak_rss_mb"] = peak_rss_mb()
+
+    return best
+
+
+def machine():
+    """Describe this machine & Python, to tell whether a baseline fits."""
+
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Return the regressions of results against baseline, as a list of
+    (scenario, metric, baseline value, value, relative change).
+    """
+
+    regressions = []
+
+    for result in results:
+        base = baseline.get(result["scenario"])
+
+        if base is None:
+            continue
+
+        for metric, higher in HIGHER_IS_BETTER.items():
+            old, new = base[metric], result[metric]
+
+            if metric == "setup_total" and max(old, new) < MIN_SETUP:
+                continue
+
+            change = (new - old) / old if old else 0.0
+            worse = -change if higher else change
+
+            if worse > threshold:
+                regressions.append((result["scenario"], metric, old, new, change))
+
+    return regressions
+
+
+def print_results(results, baseline):
+    print("{:<17} | {:>9} | {:>12} | {:>8} | {:>9} | {:>11} | {:>9}".format(
+        "Scenario", "events", "events / s", "vs base", "RSS MB", "peak queue",
+        "setup s"))
+
+    for r in results:
+        base = baseline.get(r["scenario"])
+        vs = "%+.1f%%" % (100 * (r["events_per_sec"] / base["events_per_sec"] - 1)) \
+            if base else "-"
+
+        print("{:<17} | {:>9} | {:>12.0f} | {:>8} | {:>9.1f} | {:>11} | {:>9.3f}".format(
+            r["scenario"], r["events"], r["events_per_sec"], vs, r["peak_rss_mb"],
+            r["peak_queue_depth"], r["setup_total"]))
+
+
+def bench(args):
+    results = []
+
+    # A fresh process for every scenario, started from scratch ("spawn"),
+    # so that none of them inherits the memory of another
+    context = multiprocessing.get_context("spawn")
+
+    for name in args.scenarios:
+        print(" >>>> Running %s" % name)
+
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            results.append(pool.submit(run_scenario, name, args.repeat, args.events).result())
+
+    report = {
+        "machine": machine(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+    with open(args.out, "w") as fh:
+        json.dump(report, fh, indent=2, sort_keys=True)
+
+    baseline = {}
+
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            saved = json.load(fh)
+
+        if saved["machine"] != report["machine"]:
+            print(" >>>> The baseline is from another machine, the comparison is rough")
+
+        baseline = dict((r["scenario"], r) for r in saved["results"])
+
+    print()
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+
+        print("\n >>>> Saved as the baseline in %s" % args.baseline)
+        return []
+
+    if not baseline:
+        print("\n >>>> No baseline to compare with, see --save-baseline")
+        return []
+
+    # Only the same work can be compared
+    for r in results:
+        base = baseline.get(r["scenario"])
+
+        if base and (base["events"], base["sim_time"]) != (r["events"], r["sim_time"]):
+            print(" >>>> %s ran different events than the baseline" % r["scenario"])
+
+    regressions = compare(results, baseline, args.threshold)
+
+    print()
+    for scenario, metric, old, new, change in regressions:
+        print(" >>>> Regression: %s %s %.4g -> %.4g (%+.1f%%)" % (
+            scenario, metric, old, new, 100 * change))
+
+    if not regressions:
+        print(" >>>> No regressions beyond %.0f%%" % (100 * args.threshold))
+
+    return regressions
+
+
+P = argparse.ArgumentParser(
+    description='Benchmark the simulator on fixed scenarios, against a baseline.',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+
+P.add_argument('--scenarios', nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS),
+               metavar="NAME", help='Scenarios to run: %s' % ", ".join(SCENARIOS))
+
+P.add_argument('--repeat', type=int, default=1,
+               help='Runs of each scenario, of which the fastest counts')
+
+P.add_argument('--events', type=int, default=None,
+               help='Events to run in every scenario, instead of their own')
+
+P.add_argument('--threshold', type=float, default=0.1,
+               help='Relative change beyond which a result is a regression')
+
+P.add_argument('--baseline', default="bench_baseline.json",
+               help='Baseline results to compare with')
+
+P.add_argument('--save-baseline', action="store_true",
+               help='Save the results as the new baseline, instead of comparing')
+
+P.add_argument('--out', default=os.path.join(OUT_DIR, "bench.json"),
+               help='Results file')
+
+
+if __name__ == '__main__':
+
+    args = P.parse_args()
+
+    if args.repeat < 1:
+        P.error("--repeat must be at least 1")
+
+    if args.events is not None and args.events < 1:
+        P.error("--events must be at least 1")
+
+    if args.threshold <= 0:
+        P.error("--threshold must be positive")
+
+    sys.exit(1 if bench(args) else 0)
@@ -1,28 +1,60 @@
 
+from array import array
+
+# Serialized sizes (in bytes) of a block header and of a single transaction
+BLOCK_HEADER_SIZE = 80
+TX_SIZE = 250
+
+
 class Block(object):
+    """
+    A block, shared (never copied) by every node that has seen it.
+
+    Blocks are immutable once created: anything a node knows about a block
+    that other nodes don't (such as when it arrived) is kept by the node.
+    """
+
+    __slots__ = (
+        "id", "created_at", "creator_id", "prev_block_id", "transactions", "chain_len"
+    )
+
+    def __init__(self, block_id, created_at, creator_id, prev_block_id, chain_len,
+                 transactions=()):
 
-    def __init__(self, block_id, created_at, creator_id, prev_block_id, chain_len):
-        super(Block, self).__init__()
+        # Attributes can only be set through object.__setattr__ (see below)
+        setattr = object.__setattr__
 
-        self.id = block_id
-        self.created_at = created_at
+        setattr(self, "id", block_id)
+        setattr(self, "created_at", created_at)
 
         # Node that created this block
-        self.creator_id = creator_id
+        setattr(self, "creator_id", creator_id)
 
         # This link helps create a chain of blocks
-        self.prev_block_id = prev_block_id
+        setattr(self, "prev_block_id", prev_block_id)
 
-        # Contains a dict of transactions keyed by the id
-        self.transactions = {}
+        # Tuple of the transactions in this block
+        setattr(self, "transactions", tuple(transactions))
 
         # Length of the chain ending at this block
-        self.chain_len = chain_len
+        setattr(self, "chain_len", chain_len)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Block is immutable")
+
+    def __reduce__(self):
+        r = (self.id, self.created_at, self.creator_id, self.prev_block_id,
+             self.chain_len, self.transactions)
+        return (Block, r)
 
     def __len__(self):
         """Return the length of the blockchain ending at this block."""
         return self.chain_len
 
+    def size(self):
+        """Return the serialized size of this block in bytes."""
+        return BLOCK_HEADER_SIZE + TX_SIZE * len(self.transactions)
+
     def __repr__(self):
         r = (self.id, self.prev_block_id, self.creator_id, self.chain_len, len(self.transactions))
         return "<B %d: prev=%d, by=%d, len=%d, txns=%d>" % r
@@ -30,14 +62,60 @@ class Block(object):
 
 class Transaction(object):
 
-    def __init__(self, trans_id, from_id, to_id, coins):
-        super(Transaction, self).__init__()
+    __slots__ = ("id", "from_id", "to_id", "coins", "fee")
 
+    def __init__(self, trans_id, from_id, to_id, coins, fee=0.0):
         self.id = trans_id
         self.from_id = from_id
         self.to_id = to_id
         self.coins = coins
 
+        # Fee offered to miners, used to prioritise transactions in mempools
+        self.fee = fee
+
     def __repr__(self):
         r = (self.id, self.from_id, self.to_id, self.coins)
         return "<T %d: from=%d, to=%d, amt=%d>" % r
+
+
+class TransactionStore(object):
+    """
+    Struct-of-arrays record of every transaction, indexed by transaction id.
+
+    Each field is a column in a typed array, so a transaction takes 32 bytes
+    here rather than a whole object. Transaction ids start at 1.
+    """
+
+    def __init__(self):
+        self.from_id = array("i")
+        self.to_id = array("i")
+        self.coins = array("d")
+        self.fee = array("d")
+        self.created_at = array("d")
+
+    def __len__(self):
+        return len(self.from_id)
+
+    def add(self, tx, created_at):
+        if tx.id != len(self) + 1:
+            raise ValueError("transactions must be added in order of their ids")
+
+        self.from_id.append(tx.from_id)
+        self.to_id.append(tx.to_id)
+        self.coins.append(tx.coins)
+        self.fee.append(tx.fee)
+        self.created_at.append(created_at)
+
+    def __getitem__(self, trans_id):
+        """Rebuild the Transaction with the given id."""
+
+        i = trans_id - 1
+        if i < 0:
+            raise IndexError(trans_id)
+
+        return Transaction(trans_id, self.from_id[i], self.to_id[i],
+                           self.coins[i], self.fee[i])
+
+    def nbytes(self):
+        cols = (self.from_id, self.to_id, self.coins, self.fee, self.created_at)
+        return sum(c.itemsize * len(c) for c in cols)
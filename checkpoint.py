@@ -0,0 +1,66 @@
+"""
+Checkpoints of a running simulation, to resume or fork it later.
+
+A checkpoint is the whole Simulator (event queue, nodes, id counters,
+random streams & current time), pickled and compressed with gzip.
+Pickle stores every object once however many references it has, so a
+block (or transaction) that all the nodes have is only stored once.
+
+Checkpoints are written to a temporary file first, then renamed, so a
+crash while saving one leaves the previous checkpoint intact.
+
+    sim.run(until=None, checkpoint_path="net.ckpt", checkpoint_every=10 ** 6)
+    sim = checkpoint.load("net.ckpt")          # carries on exactly
+    sim = checkpoint.fork("net.ckpt", 3)       # same network, new randomness
+"""
+
+import os
+import gzip
+import pickle
+
+from streams import derive_seed
+
+# Version of the checkpoint format, bumped whenever it changes
+FORMAT = 1
+
+# gzip level: checkpoints are written often, so favour speed over size
+COMPRESS_LEVEL = 3
+
+
+def save(sim, path):
+    """Save the state of sim to path."""
+
+    tmp = path + ".tmp"
+
+    with gzip.open(tmp, "wb", compresslevel=COMPRESS_LEVEL) as fh:
+        pickle.dump({"format": FORMAT, "sim": sim}, fh, pickle.HIGHEST_PROTOCOL)
+
+    os.replace(tmp, path)
+
+
+def load(path):
+    """Return the simulator saved in path, ready to run on from where it was."""
+
+    with gzip.open(path, "rb") as fh:
+        try:
+            saved = pickle.load(fh)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            raise ValueError("%s is not a checkpoint: %s" % (path, e))
+
+    if not isinstance(saved, dict) or saved.get("format") != FORMAT:
+        raise ValueError("%s is not a checkpoint of format %d" % (path, FORMAT))
+
+    return saved["sim"]
+
+
+def fork(path, branch):
+    """
+    Return the simulator saved in path, with its randomness from now on
+    derived from the branch number, so every branch plays out differently
+    from the same state. The network itself (peers & link delays) stays.
+    """
+
+    sim = load(path)
+    sim.reseed(derive_seed(sim.seed, "fork", branch))
+
+    return sim
@@ -2,17 +2,22 @@
 Implements the four kinds of events that can happen in the simulation.
 
 TransactionGenerate, TransactionReceive, BlockGenerate, BlockReceive
+
+Plus Multicast, which delivers one message to many peers, Inv, GetData &
+Data for the announce / request relay protocol (see relay), and
+TransactionClock & BlockClock which drive the "global" arrivals mode.
 """
 
-from block import Block, Transaction
-import random
+from block import Block, Transaction, TX_SIZE
+from latency import INV_SIZE
 
 
 class Event(object):
 
-    def __init__(self, node_id, creator_id, created_at, run_at):
-        super(Event, self).__init__()
+    # There can be millions of events waiting in the queue, so keep them small
+    __slots__ = ("node_id", "creator_id", "created_at", "run_at")
 
+    def __init__(self, node_id, creator_id, created_at, run_at):
         # Node this event will happen on
         self.node_id = node_id
 
@@ -30,69 +35,109 @@ class Event(object):
         return self.run_at < other.run_at
 
 
+def relay(sim, me, peers, kind, payload, now, msg_type, size=None):
+    """
+    Send a message from me to each of peers, to be handled by a kind event.
+
+    Normally this schedules one kind event per peer. In multicast mode, the
+    same latencies are computed (in the same order) but all the deliveries
+    go into a single Multicast event instead.
+
+    With the "inv" relay protocol, peers are only sent an announcement of
+    the payload (an Inv event); see Inv for the rest of the exchange.
+    """
+
+    if sim.relay == "inv":
+        if size is None:
+            size = TX_SIZE if msg_type == "transaction" else None
+
+        payload = (kind, payload, msg_type, size)
+        kind, msg_type, size = Inv, "inv", INV_SIZE
+
+    if not sim.multicast:
+        for peer in peers:
+            t = sim.latency(me, peer, msg_type, size)
+
+            sim.events.put(kind(payload, peer.id, me.id, now, now + t))
+
+        return
+
+    arrivals = sorted(
+        (now + sim.latency(me, peer, msg_type, size), peer.id) for peer in peers
+    )
+
+    if arrivals:
+        sim.events.put(Multicast(kind, payload, me.id, now, arrivals))
+
+
 class TransactionGenerate(Event):
 
-    def __init__(self, node_id, creator_id, created_at, run_at):
-        super(TransactionGenerate, self).__init__(
-            node_id, creator_id, created_at, run_at
-        )
+    __slots__ = ()
 
     def __repr__(self):
         return "T Gen: on=%d" % self.node_id
 
     def run(self, sim):
+        self.generate(sim, self.node_id, self.run_at)
+
+        # Create a next transaction event for this node
+        sim.events.put(TransactionGenerate(
+            self.node_id,
+            self.node_id,
+            self.run_at,
+            self.run_at + sim.transaction_delay(sim.nodes[self.node_id])
+        ))
+
+    @staticmethod
+    def generate(sim, node_id, now):
         # The node that this event is running on
-        me = sim.nodes[self.node_id]
+        me = sim.nodes[node_id]
 
         # Generate a random amount not greater than current node's balance
-        trans_amt = me.coins * random.uniform(0, 1)
+        rng = sim.stream("transactions", me.id)
+        trans_amt = me.coins * rng.uniform(0, 1)
 
         # Find a random receiver who will receive the coins in the transaction
-        all_but_me = list(set(sim.nodes) - set([me]))
-        receiver = random.choice(all_but_me)
+        # (skipping over my own id, without building a list of everyone else)
+        r = rng.randrange(sim.n - 1)
+        receiver = sim.nodes[r + 1 if r >= me.id else r]
 
-        # Update the coins of both sender & receiver
+        # Take the coins from the sender now, the receiver gets them once the
+        # transaction reaches it (see Node.add_transaction)
         me.coins -= trans_amt
-        receiver.coins += trans_amt
 
         # Add transaction to current node's transaction list
         new_trans = Transaction(
-            sim.trans_id,
+            sim.new_trans_id(me),
             me.id,
             receiver.id,
-            trans_amt
+            trans_amt,
+            sim.transaction_fee(me)
         )
 
-        sim.trans_id += 1
-        me.transactions[new_trans.id] = new_trans
+        me.add_transaction(new_trans)
 
-        # Create a next transaction event for this node
-        sim.events.put(TransactionGenerate(
-            me.id,
-            me.id,
-            self.run_at,
-            self.run_at + sim.transaction_delay()
-        ))
+        if sim.tx_store is not None:
+            sim.tx_store.add(new_trans, now)
 
-        # Create next transaction events for neighbours
-        for peer in me.peers:
-            t = sim.latency(me, peer, msg_type="transaction")
+        if sim.metrics is not None:
+            sim.metrics.transaction_made(new_trans, now)
 
-            sim.events.put(TransactionReceive(
-                new_trans,
-                peer.id,
-                me.id,
-                self.run_at,
-                self.run_at + t
-            ))
+        # Create next transaction events for neighbours
+        relay(sim, me, me.peers, TransactionReceive, new_trans, now, "transaction")
 
 
 class TransactionReceive(Event):
 
+    __slots__ = ("transaction",)
+
     def __init__(self, transaction, node_id, creator_id, created_at, run_at):
-        super(TransactionReceive, self).__init__(
-            node_id, creator_id, created_at, run_at
-        )
+        # Set directly rather than through Event.__init__: this is the most
+        # frequently created event
+        self.node_id = node_id
+        self.creator_id = creator_id
+        self.created_at = created_at
+        self.run_at = run_at
 
         # The transaction that was received
         self.transaction = transaction
@@ -101,101 +146,102 @@ class TransactionReceive(Event):
         return "T Rcv: on=%d | %s" % (self.node_id, repr(self.transaction))
 
     def run(self, sim):
+        return self.receive(sim, self.transaction, self.node_id, self.run_at)
+
+    @staticmethod
+    def has(me, tx):
+        return tx.id in me.transactions
+
+    @staticmethod
+    def receive(sim, tx, node_id, now, sender_id=None):
         # The node that this event is running on
-        me = sim.nodes[self.node_id]
-        tx = self.transaction
+        me = sim.nodes[node_id]
 
         # Check if this node has already seen this transaction before
         if tx.id in me.transactions:
             return
 
-        # If not, then add it to it's list
-        me.transactions[tx.id] = tx
+        # If not, then add it to it's list (and mempool)
+        me.add_transaction(tx)
 
         # And generate TransactionReceive events for all its neighbours
-        for peer in me.peers:
-
-            t = sim.latency(me, peer, msg_type="transaction")
-            sim.events.put(TransactionReceive(
-                tx,
-                peer.id,
-                me.id,
-                self.run_at,
-                self.run_at + t
-            ))
+        relay(sim, me, me.peers, TransactionReceive, tx, now, "transaction")
 
 
 class BlockGenerate(Event):
 
-    def __init__(self, node_id, creator_id, created_at, run_at):
-        super(BlockGenerate, self).__init__(
-            node_id, creator_id, created_at, run_at
-        )
+    __slots__ = ("epoch",)
+
+    def __init__(self, node_id, creator_id, created_at, run_at, epoch=0):
+        self.node_id = node_id
+        self.creator_id = creator_id
+        self.created_at = created_at
+        self.run_at = run_at
+
+        # Mining epoch of the node when this event was scheduled
+        self.epoch = epoch
 
     def __repr__(self):
         return "B Gen: on=%d" % self.node_id
 
+    def stale(self, sim):
+        """Has the node restarted mining since this event was scheduled?"""
+        return self.epoch != sim.nodes[self.node_id].epoch
+
     def run(self, sim):
         # Hi, this is me!
         me = sim.nodes[self.node_id]
 
-        for x in me.receivedStamps:
-            if x > self.run_at:
-                return
+        # Cancelled by a newer BlockGenerate (see Simulator.restart_mining)
+        if self.epoch != me.epoch:
+            sim.stale_events -= 1
+            return
 
-        # Traverse the longest chain and find all transactions that've been spent
-        longest_chain = me.longest_chain()
-        longest_blk = longest_chain[0]
+        me.mining = False
 
-        spent = set()
+        return self.mine(sim, self.node_id, self.run_at)
 
-        for bk in longest_chain:
-            # https://stackoverflow.com/a/7692347/2043048
-            spent |= set(bk.transactions.values())
+    @staticmethod
+    def mine(sim, node_id, now):
+        me = sim.nodes[node_id]
 
-        # Unspent = Seen - Spent
-        unspent_txns = set(me.transactions.values()) - spent
-        unspent_txns = {t.id: t for t in unspent_txns}
+        # The mempool holds exactly the seen transactions that aren't spent
+        # in the longest chain
+        longest_blk = me.tip
 
         # Only create a block if I have transactions to send
-        if not unspent_txns:
+        if not me.mempool:
             return
 
-        # Generate a new block
-        new_blk = Block(sim.block_id, self.run_at,
-                        me.id, longest_blk.id, len(longest_blk))
-        new_blk.transactions.update(unspent_txns)
-
-        sim.block_id += 1
+        # Generate a new block, filled up with the best transactions that fit
+        new_blk = Block(sim.new_block_id(me), now,
+                        me.id, longest_blk.id, len(longest_blk) + 1,
+                        me.mempool.select(sim.block_txns))
 
         # Add the block to my chain
-        me.blocks[new_blk.id] = new_blk
+        me.add_block(new_blk, now)
+
+        if sim.metrics is not None:
+            sim.metrics.block_mined(new_blk, now)
+            sim.metrics.block_added(new_blk, now)
 
         # And give me that sweet sweet mining reward!
         me.coins += 50
 
         # Generate BlockReceive events for all my peers
-        for peer in me.peers:
-
-            # Except who created the thing!
-            if peer.id != new_blk.creator_id:
-                t = sim.latency(me, peer, msg_type="block")
-
-                sim.events.put(BlockReceive(
-                    new_blk,
-                    peer.id,
-                    me.id,
-                    self.run_at,
-                    self.run_at + t
-                ))
+        # (I created the thing, so I'm not one of them!)
+        relay(sim, me, me.peers, BlockReceive, new_blk, now, "block", new_blk.size())
 
 
 class BlockReceive(Event):
 
+    __slots__ = ("block",)
+
     def __init__(self, block, node_id, creator_id, created_at, run_at):
-        super(BlockReceive, self).__init__(
-            node_id, creator_id, created_at, run_at
-        )
+        self.node_id = node_id
+        self.creator_id = creator_id
+        self.created_at = created_at
+        self.run_at = run_at
 
         # The block we've received
         self.block = block
@@ -204,54 +250,269 @@ class BlockReceive(Event):
         return "B Rcv: on=%d | %s" % (self.node_id, repr(self.block))
 
     def run(self, sim):
+        return self.receive(sim, self.block, self.node_id, self.run_at)
+
+    @staticmethod
+    def has(me, block):
+        return block.id in me.blocks or block.id in me.orphans
+
+    @staticmethod
+    def receive(sim, block, node_id, now, sender_id=None):
         # The node that this event is running on
-        me = sim.nodes[self.node_id]
+        me = sim.nodes[node_id]
 
         # Check if this node has already seen this block before
-        if self.block.id in me.blocks:
+        if block.id in me.blocks or block.id in me.orphans:
             return
 
-        # Find previous block to the one that we've just received
-        prev_blk = me.blocks.get(self.block.prev_block_id)
-        if prev_blk is None:
+        # Without its parent, keep the block until the parent arrives
+        if block.prev_block_id not in me.blocks:
+            sim.orphan_stats["orphaned"] += 1
+
+            if me.orphans.add(block) is not None:
+                sim.orphan_stats["evicted"] += 1
+
             return
 
+        BlockReceive.connect(sim, me, block, now)
+
+        # Blocks waiting for this one (and for those, in turn) can be added
+        # now, in a single cascade
+        waiting = me.orphans.pop_children(block.id)
+
+        while waiting:
+            child = waiting.pop()
+            sim.orphan_stats["connected"] += 1
+
+            BlockReceive.connect(sim, me, child, now)
+            waiting.extend(me.orphans.pop_children(child.id))
+
+        # Create a new block generation event for me, replacing any pending one
+        # (with global arrivals, the BlockClock takes care of this)
+        if sim.arrivals == "per-node":
+            sim.restart_mining(me, now)
+
+    @staticmethod
+    def connect(sim, me, block, now):
+        """Add a block whose parent me already has, and pass it on."""
+
         # Add transactions in this block to my list of seen ones
-        me.transactions.update(self.block.transactions)
-
-        # Make a copy of the block to increase the length
-        new_blk = Block(
-            self.block.id,
-            self.block.created_at,
-            self.block.creator_id,
-            prev_blk.id,
-            len(self.block) + 1
-        )
+        for tx in block.transactions:
+            if tx.id not in me.transactions:
+                me.add_transaction(tx)
 
-        # Add the block to my chain
-        me.blocks[new_blk.id] = new_blk
-        me.receivedStamps.append(new_blk.created_at)
+        # Add the (shared) block to my chain
+        me.add_block(block, now)
+
+        if sim.metrics is not None:
+            sim.metrics.block_added(block, now)
 
         # Generate BlockReceive events for all my peers
-        for peer in me.peers:
+        # Except for who created it
+        peers = [peer for peer in me.peers if peer.id != block.creator_id]
+        relay(sim, me, peers, BlockReceive, block, now, "block", block.size())
 
-            # Except for who created it
-            if peer.id != self.block.creator_id:
 
-                t = sim.latency(me, peer, msg_type="block")
+class Multicast(Event):
+    """
+    A message sent to many peers, kept in the queue as a single event.
 
-                sim.events.put(BlockReceive(
-                    self.block,
-                    peer.id,
-                    me.id,
-                    self.run_at,
-                    self.run_at + t
-                ))
+    Holds the arrival times (sorted) and ids of all the receiving peers.
+    node_id & run_at always refer to the next delivery: every time this
+    event reaches the front of the queue, it delivers the message to one
+    peer, then goes back into the queue for the next one.
+    """
 
-        # Create a new block generation event for me
-        sim.events.put(BlockGenerate(
-            me.id,
-            me.id,
-            self.run_at,
-            self.run_at + sim.block_delay()
+    __slots__ = ("kind", "payload", "arrivals", "pos")
+
+    def __init__(self, kind, payload, creator_id, created_at, arrivals):
+        run_at, node_id = arrivals[0]
+
+        self.node_id = node_id
+        self.creator_id = creator_id
+        self.created_at = created_at
+        self.run_at = run_at
+
+        # Event type that handles each delivery, and the message itself
+        self.kind = kind
+        self.payload = payload
+
+        # (arrival time, peer id) of each delivery, earliest first
+        self.arrivals = arrivals
+        self.pos = 0
+
+    @property
+    def label(self):
+        return self.kind.label
+
+    def __repr__(self):
+        ev = self.kind(self.payload, self.node_id, self.creator_id,
+                       self.created_at, self.run_at)
+
+        return "%r (%d/%d)" % (ev, self.pos + 1, len(self.arrivals))
+
+    def run(self, sim):
+        result = self.kind.receive(sim, self.payload, self.node_id, self.run_at,
+                                   self.creator_id)
+
+        self.pos += 1
+
+        if self.pos < len(self.arrivals):
+            self.run_at, self.node_id = self.arrivals[self.pos]
+            sim.events.put(self)
+
+        return result
+
+
+class Inv(Event):
+    """
+    Announcement of a transaction or block by its id.
+
+    If the node doesn't have the item yet (and hasn't asked anyone else for
+    it), it replies with a GetData; the announcer then sends the payload in
+    a Data event. Otherwise the announcement is all that was sent, where
+    flooding would have sent the whole payload.
+
+    The payload of Inv, GetData & Data is (kind, item, msg_type, size),
+    where kind is the event type that handles the item once it arrives.
+    """
+
+    __slots__ = ("payload",)
+
+    def __init__(self, payload, node_id, creator_id, created_at, run_at):
+        self.node_id = node_id
+        self.creator_id = creator_id
+        self.created_at = created_at
+        self.run_at = run_at
+
+        self.payload = payload
+
+    def __repr__(self):
+        r = (self.label, self.node_id, self.creator_id, self.payload[0].label,
+             self.payload[1].id)
+        return "%s: on=%d, from=%d | %s %d" % r
+
+    def run(self, sim):
+        return self.receive(sim, self.payload, self.node_id, self.run_at,
+                            self.creator_id)
+
+    @staticmethod
+    def receive(sim, payload, node_id, now, sender_id):
+        me = sim.nodes[node_id]
+        kind, item, msg_type, size = payload
+
+        stats = sim.relay_stats
+
+        # Flooding would've sent the payload instead of this announcement
+        stats["flood_messages"] += 1
+        stats["flood_bytes"] += size
+        stats["messages"] += 1
+        stats["bytes"] += INV_SIZE
+
+        key = (kind.label, item.id)
+
+        if kind.has(me, item) or key in me.requested:
+            return
+
+        me.requested.add(key)
+
+        sender = sim.nodes[sender_id]
+        t = sim.latency(me, sender, "inv", INV_SIZE)
+
+        sim.events.put(GetData(payload, sender_id, me.id, now, now + t))
+
+
+class GetData(Inv):
+    """Request for an announced item, sent back to the announcer."""
+
+    __slots__ = ()
+
+    @staticmethod
+    def receive(sim, payload, node_id, now, sender_id):
+        me = sim.nodes[node_id]
+        kind, item, msg_type, size = payload
+
+        sim.relay_stats["messages"] += 1
+        sim.relay_stats["bytes"] += INV_SIZE
+
+        requester = sim.nodes[sender_id]
+        t = sim.latency(me, requester, msg_type, size)
+
+        sim.events.put(Data(payload, sender_id, me.id, now, now + t))
+
+
+class Data(Inv):
+    """The payload of a requested item."""
+
+    __slots__ = ()
+
+    @staticmethod
+    def receive(sim, payload, node_id, now, sender_id):
+        me = sim.nodes[node_id]
+        kind, item, msg_type, size = payload
+
+        sim.relay_stats["messages"] += 1
+        sim.relay_stats["bytes"] += size
+
+        # Whatever happens to it, the item isn't outstanding anymore
+        me.requested.discard((kind.label, item.id))
+
+        return kind.receive(sim, item, node_id, now, sender_id)
+
+
+class TransactionClock(Event):
+    """
+    Single Poisson process generating the transactions of all nodes.
+
+    The superposition of independent Poisson processes is a Poisson process
+    with the sum of their rates. So instead of one TransactionGenerate per
+    node, this one event fires at the total rate, and picks the node that
+    generates the transaction with probability proportional to its rate.
+    node_id is -1, as the clock doesn't belong to any node.
+    """
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return "T Clk"
+
+    def run(self, sim):
+        node_id = sim.pick_node(sim.tx_rate_cum, "transactions")
+
+        TransactionGenerate.generate(sim, node_id, self.run_at)
+
+        sim.events.put(TransactionClock(
+            -1, -1, self.run_at, self.run_at + sim.transaction_delay()
         ))
+
+
+class BlockClock(Event):
+    """
+    Single Poisson process mining the blocks of all nodes.
+
+    Nodes are picked in proportion to their hashing power. As the process
+    is memoryless, a node doesn't need to restart mining when it hears of a
+    new block, so there's no pending event per node to throw away.
+    """
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return "B Clk"
+
+    def run(self, sim):
+        node_id = sim.pick_node(sim.hash_power_cum, "mining")
+
+        result = BlockGenerate.mine(sim, node_id, self.run_at)
+
+        sim.events.put(BlockClock(
+            -1, -1, self.run_at, self.run_at + sim.block_delay()
+        ))
+
+        return result
+
+
+# Name used to count events of each kind, multicasts count as their deliveries
+for _kind in (TransactionGenerate, TransactionReceive, BlockGenerate, BlockReceive,
+              Inv, GetData, Data, TransactionClock, BlockClock):
+    _kind.label = _kind.__name__
@@ -0,0 +1,218 @@
+"""
+Export of the blockchains of all nodes, in one file and a single pass.
+
+Blocks are shared by all the nodes, so instead of a tree per node, the
+union of their trees is written once, as JSON lines. The first line is a
+header with the nodes (whether they're fast, and their tips), then every
+block follows, parents before children:
+
+    {"id": 7, "prev": 3, "creator": 2, "created_at": 12.5, "height": 2,
+     "txns": 14, "seen": [0, 1, 2], "arrived": [12.61, 12.58, 12.5],
+     "main": [0, 2]}
+
+seen lists the nodes that have the block (with the times it arrived at
+each of them in arrived), and main those that have it in their longest
+chain. Blocks still waiting for their parent (orphans) aren't included.
+
+The .dot graphs of chosen nodes can be drawn from an export later on:
+
+For eg: python3 export.py output/chains.jsonl --nodes 0 3 --pruned --png
+"""
+
+import os
+import json
+import argparse
+
+# Version of the export format, bumped whenever it changes
+FORMAT = 1
+
+
+def chains(sim):
+    """Return the header of an export of sim, and its blocks, parents first."""
+
+    blocks, seen, arrived = {}, {}, {}
+
+    for node in sim.nodes:
+        for block_id, at in node.arrived_at.items():
+
+            if block_id not in blocks:
+                blocks[block_id] = node.blocks[block_id]
+                seen[block_id] = []
+                arrived[block_id] = []
+
+            seen[block_id].append(node.id)
+            arrived[block_id].append(at)
+
+    # Nodes on the same tip share their longest chain: walk it once for all
+    on_tip = {}
+    for node in sim.nodes:
+        on_tip.setdefault(node.tip.id, []).append(node.id)
+
+    main = dict((block_id, []) for block_id in blocks)
+    for tip_id, ids in on_tip.items():
+        block_id = tip_id
+
+        while block_id != -1:
+            main[block_id].extend(ids)
+            block_id = blocks[block_id].prev_block_id
+
+    header = {
+        "format": FORMAT,
+        "n": len(sim.nodes),
+        "time": sim.curr_time,
+        "fast": [node.is_fast for node in sim.nodes],
+        "tips": [node.tip.id for node in sim.nodes],
+    }
+
+    records = []
+    for block in sorted(blocks.values(), key=lambda b: (b.chain_len, b.id)):
+        records.append({
+            "id": block.id,
+            "prev": block.prev_block_id,
+            "creator": block.creator_id,
+            "created_at": block.created_at,
+            "height": block.chain_len,
+            "txns": len(block.transactions),
+            "seen": seen[block.id],
+            "arrived": arrived[block.id],
+            "main": sorted(main[block.id]),
+        })
+
+    return header, records
+
+
+def write(sim, path):
+    """Export the blockchains of all the nodes of sim to path."""
+
+    header, records = chains(sim)
+
+    with open(path, "w") as fh:
+        fh.write(json.dumps(header) + "\n")
+
+        for rec in records:
+            fh.write(json.dumps(rec) + "\n")
+
+    return len(records)
+
+
+def read(path):
+    """Return the header of an export, and an iterator over its blocks."""
+
+    fh = open(path)
+
+    try:
+        header = json.loads(fh.readline())
+    except ValueError:
+        header = None
+
+    if not isinstance(header, dict) or header.get("format") != FORMAT:
+        fh.close()
+        raise ValueError("%s is not an export of format %d" % (path, FORMAT))
+
+    def records():
+        with fh:
+            for line in fh:
+                yield json.loads(line)
+
+    return header, records()
+
+
+def dot_name(node_id, is_fast, pruned=False):
+    """Return the name of the .dot file of a node's blockchain."""
+
+    node_type = "fast" if is_fast else "slow"
+    prune = "_pruned" if pruned else ""
+
+    return "%d_%s%s.dot" % (node_id, node_type, prune)
+
+
+def write_dot(path, edges):
+    """
+    Save a blockchain tree, given by its (parent id, block id) edges, to a
+    .dot file.
+
+    Outputs are graphs in graphviz format:
+    https://en.wikipedia.org/wiki/DOT_(graph_description_language)
+    """
+
+    with open(path, "w+") as fh:
+
+        # Graphviz header format
+        fh.write("digraph G { \n")
+        fh.write('rankdir="LR";\n\n')
+
+        # Draw edges of the blockchain tree
+        for prev_id, block_id in edges:
+            fh.write("\t%d -> %d\n" % (prev_id, block_id))
+
+        # Close the graph
+        fh.write("\n}")
+
+
+def dot_from_export(path, node_ids, out_dir, pruned=False):
+    """
+    Draw the blockchains of the given nodes, from the export in path, into
+    .dot files in out_dir. Returns the paths of the files.
+    """
+
+    header, records = read(path)
+
+    wanted = set(node_ids)
+    unknown = [i for i in wanted if not 0 <= i < header["n"]]
+
+    if unknown:
+        raise ValueError("no such nodes: %s" % ", ".join(map(str, sorted(unknown))))
+
+    # Edges of every wanted node's tree, in a single pass over the blocks
+    edges = dict((i, []) for i in wanted)
+
+    for rec in records:
+        if rec["prev"] == -1:
+            continue
+
+        for i in wanted.intersection(rec["main"] if pruned else rec["seen"]):
+            edges[i].append((rec["prev"], rec["id"]))
+
+    paths = []
+    for i in sorted(wanted):
+        out = os.path.join(out_dir, dot_name(i, header["fast"][i], pruned))
+        write_dot(out, edges[i])
+        paths.append(out)
+
+    return paths
+
+
+P = argparse.ArgumentParser(
+    description='Draw the blockchains of chosen nodes from an export.',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+
+P.add_argument('path', help='Export written by a run (see run.py --export)')
+
+P.add_argument('--nodes', type=int, nargs="+", required=True,
+               help='Nodes to draw the blockchain of')
+
+P.add_argument('--pruned', action="store_true",
+               help='Only draw their longest chains')
+
+P.add_argument('--out', default="output",
+               help='Directory to write the .dot files to')
+
+P.add_argument('--png', action="store_true",
+               help='Also render them to .png images (needs graphviz)')
+
+
+if __name__ == '__main__':
+
+    args = P.parse_args()
+
+    try:
+        paths = dot_from_export(args.path, args.nodes, args.out, args.pruned)
+    except ValueError as e:
+        P.error(str(e))
+
+    for fn in paths:
+        print(fn)
+
+        if args.png:
+            os.system("dot -Tpng %s -o %s" % (fn, fn[:-4] + ".png"))
@@ -0,0 +1,180 @@
+"""
+Optional instrumentation of a run: where the time goes, by kind of event.
+
+Passed to Simulator.run, an Instruments times every event's run() and
+counts, for each kind of event:
+
+    - the events run (each one popped off the queue once) and the events
+      they pushed onto it
+    - the events that were discarded without doing anything: blocks &
+      transactions the node had already seen, and stale BlockGenerate
+      events (see Simulator.restart_mining)
+
+and overall, the current and peak depth of the queue, and the calls to
+Simulator.latency. A summary can be printed every so many events, and
+everything is available as a JSON report.
+
+Without instruments, run() only pays for one check per event.
+"""
+
+import json
+import time
+
+from collections import Counter
+
+import events as EV
+
+
+def _seen_inv(ev, sim):
+    me = sim.nodes[ev.node_id]
+    kind, item = ev.payload[0], ev.payload[1]
+
+    return kind.has(me, item) or (kind.label, item.id) in me.requested
+
+
+# Whether an event will be discarded when it runs, by the type of event
+DISCARDED = {
+    EV.TransactionReceive: lambda ev, sim: EV.TransactionReceive.has(
+        sim.nodes[ev.node_id], ev.transaction),
+    EV.BlockReceive: lambda ev, sim: EV.BlockReceive.has(sim.nodes[ev.node_id], ev.block),
+
+    # Judged as the delivery it's about to make
+    EV.Multicast: lambda ev, sim: discarded(ev.kind(
+        ev.payload, ev.node_id, ev.creator_id, ev.created_at, ev.run_at), sim),
+
+    EV.BlockGenerate: lambda ev, sim: ev.stale(sim),
+    EV.Inv: _seen_inv,
+    EV.Data: lambda ev, sim: ev.payload[0].has(sim.nodes[ev.node_id], ev.payload[1]),
+}
+
+
+def discarded(ev, sim):
+    """Check whether an event will do nothing when it runs (before it does)."""
+
+    seen = DISCARDED.get(type(ev))
+    return seen is not None and seen(ev, sim)
+
+
+class Instruments(object):
+    """
+    Measurements of the events run by Simulator.run(instruments=...).
+
+    report_every -- print a summary every this many events (None for never)
+    """
+
+    def __init__(self, report_every=None):
+        self.report_every = report_every
+
+        # By event label: events run, time spent running them (ns), events
+        # they pushed onto the queue, and those discarded
+        self.runs = Counter()
+        self.time_ns = Counter()
+        self.pushes = Counter()
+        self.discarded = Counter()
+
+        # Depth of the queue after the last event, and its highest
+        self.depth = 0
+        self.peak_depth = 0
+
+        # Calls to Simulator.latency
+        self.latency_calls = 0
+
+        self.events = 0
+
+    def attach(self, sim):
+        """Start counting calls to sim.latency."""
+
+        latency = sim.latency
+
+        def counted(*args, **kwargs):
+            self.latency_calls += 1
+            return latency(*args, **kwargs)
+
+        # Shadows the method for this simulator only, see detach
+        sim.latency = counted
+
+        self.depth = len(sim.events)
+        self.peak_depth = max(self.peak_depth, self.depth)
+
+    def detach(self, sim):
+        del sim.latency
+
+    def run(self, ev, sim):
+        """Run an event (already popped off the queue), measuring it."""
+
+        label = ev.label
+
+        if discarded(ev, sim):
+            self.discarded[label] += 1
+
+        queue = sim.events
+        before, compacted = len(queue), sim.compacted
+
+        started = time.perf_counter_ns()
+        ev.run(sim)
+        self.time_ns[label] += time.perf_counter_ns() - started
+
+        depth = self.depth = len(queue)
+        if depth > self.peak_depth:
+            self.peak_depth = depth
+
+        # Whatever left the queue other than through get was compacted away
+        self.pushes[label] += depth - before + sim.compacted - compacted
+        self.runs[label] += 1
+
+        self.events += 1
+        if self.report_every and self.events % self.report_every == 0:
+            self.print_summary()
+
+    def report(self):
+        """Return all the measurements as a dict (of JSON types)."""
+
+        total_ns = sum(self.time_ns.values())
+
+        kinds = {}
+        for label, runs in self.runs.items():
+            ns = self.time_ns[label]
+
+            kinds[label] = {
+                "runs": runs,
+                "time": ns / 1e9,
+                "mean_us": ns / runs / 1e3,
+                "share": ns / total_ns if total_ns else 0.0,
+                "pushes": self.pushes[label],
+                "discarded": self.discarded[label],
+            }
+
+        return {
+            "events": self.events,
+            "time": total_ns / 1e9,
+            "kinds": kinds,
+            "queue": {
+                "pops": self.events,
+                "pushes": sum(self.pushes.values()),
+                "depth": self.depth,
+                "peak_depth": self.peak_depth,
+            },
+            "latency_calls": self.latency_calls,
+            "discarded": sum(self.discarded.values()),
+        }
+
+    def save(self, path):
+        """Write the report to path as JSON."""
+
+        with open(path, "w") as fh:
+            json.dump(self.report(), fh, indent=2, sort_keys=True)
+
+    def print_summary(self):
+        report = self.report()
+
+        print("\n{:<19} | {:>9} | {:>9} | {:>6} | {:>9} | {:>9}".format(
+            "Event", "runs", "mean us", "share", "pushes", "discarded"))
+
+        for label, k in sorted(report["kinds"].items()):
+            print("{:<19} | {:>9} | {:>9.2f} | {:>6.1%} | {:>9} | {:>9}".format(
+                label, k["runs"], k["mean_us"], k["share"], k["pushes"], k["discarded"]))
+
+        queue = report["queue"]
+        print("Queue: %d pushes, %d pops, depth %d (peak %d), latency calls: %d" % (
+            queue["pushes"], queue["pops"], queue["depth"], queue["peak_depth"],
+            report["latency_calls"]))
@@ -0,0 +1,194 @@
+"""
+Latency model for messages sent between two peers.
+
+From the assignment, the latency between nodes i & j is: p_ij + |m|/c_ij + d_ij
+"""
+
+from bisect import bisect_left
+
+import numpy as np
+
+# Size (in bits) of the messages that nodes send each other
+MSG_SIZE = {
+    # for a msg of only 1 transaction: assume that |m| = 0
+    "transaction": 0,
+
+    # for a msg of a block: assume that |m| = 1 MB (8 × 10**6 b)
+    "block": 8 * (10 ** 6),
+
+    # announcements & requests of a single item by its id
+    "inv": 8 * 36,
+}
+
+# Size (in bytes) of an announcement or request for an item
+INV_SIZE = MSG_SIZE["inv"] // 8
+
+# Link capacity c_ij, indexed by the classes (0 = slow, 1 = fast) of both ends.
+# c_ij is set to 100 Mbps if both i and j are fast and 5 Mbps if either is slow
+LINK_CAPACITY = (
+    (5 * (10 ** 6), 5 * (10 ** 6)),
+    (5 * (10 ** 6), 100 * (10 ** 6)),
+)
+
+
+# Propagation delays are drawn uniformly from [PROP_DELAY_MIN, PROP_DELAY_MAX)
+# From assignment:
+# Pij can be chosen from a uniform distribution between 10ms and 500ms
+PROP_DELAY_MIN = 0.010
+PROP_DELAY_MAX = 0.501
+
+MASK64 = (1 << 64) - 1
+
+
+def splitmix64(x):
+    """Scramble a 64 bit integer (Steele et al's SplitMix64 finaliser)."""
+
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+class LatencyEngine(object):
+    """
+    Computes message latencies from node ids.
+
+    Only the links of the peer graph are stored, in CSR form: the peers of
+    node i are indices[indptr[i]:indptr[i + 1]] (sorted), and delays holds
+    the propagation delay of each of those links at the same position.
+
+    A delay is generated the first time its link is used, by hashing the
+    seed with the link's endpoints, so it doesn't matter in which order the
+    links get used. Queuing delays are drawn from the exponential
+    distribution in batches, which are refilled whenever they run out.
+    """
+
+    # Number of queuing delays drawn at a time
+    BATCH = 4096
+
+    def __init__(self, is_fast, peers, seed, rng=None):
+
+        n = len(is_fast)
+
+        # Class of each node, indexed by node id. Kept as bytes too, since
+        # indexing those gives plain ints without any NumPy scalar overhead
+        self.node_class = np.asarray(is_fast, dtype=np.int8)
+        self._class = self.node_class.tobytes()
+
+        # CSR layout of the peer graph, indexed by node ids
+        degree = np.fromiter((len(p) for p in peers), dtype=np.int64, count=n)
+
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(degree, out=self.indptr[1:])
+
+        self.indices = np.fromiter(
+            (j for p in peers for j in sorted(p)), dtype=np.int32,
+            count=int(self.indptr[-1]),
+        )
+
+        # Propagation delay of every link; NaN until the link is first used
+        self.delays = np.full(len(self.indices), np.nan, dtype=np.float32)
+
+        self._views()
+
+        self.n = n
+        self.seed = seed & MASK64
+
+        # Mean of d_ij is set equal to 96kbit/c_ij
+        self.d_mean = tuple(
+            tuple(12 * 8 * (10 ** 3) / c for c in row) for row in LINK_CAPACITY
+        )
+
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        # Pre-sampled draws from an exponential distribution with mean 1
+        self._queuing = []
+        self._pos = 0
+
+    def _views(self):
+        # Memoryviews let the hot path read these without NumPy scalars
+        self._indptr = memoryview(self.indptr)
+        self._indices = memoryview(self.indices)
+        self._delays = memoryview(self.delays)
+
+    def __getstate__(self):
+        # Memoryviews can't be pickled, they're made again from the arrays
+        state = dict(self.__dict__)
+        for name in ("_indptr", "_indices", "_delays"):
+            del state[name]
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views()
+
+    def reseed_queuing(self, rng):
+        """Draw queuing delays from rng from now on."""
+
+        self.rng = rng
+        self._queuing = []
+        self._pos = 0
+
+    def draw_prop_delay(self, i, j):
+        """Return the (deterministic) propagation delay of link i -> j."""
+
+        u = splitmix64(self.seed ^ splitmix64(i * self.n + j)) / 2 ** 64
+        return PROP_DELAY_MIN + (PROP_DELAY_MAX - PROP_DELAY_MIN) * u
+
+    def prop_delay(self, i, j):
+        """Return p_ij, generating and storing it on first use."""
+
+        lo, hi = self._indptr[i], self._indptr[i + 1]
+        k = bisect_left(self._indices, j, lo, hi)
+
+        # Not a link of the peer graph: nothing to store it in
+        if k == hi or self._indices[k] != j:
+            return self.draw_prop_delay(i, j)
+
+        p = self._delays[k]
+
+        # Store it first, so every use sees the same (float32) value
+        if p != p:
+            self._delays[k] = self.draw_prop_delay(i, j)
+            p = self._delays[k]
+
+        return p
+
+    def queuing_sample(self):
+        """Return the next draw from Exp(1), refilling the batch if needed."""
+
+        if self._pos == len(self._queuing):
+            self._queuing = self.rng.standard_exponential(self.BATCH).tolist()
+            self._pos = 0
+
+        d = self._queuing[self._pos]
+        self._pos += 1
+
+        return d
+
+    def latency(self, i, j, m, q=None):
+        """
+        Return latency of an m bit message sent from node i to node j.
+
+        q is a draw from Exp(1) for the queuing delay; by default the next one
+        of the batch is used.
+        """
+
+        # Propagation delays p_ij, fixed for the whole simulation
+        p = self.prop_delay(i, j)
+
+        ci, cj = self._class[i], self._class[j]
+
+        c = LINK_CAPACITY[ci][cj]
+
+        # d_ij is the queuing delay on the path, randomly chosen from an
+        # exponential distribution with the above mean. Scaling an Exp(1)
+        # draw by the mean gives exactly that distribution.
+        if q is None:
+            q = self.queuing_sample()
+
+        d = self.d_mean[ci][cj] * q
+
+        # latency is of the form p_ij + |m|/c_ij + d_ij
+        return (p + m / c + d)
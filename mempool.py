@@ -0,0 +1,101 @@
+"""
+A node's pool of unconfirmed transactions.
+
+Transactions are indexed by a heap on their priority (oldest first or
+highest fee first), so picking the contents of a block of k transactions
+costs O(k log n) no matter how large the backlog grows.
+"""
+
+import heapq
+
+
+def by_age(tx):
+    # Ids are handed out in order of creation
+    return (tx.id,)
+
+
+def by_fee(tx):
+    # Ties are broken by age
+    return (-tx.fee, tx.id)
+
+
+# Priority of a transaction in the mempool, smallest first (functions rather
+# than lambdas, so that pools can be pickled, see checkpoint.py)
+ORDERS = {
+    "age": by_age,
+    "fee": by_fee,
+}
+
+
+class Mempool(object):
+
+    __slots__ = ("txns", "_heap", "_key")
+
+    def __init__(self, order="age"):
+
+        # Transactions in the pool, keyed by their id
+        self.txns = {}
+
+        # Heap of (priority, tx id). Removal is lazy: entries whose tx is no
+        # longer in the pool are skipped (and dropped) when they surface
+        self._heap = []
+
+        self._key = ORDERS[order]
+
+    def __len__(self):
+        return len(self.txns)
+
+    def __contains__(self, tx_id):
+        return tx_id in self.txns
+
+    def __iter__(self):
+        return iter(self.txns)
+
+    def copy(self):
+        """Return an independent copy of the pool (transactions are shared)."""
+
+        pool = Mempool.__new__(Mempool)
+        pool.txns = dict(self.txns)
+        pool._heap = list(self._heap)
+        pool._key = self._key
+
+        return pool
+
+    def add(self, tx):
+        if tx.id in self.txns:
+            return
+
+        self.txns[tx.id] = tx
+        heapq.heappush(self._heap, self._key(tx) + (tx.id,))
+
+    def discard(self, tx_id):
+        if self.txns.pop(tx_id, None) is None:
+            return
+
+        # Rebuild the heap once it's mostly made of removed transactions
+        if len(self._heap) > 2 * len(self.txns) + 64:
+            self._heap = [self._key(tx) + (tx.id,) for tx in self.txns.values()]
+            heapq.heapify(self._heap)
+
+    def select(self, k):
+        """Return (without removing) the k transactions of highest priority."""
+
+        heap = self._heap
+        chosen = []
+        entries = []
+
+        while heap and len(chosen) < k:
+            entry = heapq.heappop(heap)
+            tx = self.txns.get(entry[-1])
+
+            # Removed, or a duplicate entry left over from an earlier removal
+            if tx is None or (entries and entry == entries[-1]):
+                continue
+
+            chosen.append(tx)
+            entries.append(entry)
+
+        for entry in entries:
+            heapq.heappush(heap, entry)
+
+        return chosen
@@ -0,0 +1,116 @@
+"""
+Report how many bytes the simulator's records take per object.
+
+Compares the current (__slots__ / array backed) records with plain classes
+that keep their attributes in a __dict__, like the simulator used to.
+
+Usage: python3 memreport.py [count]
+"""
+
+import sys
+import tracemalloc
+
+from block import Block, Transaction, TransactionStore
+from events import TransactionReceive
+
+
+class DictEvent(object):
+
+    def __init__(self, node_id, creator_id, created_at, run_at):
+        super(DictEvent, self).__init__()
+
+        self.node_id = node_id
+        self.creator_id = creator_id
+        self.created_at = created_at
+        self.run_at = run_at
+
+
+class DictTransactionReceive(DictEvent):
+
+    def __init__(self, transaction, node_id, creator_id, created_at, run_at):
+        super(DictTransactionReceive, self).__init__(
+            node_id, creator_id, created_at, run_at
+        )
+
+        self.transaction = transaction
+
+
+class DictTransaction(object):
+
+    def __init__(self, trans_id, from_id, to_id, coins, fee=0.0):
+        super(DictTransaction, self).__init__()
+
+        self.id = trans_id
+        self.from_id = from_id
+        self.to_id = to_id
+        self.coins = coins
+        self.fee = fee
+
+
+class DictBlock(object):
+
+    def __init__(self, block_id, created_at, creator_id, prev_block_id, chain_len):
+        super(DictBlock, self).__init__()
+
+        self.id = block_id
+        self.created_at = created_at
+        self.creator_id = creator_id
+        self.prev_block_id = prev_block_id
+        self.transactions = {}
+        self.chain_len = chain_len
+
+
+def measure(make, count):
+    """Return the bytes allocated per object by count calls to make(i)."""
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    objs = [make(i) for i in range(count)]
+
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Don't count the list that holds the objects
+    return (after - before - sys.getsizeof(objs)) / count
+
+
+def store_bytes(count):
+    store = TransactionStore()
+
+    for i in range(count):
+        store.add(Transaction(i + 1, 1, 2, 0.5, 0.01), float(i))
+
+    return store.nbytes() / count
+
+
+def main(count):
+    tx = Transaction(1, 1, 2, 0.5)
+
+    rows = [
+        ("Event (TransactionReceive)",
+         measure(lambda i: DictTransactionReceive(tx, 1, 2, 0.1 * i, 0.2 * i), count),
+         measure(lambda i: TransactionReceive(tx, 1, 2, 0.1 * i, 0.2 * i), count)),
+
+        ("Transaction",
+         measure(lambda i: DictTransaction(i, 1, 2, 0.1 * i, 0.01 * i), count),
+         measure(lambda i: Transaction(i, 1, 2, 0.1 * i, 0.01 * i), count)),
+
+        ("Transaction (TransactionStore)",
+         measure(lambda i: DictTransaction(i, 1, 2, 0.1 * i, 0.01 * i), count),
+         store_bytes(count)),
+
+        ("Block (no transactions)",
+         measure(lambda i: DictBlock(i, 0.1 * i, 1, i - 1, i), count),
+         measure(lambda i: Block(i, 0.1 * i, 1, i - 1, i), count)),
+    ]
+
+    print("{:<31} | {:>8} | {:>8}".format("Bytes per object", "before", "after"))
+    print("{:-<31}-+-{:->8}-+-{:->8}".format("", "", ""))
+
+    for name, before, after in rows:
+        print("{:<31} | {:>8.1f} | {:>8.1f}".format(name, before, after))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
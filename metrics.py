@@ -0,0 +1,313 @@
+"""
+Metrics of a run, kept up to date as it goes, and written out periodically.
+
+Passed to Simulator.run, a Metrics follows:
+
+    - how long blocks take to reach 50%, 90% & all of the nodes
+    - the fork rate (share of the heights where competing blocks were
+      mined) and the stale rate (blocks mined that aren't in the longest chain)
+    - how long transactions wait before a block includes them
+    - the share of the blocks each node has that are in its longest chain,
+      and how many nodes agree on the tip
+
+Times are summarised by P2Quantile sketches, which take O(1) memory and
+time per value. Apart from the counts of nodes reached by blocks still
+spreading, and the creation times of transactions still waiting for a
+block, nothing is kept per block or transaction (only a count of blocks
+per height).
+
+Every so often (in simulated time), the metrics are written out as a row
+of a CSV file, or a line of a JSON lines file, by the extension of the path.
+"""
+
+import csv
+import json
+import math
+
+# Shares of the nodes a block has to reach, for its propagation times
+COVERAGE = (0.5, 0.9, 1.0)
+
+# Quantiles estimated for every distribution of times
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class P2Quantile(object):
+    """
+    Streaming estimate of the p-quantile of values, in O(1) memory.
+
+    The P-square algorithm of Jain & Chlamtac (1985): five markers track
+    the minimum, p/2, p, (1 + p)/2 quantiles & the maximum, their heights
+    adjusted with a piecewise parabolic fit as values come in.
+    """
+
+    __slots__ = ("p", "count", "heights", "positions", "desired", "step")
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+
+        # Heights & (actual, desired) positions of the markers
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+
+        # How far the desired positions move with every value
+        self.step = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        self.count += 1
+        q = self.heights
+
+        # The first five values are kept as they are
+        if self.count <= 5:
+            q.append(x)
+            q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n, want = self.positions, self.desired
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            want[i] += self.step[i]
+
+        for i in (1, 2, 3):
+            d = want[i] - n[i]
+
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+
+                # Parabolic fit, or linear if that'd leave the neighbours' range
+                h = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+
+                if not q[i - 1] < h < q[i + 1]:
+                    h = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+
+                q[i] = h
+                n[i] += d
+
+    def value(self):
+        """Return the estimate (exact for up to five values, NaN for none)."""
+
+        if not self.count:
+            return float("nan")
+
+        if self.count <= 5:
+            return self.heights[int(round(self.p * (self.count - 1)))]
+
+        return self.heights[2]
+
+
+class Distribution(object):
+    """Count, mean, maximum & QUANTILES of a stream of values."""
+
+    __slots__ = ("count", "total", "max", "quantiles")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = float("nan")
+        self.quantiles = [P2Quantile(p) for p in QUANTILES]
+
+    def add(self, x):
+        self.count += 1
+        self.total += x
+
+        if not x <= self.max:
+            self.max = x
+
+        for q in self.quantiles:
+            q.add(x)
+
+    def summary(self, prefix):
+        """Return the figures as a flat dict, with keys starting with prefix."""
+
+        row = {
+            prefix + "_count": self.count,
+            prefix + "_mean": self.total / self.count if self.count else float("nan"),
+            prefix + "_max": self.max,
+        }
+
+        for p, q in zip(QUANTILES, self.quantiles):
+            row["%s_p%g" % (prefix, 100 * p)] = q.value()
+
+        return row
+
+
+class Metrics(object):
+    """
+    Metrics of the runs of a Simulator(n, ...), see Simulator.run.
+
+    path  -- file to write rows of metrics to (None for none): CSV if it
+             ends with .csv, JSON lines otherwise
+    every -- simulated time between rows
+    start -- simulated time to start from (say, of a checkpoint)
+
+    Blocks & transactions are followed from when they're made, so pass the
+    same Metrics to every run of a simulator after start. Blocks made
+    before it are left out.
+    """
+
+    def __init__(self, n, path=None, every=100.0, start=0.0):
+        self.n = n
+        self.path = path
+        self.every = every
+        self.start = start
+
+        # Nodes a block has to reach for each share of COVERAGE
+        self.needed = [max(1, int(math.ceil(c * n))) for c in COVERAGE]
+
+        # Nodes reached by each block that hasn't reached all of them yet
+        self.reached = {}
+
+        # Times for blocks to reach each share of the nodes
+        self.propagation = [Distribution() for _ in COVERAGE]
+
+        # Blocks mined, at each height, and the highest height; with the
+        # number of heights more than one block was mined at
+        self.blocks = 0
+        self.at_height = {}
+        self.height = 0
+        self.forks = 0
+
+        # Creation times of the transactions no block has included yet, and
+        # the time they waited for one
+        self.waiting = {}
+        self.confirmation = Distribution()
+
+        # Simulated time of the next row
+        self.next_at = start + every
+
+        # Rows written, and the file they're written to
+        self.rows = 0
+        self._fh = None
+        self._csv = None
+
+    def block_added(self, block, now):
+        """A node (the creator included) added block to its tree at now."""
+
+        if block.created_at < self.start:
+            return
+
+        count = self.reached.get(block.id, 0) + 1
+
+        for need, dist in zip(self.needed, self.propagation):
+            if count == need:
+                dist.add(now - block.created_at)
+
+        if count >= self.n:
+            self.reached.pop(block.id, None)
+        else:
+            self.reached[block.id] = count
+
+    def block_mined(self, block, now):
+        """A node mined block at now."""
+
+        self.blocks += 1
+
+        height = block.chain_len
+        count = self.at_height[height] = self.at_height.get(height, 0) + 1
+
+        if count == 2:
+            self.forks += 1
+        if height > self.height:
+            self.height = height
+
+        waiting = self.waiting
+        for tx in block.transactions:
+            created = waiting.pop(tx.id, None)
+
+            if created is not None:
+                self.confirmation.add(now - created)
+
+    def transaction_made(self, tx, now):
+        self.waiting[tx.id] = now
+
+    def row(self, sim, at):
+        """Return the metrics of sim as of simulated time at, as a flat dict."""
+
+        blocks = self.blocks
+
+        # Blocks each node has (apart from genesis), and tips they're on
+        shares = [
+            node.height / (len(node.blocks) - 1) if len(node.blocks) > 1 else 1.0
+            for node in sim.nodes
+        ]
+
+        tips = {}
+        for node in sim.nodes:
+            tips[node.tip.id] = tips.get(node.tip.id, 0) + 1
+
+        row = {
+            "time": at,
+            "blocks": blocks,
+            "height": self.height,
+            "forks": self.forks,
+            "fork_rate": self.forks / self.height if self.height else 0.0,
+            "stale_rate": (blocks - self.height) / blocks if blocks else 0.0,
+            "chain_share_mean": sum(shares) / len(shares),
+            "chain_share_min": min(shares),
+            "tip_agreement": max(tips.values()) / len(sim.nodes),
+            "spreading": len(self.reached),
+            "unconfirmed": len(self.waiting),
+        }
+
+        for c, dist in zip(COVERAGE, self.propagation):
+            row.update(dist.summary("prop%g" % (100 * c)))
+
+        row.update(self.confirmation.summary("confirm"))
+
+        return row
+
+    def tick(self, sim, now):
+        """Write the rows due by now (the time of the next event)."""
+
+        while now >= self.next_at:
+            self.emit(sim, self.next_at)
+            self.next_at += self.every
+
+    def emit(self, sim, at):
+        """Write a row of the metrics as of simulated time at, return it."""
+
+        row = self.row(sim, at)
+
+        if self.path is None:
+            return row
+
+        if self._fh is None:
+            self._fh = open(self.path, "w", newline="")
+
+            if self.path.endswith(".csv"):
+                self._csv = csv.DictWriter(self._fh, sorted(row))
+                self._csv.writeheader()
+
+        if self._csv is not None:
+            self._csv.writerow(row)
+        else:
+            self._fh.write(json.dumps(row, sort_keys=True) + "\n")
+
+        self._fh.flush()
+        self.rows += 1
+
+        return row
+
+    def close(self):
+        """Close the file of rows (a later row opens it again, from scratch)."""
+
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = self._csv = None
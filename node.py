@@ -1,64 +1,210 @@
 
 from block import Block
+from mempool import Mempool
+from orphans import OrphanPool
+
+# Every node begins with the same genesis block
+GENESIS = Block(block_id=0, created_at=0.0, creator_id=-1,
+                prev_block_id=-1, chain_len=0)
 
 
 class Node(object):
 
-    def __init__(self, node_id, initial_coins, is_fast):
+    __slots__ = (
+        "id", "coins", "is_fast", "epoch", "mining", "peers", "blocks",
+        "arrived_at", "tip", "transactions", "mempool", "confirmed", "requested",
+        "orphans", "hash_power", "tx_rate", "made",
+    )
+
+    def __init__(self, node_id, initial_coins, is_fast, mempool_order="age",
+                 orphan_limit=100, orphan_eviction="oldest", orphan_rng=None):
         self.id = node_id
         self.coins = initial_coins
         self.is_fast = is_fast
-        self.receivedStamps = []
+
+        # Bumped whenever this node restarts mining, which cancels any
+        # BlockGenerate event scheduled with an older epoch
+        self.epoch = 0
+
+        # Whether a (current epoch) BlockGenerate event is pending
+        self.mining = False
+
+        # Number of blocks & transactions this node has created
+        self.made = 0
+
+        # Relative weights of this node's mining & transaction rates
+        self.hash_power = 1.0
+        self.tx_rate = 1.0
 
         # List of this node's neighbours
         self.peers = []
 
         # Dict of all blocks this node has seen
         # (can be thought of as a tree using prev_block attribute of a block)
-        self.blocks = {
+        # The blocks themselves are shared between all nodes.
+        self.blocks = {}
 
-            # Each node begins with a genesis block
-            0: Block(block_id=0, created_at=0.0, creator_id=self.id,
-                     prev_block_id=-1, chain_len=0)
+        # Time at which each block (by id) reached this node
+        self.arrived_at = {}
 
-        }
+        # Block at the end of the longest chain, kept up to date by add_block
+        self.tip = None
 
         # Dict of transactions this node has seen
         self.transactions = {}
 
+        # Seen transactions that aren't in the longest chain
+        self.mempool = Mempool(mempool_order)
+
+        # Ids of the transactions that are in the longest chain
+        self.confirmed = set()
+
+        # (event label, id) of items requested from a peer but not yet received
+        self.requested = set()
+
+        # Blocks that arrived before their parent did
+        self.orphans = OrphanPool(orphan_limit, orphan_eviction, orphan_rng)
+
+        # Each node begins with the genesis block
+        self.add_block(GENESIS, 0.0)
+
     def __repr__(self):
         r = (self.id, self.coins, ("fast" if self.is_fast else "slow"))
         return "<Node %d:, coins=%d, %s>" % r
 
-    def longest_chain(self):
+    @property
+    def height(self):
+        """Return the length of the longest chain."""
+        return len(self.tip)
+
+    def save(self):
         """
-        Return the blocks of the longest chain.
+        Return a copy of everything about this node that events can change,
+        for restore. Blocks & transactions themselves are immutable, so
+        they're shared rather than copied.
         """
 
-        chain = []
+        return self._copy_state((
+            self.coins, self.epoch, self.mining, self.made, self.blocks,
+            self.arrived_at, self.tip, self.transactions, self.mempool,
+            self.confirmed, self.requested, self.orphans,
+        ))
+
+    def restore(self, saved):
+        """Go back to a state returned by save (which can be reused)."""
+
+        (self.coins, self.epoch, self.mining, self.made, self.blocks,
+         self.arrived_at, self.tip, self.transactions, self.mempool,
+         self.confirmed, self.requested, self.orphans) = self._copy_state(saved)
+
+    def __getstate__(self):
+        # Peers are pickled by id: following them as objects would recurse
+        # through the whole peer graph. Simulator.__setstate__ links them again
+        state = dict((name, getattr(self, name)) for name in self.__slots__)
+        state["peers"] = [peer.id for peer in self.peers]
 
-        # Alternative way? https://stackoverflow.com/a/4233482/2043048
-        # by_time = sorted(me.blocks.values(), key=lambda b: b.created_at)
-        # longest_blk = sorted(by_time, key=lambda b: b.chain_len)
+        return state
 
-        # Start with the genesis block
-        longest_bk = self.blocks[0]
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
-        # Find the block ending with the longest chain
-        for bk in self.blocks.values():
+    @staticmethod
+    def _copy_state(state):
+        (coins, epoch, mining, made, blocks, arrived_at, tip, transactions,
+         mempool, confirmed, requested, orphans) = state
 
-            # Use block creation time to break ties in case of equal length
-            if ((len(bk) > len(longest_bk)) or ((len(bk) == len(longest_bk)) and
-                                                (bk.created_at < longest_bk.created_at))):
-                longest_bk = bk
+        return (
+            coins, epoch, mining, made, dict(blocks), dict(arrived_at), tip,
+            dict(transactions), mempool.copy(), set(confirmed), set(requested),
+            orphans.copy(),
+        )
 
-        # Now find all the blocks in this chain
-        bk = longest_bk
+    def add_transaction(self, tx):
+        """
+        Remember a transaction, it's unconfirmed unless in the longest chain.
+
+        The receiver of a transaction is paid when it first learns of it.
+        """
+
+        self.transactions[tx.id] = tx
+
+        if tx.to_id == self.id:
+            self.coins += tx.coins
+
+        if tx.id not in self.confirmed:
+            self.mempool.add(tx)
+
+    def add_block(self, bk, at=0.0):
+        """
+        Add a block that reached this node at time at to the tree, moving the
+        tip if it makes a longer chain.
+        """
+
+        self.blocks[bk.id] = bk
+        self.arrived_at[bk.id] = at
+
+        tip = self.tip
+
+        # Use block creation time to break ties in case of equal length
+        if (tip is None or (len(bk) > len(tip)) or
+                ((len(bk) == len(tip)) and (bk.created_at < tip.created_at))):
+            self.switch_tip(bk)
+
+    def switch_tip(self, new_tip):
+        """
+        Move the tip, updating the mempool for just the blocks that changed.
+
+        Blocks from the old tip back to the fork point are undone (their
+        transactions go back to the mempool), then blocks from the fork
+        point up to the new tip are applied.
+        """
+
+        old, new = self.tip, new_tip
+        self.tip = new_tip
+
+        undo, apply = [], []
+
+        if old is not None:
+
+            while len(old) > len(new):
+                undo.append(old)
+                old = self.blocks[old.prev_block_id]
+
+            while len(new) > len(old):
+                apply.append(new)
+                new = self.blocks[new.prev_block_id]
+
+            while old.id != new.id:
+                undo.append(old)
+                apply.append(new)
+                old = self.blocks[old.prev_block_id]
+                new = self.blocks[new.prev_block_id]
+
+        else:
+            apply.append(new)
+
+        for bk in undo:
+            for tx in bk.transactions:
+                self.confirmed.discard(tx.id)
+                self.mempool.add(tx)
+
+        for bk in reversed(apply):
+            for tx in bk.transactions:
+                self.confirmed.add(tx.id)
+                self.mempool.discard(tx.id)
+
+    def ancestors(self, bk=None):
+        """
+        Lazily walk back from a block (the tip by default) to genesis.
+        """
+
+        bk = self.tip if bk is None else bk
 
         # Do-While Loop!
         while True:
 
-            chain.append(bk)
+            yield bk
 
             # Chain ends at Genesis block which have id 0
             if bk.id == 0:
@@ -67,4 +213,9 @@ class Node(object):
             # Move backwards
             bk = self.blocks[bk.prev_block_id]
 
-        return chain
+    def longest_chain(self):
+        """
+        Return the blocks of the longest chain.
+        """
+
+        return list(self.ancestors())
@@ -0,0 +1,98 @@
+"""
+A node's pool of orphan blocks: blocks that arrived before their parent.
+
+Orphans are indexed by the id of the parent they're waiting for, so when a
+block is added to the tree, all the blocks waiting on it are found in O(1).
+The pool is bounded; once full, adding an orphan evicts another one.
+"""
+
+import random
+
+# Which orphan is thrown away when the pool is full
+EVICTIONS = ("oldest", "random")
+
+
+class OrphanPool(object):
+
+    __slots__ = ("limit", "eviction", "rng", "waiting", "blocks")
+
+    def __init__(self, limit=100, eviction="oldest", rng=None):
+
+        # Maximum number of orphans kept
+        self.limit = limit
+
+        # One of EVICTIONS, and the source of randomness for "random"
+        self.eviction = eviction
+        self.rng = rng if rng is not None else random
+
+        # Orphan blocks waiting for each missing parent, by the parent's id
+        self.waiting = {}
+
+        # All orphans by their id, in order of arrival
+        self.blocks = {}
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __contains__(self, block_id):
+        return block_id in self.blocks
+
+    def copy(self):
+        """Return an independent copy of the pool (blocks are shared)."""
+
+        pool = OrphanPool(self.limit, self.eviction, self.rng)
+        pool.waiting = dict((k, list(v)) for k, v in self.waiting.items())
+        pool.blocks = dict(self.blocks)
+
+        return pool
+
+    def add(self, block):
+        """
+        Keep a block until its parent arrives.
+
+        Returns the orphan that was evicted to make room, if any (with a
+        limit of 0, that's the block itself).
+        """
+
+        if block.id in self.blocks:
+            return None
+
+        if self.limit <= 0:
+            return block
+
+        evicted = None
+
+        if len(self.blocks) >= self.limit:
+            if self.eviction == "random":
+                victim = self.rng.choice(list(self.blocks))
+            else:
+                victim = next(iter(self.blocks))
+
+            evicted = self.remove(victim)
+
+        self.blocks[block.id] = block
+        self.waiting.setdefault(block.prev_block_id, []).append(block)
+
+        return evicted
+
+    def remove(self, block_id):
+        """Remove an orphan by its id, and return it."""
+
+        block = self.blocks.pop(block_id)
+        children = self.waiting[block.prev_block_id]
+
+        children.remove(block)
+        if not children:
+            del self.waiting[block.prev_block_id]
+
+        return block
+
+    def pop_children(self, parent_id):
+        """Remove and return the orphans waiting for parent_id."""
+
+        children = self.waiting.pop(parent_id, [])
+
+        for block in children:
+            del self.blocks[block.id]
+
+        return children
@@ -0,0 +1,326 @@
+"""
+Conservative parallel execution of a simulation over several processes.
+
+The nodes are split into partitions (logical processes), each simulated by
+its own worker process. Every message between two nodes takes at least
+the propagation delay of their link, so an event at time t can't cause an
+event on another node before t + L, where L (the lookahead) is the
+smallest delay of any link between two partitions.
+
+Workers therefore advance in windows: if T is the earliest pending event
+anywhere, every worker can safely run all its events before T + L without
+hearing from the others. Events for nodes of other partitions are sent
+(through pipes, via the coordinating process) at the end of each window.
+
+Nothing a node does may depend on the order that other nodes run in, so
+this needs per-node random streams (see streams.py), with which the
+results are the same as those of a sequential run from the same seed.
+"""
+
+import time
+import traceback
+import multiprocessing
+
+from collections import Counter
+
+from events import Multicast
+from simulation import Simulator
+
+
+def partition(n, parts):
+    """Return the partition of each node: parts contiguous ranges of ids."""
+    return [i * parts // n for i in range(n)]
+
+
+def node_state(node):
+    """Return the state of a node that a run should end with, comparably."""
+
+    return {
+        "coins": node.coins,
+        "tip": node.tip.id,
+        "height": node.height,
+        "arrived_at": dict(node.arrived_at),
+        "mempool": sorted(node.mempool),
+        "orphans": sorted(node.orphans.blocks),
+    }
+
+
+class Router(object):
+    """
+    Event queue of a partition, in front of the real one.
+
+    Events for the partition's own nodes are scheduled as usual; others are
+    collected in an outbox per partition, to be sent at the end of a window.
+    """
+
+    def __init__(self, queue, owner, part, parts):
+        self.queue = queue
+        self.owner = owner
+        self.part = part
+
+        # Events to send to each partition
+        self.outbox = [[] for _ in range(parts)]
+
+    def __len__(self):
+        return len(self.queue)
+
+    def empty(self):
+        return self.queue.empty()
+
+    def get(self):
+        return self.queue.get()
+
+    def peek(self):
+        return self.queue.peek()
+
+    def discard_if(self, pred):
+        return self.queue.discard_if(pred)
+
+    def put(self, ev):
+
+        # A new multicast splits into one per partition. Later deliveries of
+        # each then stay within their partition
+        if isinstance(ev, Multicast) and ev.pos == 0:
+            groups = {}
+            for arrival in ev.arrivals:
+                groups.setdefault(self.owner[arrival[1]], []).append(arrival)
+
+            if len(groups) > 1:
+                for arrivals in groups.values():
+                    self.put(Multicast(ev.kind, ev.payload, ev.creator_id,
+                                       ev.created_at, arrivals))
+                return
+
+        dest = self.owner[ev.node_id]
+
+        if dest == self.part:
+            self.queue.put(ev)
+        else:
+            self.outbox[dest].append(ev)
+
+
+def lookahead(sim, owner, part):
+    """
+    Return the smallest delay of a link between a node of this partition
+    and a node of another, in either direction.
+    """
+
+    least = float("inf")
+
+    for node in sim.nodes:
+        for peer in node.peers:
+            a, b = node.id, peer.id
+
+            if owner[a] == owner[b] or part not in (owner[a], owner[b]):
+                continue
+
+            # Messages go both ways: inv requests are sent back to the announcer
+            mine, other = (a, b) if owner[a] == part else (b, a)
+            least = min(least, sim.links.prop_delay(mine, other))
+
+    return least
+
+
+def _next_time(queue):
+    return queue.peek().run_at if not queue.empty() else float("inf")
+
+
+def _work(conn, part, parts, args, kwargs):
+    """Main loop of a worker process, simulating one partition."""
+
+    sim = Simulator(*args, **kwargs)
+    owner = partition(sim.n, parts)
+
+    # Every worker builds the whole network, but only runs its own nodes
+    sim.events.discard_if(lambda ev: owner[ev.node_id] != part)
+    router = sim.events = Router(sim.events, owner, part, parts)
+
+    conn.send((lookahead(sim, owner, part), _next_time(router)))
+
+    counts = Counter()
+
+    while True:
+        msg = conn.recv()
+
+        if msg[0] == "finish":
+            break
+
+        _, end, until_time, incoming = msg
+
+        for ev in incoming:
+            router.queue.put(ev)
+
+        queue = router.queue
+        while not queue.empty():
+            run_at = queue.peek().run_at
+
+            if run_at >= end or run_at > until_time:
+                break
+
+            ev = queue.get()
+            sim.curr_time = run_at
+
+            ev.run(sim)
+            counts[ev.label] += 1
+
+        outbox, router.outbox = router.outbox, [[] for _ in range(parts)]
+        conn.send((outbox, _next_time(router)))
+
+    conn.send({
+        "nodes": dict((node.id, node_state(node)) for node in sim.nodes
+                      if owner[node.id] == part),
+        "counts": counts,
+        "relay": sim.relay_stats,
+        "orphans": sim.orphan_stats,
+        "blocks": sim.block_id - 1,
+        "transactions": sim.trans_id - 1,
+        "sim_time": sim.curr_time,
+    })
+
+
+def _worker(conn, part, parts, args, kwargs):
+    try:
+        _work(conn, part, parts, args, kwargs)
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+
+
+class ParallelSimulator(object):
+    """
+    Runs a Simulator(*args, **kwargs) split over several worker processes.
+
+    Per-node random streams are always used, and only per-node arrivals are
+    supported (the global clocks of the other mode are a single sequence
+    of events for the whole network).
+    """
+
+    def __init__(self, partitions, *args, **kwargs):
+
+        if kwargs.get("arrivals", "per-node") != "per-node":
+            raise ValueError("parallel runs need per-node arrivals")
+
+        if kwargs.get("seed") is None:
+            raise ValueError("parallel runs need a seed, shared by all workers")
+
+        kwargs["per_node_streams"] = True
+
+        # Number of worker processes
+        self.partitions = partitions
+
+        self.args = args
+        self.kwargs = kwargs
+
+        # Final state of each node (see node_state), by id, once run
+        self.nodes = {}
+
+    def _recv(self, conn):
+        msg = conn.recv()
+
+        if isinstance(msg, tuple) and msg and msg[0] == "error":
+            raise RuntimeError("worker failed:\n" + msg[1])
+
+        return msg
+
+    def run(self, until_time, quiet=False):
+        """Run all events up to simulated time until_time, return a summary."""
+
+        started = time.perf_counter()
+        parts = self.partitions
+
+        conns, procs = [], []
+        for part in range(parts):
+            parent, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(
+                target=_worker, args=(child, part, parts, self.args, self.kwargs)
+            )
+            proc.start()
+
+            conns.append(parent)
+            procs.append(proc)
+
+        results = None
+        try:
+            hello = [self._recv(conn) for conn in conns]
+
+            L = min(h[0] for h in hello)
+            T = min(h[1] for h in hello)
+
+            pending = [[] for _ in range(parts)]
+            windows = sent = 0
+
+            while T <= until_time:
+                end = T + L
+
+                for conn, incoming in zip(conns, pending):
+                    conn.send(("window", end, until_time, incoming))
+
+                pending = [[] for _ in range(parts)]
+                nexts = []
+
+                # Gathered in partition order, so deliveries are deterministic
+                for conn in conns:
+                    outbox, next_time = self._recv(conn)
+                    nexts.append(next_time)
+
+                    for dest, evs in enumerate(outbox):
+                        pending[dest].extend(evs)
+                        sent += len(evs)
+
+                T = min(nexts + [ev.run_at for evs in pending for ev in evs])
+                windows += 1
+
+            for conn in conns:
+                conn.send(("finish",))
+
+            results = [self._recv(conn) for conn in conns]
+
+        finally:
+            for proc in procs:
+                # After a failure, the other workers still wait for messages
+                if results is None:
+                    proc.terminate()
+                proc.join()
+
+        elapsed = time.perf_counter() - started
+
+        counts = Counter()
+        relay = Counter()
+        orphans = Counter()
+
+        for result in results:
+            self.nodes.update(result["nodes"])
+            counts.update(result["counts"])
+            relay.update(result["relay"])
+            orphans.update(result["orphans"])
+
+        events = sum(counts.values())
+
+        summary = {
+            "events": events,
+            "sim_time": max(r["sim_time"] for r in results),
+            "wall_time": elapsed,
+            "events_per_sec": events / elapsed if elapsed else 0.0,
+            "counts": dict(counts),
+            "blocks": sum(r["blocks"] for r in results),
+            "transactions": sum(r["transactions"] for r in results),
+            "orphans": dict(orphans),
+            "relay": dict(relay),
+            "partitions": parts,
+            "lookahead": L,
+            "windows": windows,
+            "messages": sent,
+        }
+
+        if not quiet:
+            print("\nCounts of events run: \n")
+            for e, c in sorted(counts.items()):
+                print("{:<19} | {}".format(e, c))
+            print("{:^19} | {}".format("Total", events))
+
+            print("\nPartitions: %d, lookahead: %.4f s" % (parts, L))
+            print("Windows: %d, messages between partitions: %d" % (windows, sent))
+            print("Simulated time: %.4f s in %.4f s of wall time" % (
+                summary["sim_time"], elapsed))
+            print("Events / second: %.1f" % summary["events_per_sec"])
+
+        return summary
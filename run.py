@@ -1,6 +1,21 @@
+import os
+import sys
+import random
 import argparse
 
-from simulation import Simulator
+import checkpoint
+import export
+
+from instrument import Instruments
+from metrics import Metrics
+
+from orphans import EVICTIONS
+from parallel import ParallelSimulator
+from scheduler import SCHEDULERS
+from simulation import OUT_DIR, Simulator
+from timewarp import TimeWarpSimulator
+from topology import TOPOLOGIES
+from tracelog import TraceWriter
 
 # Build a CLI argument parser
 P = argparse.ArgumentParser(
@@ -8,25 +23,131 @@ P = argparse.ArgumentParser(
     formatter_class=argparse.ArgumentDefaultsHelpFormatter,
 )
 
-P.add_argument('n', type=int, default=10,
+P.add_argument('n', type=int, nargs='?', default=10,
                help='Number of nodes')
 
-P.add_argument('z', type=float, default=0.4,
+P.add_argument('z', type=float, nargs='?', default=0.4,
                help='Fraction of slow nodes')
 
-P.add_argument('tm', type=float, default=5,
+P.add_argument('tm', type=float, nargs='?', default=5,
                help='Mean transaction interarrival time')
 
-P.add_argument('bm', type=float, default=10,
+P.add_argument('bm', type=float, nargs='?', default=10,
                # metavar="Tk",
                help='Mean block interarrival time')
 
 P.add_argument('--until', type=int, default=1000,
-               help='Maximum number of events to run')
+               help='Maximum number of events to run (0 for no limit)')
+
+P.add_argument('--until-time', type=float, default=None,
+               help='Stop once this much simulated time has passed')
+
+P.add_argument('--wall-time', type=float, default=None,
+               help='Stop after running for this many seconds')
+
+P.add_argument('--scheduler', choices=sorted(SCHEDULERS), default="heap",
+               help='Event queue implementation to use')
+
+P.add_argument('--topology', choices=sorted(TOPOLOGIES), default="dense",
+               help='Shape of the peer-to-peer network')
+
+P.add_argument('--degree', type=int, default=8,
+               help='Average number of peers of a node (ignored by dense)')
+
+P.add_argument('--block-size', type=int, default=10 ** 6,
+               help='Maximum size of a block in bytes')
+
+P.add_argument('--mempool-order', choices=["age", "fee"], default="age",
+               help='Which transactions miners put in a block first')
+
+P.add_argument('--multicast', action="store_true",
+               help='Queue one event per broadcast instead of one per peer')
+
+P.add_argument('--relay', choices=["flood", "inv"], default="flood",
+               help='Flood payloads to peers, or announce them & let peers ask')
+
+P.add_argument('--arrivals', choices=["per-node", "global"], default="per-node",
+               help='Schedule mining & transactions per node, or as one '
+                    'Poisson process each for the whole network')
+
+P.add_argument('--hash-power', choices=["equal", "random"], default="equal",
+               help='Relative hashing power of the nodes')
+
+P.add_argument('--tx-rate', choices=["equal", "random"], default="equal",
+               help='Relative transaction rate of the nodes')
+
+P.add_argument('--orphan-limit', type=int, default=100,
+               help='Blocks a node keeps while waiting for their parent '
+                    '(0 drops them, as before)')
+
+P.add_argument('--orphan-eviction', choices=EVICTIONS, default="oldest",
+               help='Which orphan block is dropped when a node has too many')
+
+P.add_argument('--seed', type=int, default=None,
+               help='Seed for all the randomness of the run (random if not given)')
+
+P.add_argument('--per-node-streams', action="store_true",
+               help='Give every node its own random streams')
+
+P.add_argument('--partitions', type=int, default=1,
+               help='Split the nodes over this many processes, which run in '
+                    'parallel (needs --until-time, no graphs are drawn)')
+
+P.add_argument('--optimistic', action="store_true",
+               help='Run partitions optimistically, rolling back on late '
+                    'messages (Time Warp), instead of in safe windows')
+
+P.add_argument('--checkpoint', metavar="PATH", default=None,
+               help='Save the state of the run to this file when it stops '
+                    '(and periodically, see below), to resume it later')
+
+P.add_argument('--checkpoint-every', type=int, default=None,
+               help='Also save a checkpoint every this many events')
+
+P.add_argument('--checkpoint-interval', type=float, default=None,
+               help='Also save a checkpoint every this much simulated time')
+
+P.add_argument('--resume', metavar="PATH", default=None,
+               help='Carry on a run from a checkpoint (n, z, tm, bm & the '
+                    'network options are taken from it)')
+
+P.add_argument('--fork', type=int, default=None,
+               help='With --resume, draw the randomness from here on from '
+                    'this branch number, to play out different futures')
+
+P.add_argument('--trace', metavar="PATH", default=None,
+               help='Record the events run to this binary trace file (see '
+                    'tracelog.py), best with -q')
+
+P.add_argument('--trace-every', type=int, default=1,
+               help='Only record one in every this many events')
+
+P.add_argument('--profile', metavar="PATH", default=None,
+               help='Time every kind of event & count queue operations, '
+                    'and write a JSON report of it to this file')
+
+P.add_argument('--profile-every', type=int, default=None,
+               help='With --profile, also print a summary every this many events')
+
+P.add_argument('--metrics', metavar="PATH", default=None,
+               help='Keep metrics (block propagation, forks, confirmation '
+                    'latency...) as the run goes, and write them to this '
+                    'file: CSV if it ends with .csv, JSON lines otherwise')
+
+P.add_argument('--metrics-every', type=float, default=100.0,
+               help='Simulated time between rows of --metrics')
 
 P.add_argument('-q', action="store_true",
                help='Do not print event log')
 
+P.add_argument('--export', metavar="PATH", default=os.path.join(OUT_DIR, "chains.jsonl"),
+               help='Write the blockchains of all nodes (one tree of all '
+                    'the blocks, with when each node got them) to this file')
+
+P.add_argument('--dot', metavar="NODE", type=int, nargs="*", default=None,
+               help='Draw the blockchains of these nodes (all of them if '
+                    'none are given) to .dot & .png files')
+
 P.add_argument('--network', action="store_true",
                help='Dump network graph (may take a long time!)')
 
@@ -34,28 +155,126 @@ if __name__ == '__main__':
 
     args = P.parse_args()
 
+    if args.degree < 1:
+        P.error("--degree must be at least 1")
+
+    if (args.checkpoint_every or args.checkpoint_interval) and not args.checkpoint:
+        P.error("--checkpoint-every & --checkpoint-interval need --checkpoint")
+
+    if args.trace_every < 1:
+        P.error("--trace-every must be at least 1")
+
+    if args.profile_every and not args.profile:
+        P.error("--profile-every needs --profile")
+
+    if args.metrics_every <= 0:
+        P.error("--metrics-every must be positive")
+
+    if args.fork is not None and not args.resume:
+        P.error("--fork needs --resume")
+
+    if args.resume and args.partitions > 1:
+        P.error("--resume can't be used with --partitions")
+
     # If not given as a fraction, then assume percentage
     if args.z > 1:
         args.z /= 100
 
-    sim = Simulator(args.n, args.z, args.tm, args.bm)
+    options = dict(scheduler=args.scheduler,
+                   topology=args.topology, degree=args.degree,
+                   block_size=args.block_size,
+                   mempool_order=args.mempool_order,
+                   multicast=args.multicast, relay=args.relay,
+                   arrivals=args.arrivals, hash_power=args.hash_power,
+                   tx_rate=args.tx_rate, orphan_limit=args.orphan_limit,
+                   orphan_eviction=args.orphan_eviction,
+                   per_node_streams=args.per_node_streams)
+
+    if args.partitions > 1:
+        if args.until_time is None:
+            P.error("--partitions needs --until-time")
+
+        # All workers need the same seed
+        seed = args.seed if args.seed is not None else random.getrandbits(64)
+        print("\n >>>> Seed: %d " % seed)
+
+        engine = TimeWarpSimulator if args.optimistic else ParallelSimulator
+
+        print("\n >>>> Running simulation on %d processes \n" % args.partitions)
+        engine(args.partitions, args.n, args.z, args.tm, args.bm,
+               seed=seed, **options).run(args.until_time)
+
+        sys.exit()
+
+    if args.resume and args.fork is not None:
+        sim = checkpoint.fork(args.resume, args.fork)
+    elif args.resume:
+        sim = checkpoint.load(args.resume)
+    else:
+        sim = Simulator(args.n, args.z, args.tm, args.bm, seed=args.seed, **options)
+
+    if args.dot and any(not 0 <= i < sim.n for i in args.dot):
+        P.error("--dot takes node ids from 0 to n - 1")
+
+    # Running again with this seed repeats the run exactly
+    print("\n >>>> Seed: %d " % sim.seed)
+
+    if args.resume:
+        print("\n >>>> Resuming from %s at t = %.4f s " % (args.resume, sim.curr_time))
 
     print("\n >>>> Cleaning graphs directory ")
     sim.remove_graphs()
 
+    trace = None
+    if args.trace:
+        trace = TraceWriter(args.trace, args.trace_every, meta={
+            "seed": sim.seed, "n": sim.n, "z": sim.z, "tm": sim.tm, "bm": sim.bm,
+            "start": sim.curr_time,
+        })
+
+    instruments = Instruments(args.profile_every) if args.profile else None
+
+    metrics = None
+    if args.metrics:
+        metrics = Metrics(sim.n, args.metrics, args.metrics_every, start=sim.curr_time)
+
     print("\n >>>> Running simulation \n")
-    sim.run(args.until, args.q)
+    try:
+        sim.run(args.until or None, args.q,
+                until_time=args.until_time, wall_time=args.wall_time,
+                checkpoint_path=args.checkpoint,
+                checkpoint_every=args.checkpoint_every,
+                checkpoint_interval=args.checkpoint_interval,
+                trace=trace, instruments=instruments, metrics=metrics)
+    finally:
+        if metrics is not None:
+            metrics.close()
+            print("\n >>>> Wrote %d rows of metrics to %s " % (metrics.rows, metrics.path))
+
+        if trace is not None:
+            trace.close()
+            print("\n >>>> Recorded %d events to %s " % (trace.recorded, trace.path))
+
+    if instruments is not None:
+        instruments.save(args.profile)
+        print("\n >>>> Profile written to %s " % args.profile)
 
     if args.network:
         print("\n >>>> Dumping network graph ")
         sim.dump_network()
 
-    print("\n >>>> Dumping blockchains of all nodes ")
-    sim.dump_node_chains()
+    print("\n >>>> Exporting blockchains of all nodes ")
+    blocks = export.write(sim, args.export)
+    print("\n >>>> Wrote %d blocks to %s " % (blocks, args.export))
+
+    if args.dot is not None:
+        nodes = args.dot or None
 
-    print("\n >>>> Dumping blockchains of all nodes (pruned) ")
-    sim.prune_node_chains()
-    sim.dump_node_chains(pruned=True)
+        print("\n >>>> Dumping blockchains of %s " % (
+            "all nodes" if nodes is None else "nodes %s" % ", ".join(map(str, nodes))))
+        sim.dump_node_chains(nodes=nodes)
+        sim.dump_node_chains(pruned=True, nodes=nodes)
 
-    print("\n >>>> Rendering graphs to png images ")
-    sim.convert_graphs()
+    if args.dot is not None or args.network:
+        print("\n >>>> Rendering graphs to png images ")
+        sim.convert_graphs()
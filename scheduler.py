@@ -0,0 +1,425 @@
+"""
+Event schedulers (future event lists) for the simulation.
+
+The simulator is single threaded, so none of these take locks. All of them
+order events by their scheduled time and break ties by insertion order, so
+two events scheduled for the same instant always run first-in first-out.
+
+HeapScheduler, CalendarQueue, LadderQueue
+"""
+
+import abc
+import heapq
+import itertools
+
+from bisect import insort
+
+
+class Scheduler(abc.ABC):
+    """
+    Interface that every scheduler backend implements.
+
+    Entries are stored as (run_at, seq, event) tuples, where seq is a
+    monotonically increasing insertion counter. Since seq is unique, tuple
+    comparison never has to fall back to comparing the events themselves.
+    """
+
+    def __init__(self):
+        # Insertion counter used to break ties between equal run_at
+        self._seq = itertools.count()
+
+        # Number of events currently in the queue
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getstate__(self):
+        # Counters can't be pickled (in newer Pythons): keep the next seq
+        state = dict(self.__dict__)
+        state["_seq"] = next(self._seq)
+        self._seq = itertools.count(state["_seq"])
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._seq = itertools.count(state["_seq"])
+
+    def empty(self):
+        return self._size == 0
+
+    @abc.abstractmethod
+    def put(self, ev):
+        """Schedule an event."""
+
+    @abc.abstractmethod
+    def get(self):
+        """Remove and return the earliest scheduled event."""
+
+    @abc.abstractmethod
+    def peek(self):
+        """Return the earliest scheduled event without removing it."""
+
+    @abc.abstractmethod
+    def discard_if(self, pred):
+        """Remove every event for which pred is true, return how many."""
+
+
+class HeapScheduler(Scheduler):
+    """Plain binary heap, using the heapq module."""
+
+    def __init__(self):
+        super(HeapScheduler, self).__init__()
+
+        self._heap = []
+
+    def __len__(self):
+        return len(self._heap)
+
+    def empty(self):
+        return not self._heap
+
+    def put(self, ev):
+        heapq.heappush(self._heap, (ev.run_at, next(self._seq), ev))
+
+    def get(self):
+        return heapq.heappop(self._heap)[2]
+
+    def peek(self):
+        return self._heap[0][2]
+
+    def discard_if(self, pred):
+        size = len(self._heap)
+
+        self._heap = [entry for entry in self._heap if not pred(entry[2])]
+        heapq.heapify(self._heap)
+
+        return size - len(self._heap)
+
+
+class CalendarQueue(Scheduler):
+    """
+    Calendar queue, as described by R. Brown (1988).
+
+    Events are hashed into a circular array of "day" buckets by their time.
+    Dequeueing walks the calendar one day at a time, so both operations are
+    O(1) on average when the bucket width matches the event density. The
+    calendar is resized (and the width re-estimated) whenever the number of
+    events doubles or halves.
+    """
+
+    def __init__(self, nbuckets=2, width=1.0):
+        super(CalendarQueue, self).__init__()
+
+        # Time of the most recently dequeued event
+        self._last_time = 0.0
+
+        self._build(nbuckets, width)
+
+    def _build(self, nbuckets, width):
+        self._nbuckets = nbuckets
+        self._width = width
+        self._buckets = [[] for _ in range(nbuckets)]
+
+        # Virtual (never wrapping) index of the day we're dequeueing from
+        self._day = int(self._last_time / width)
+
+        # Queue only grows / shrinks its calendar past these sizes
+        self._grow_at = 2 * nbuckets
+        self._shrink_at = nbuckets // 2 - 2
+
+    def _new_width(self):
+        """Estimate a bucket width from the spacing of the earliest events."""
+
+        sample = heapq.nsmallest(
+            min(self._size, 25), itertools.chain.from_iterable(self._buckets)
+        )
+
+        if len(sample) < 2:
+            return self._width
+
+        gaps = [b[0] - a[0] for a, b in zip(sample, sample[1:])]
+        avg = sum(gaps) / len(gaps)
+
+        # Ignore unusually large gaps when computing the final average
+        small = [g for g in gaps if g <= 2 * avg]
+        avg = sum(small) / len(small) if small else avg
+
+        return 3 * avg if avg > 0 else self._width
+
+    def _resize(self, nbuckets):
+        width = self._new_width()
+        entries = list(itertools.chain.from_iterable(self._buckets))
+
+        self._build(nbuckets, width)
+
+        for entry in entries:
+            self._buckets[int(entry[0] / width) % nbuckets].append(entry)
+
+        for bucket in self._buckets:
+            bucket.sort()
+
+    def put(self, ev):
+        entry = (ev.run_at, next(self._seq), ev)
+        day = int(entry[0] / self._width)
+
+        insort(self._buckets[day % self._nbuckets], entry)
+        self._size += 1
+
+        # peek() may have moved past this day already: go back to it
+        if day < self._day:
+            self._day = day
+
+        if self._size > self._grow_at:
+            self._resize(2 * self._nbuckets)
+
+    def _locate(self):
+        """Move to the day of the earliest event and return its bucket."""
+
+        if not self._size:
+            raise IndexError("get from an empty scheduler")
+
+        buckets = self._buckets
+        nbuckets = self._nbuckets
+        width = self._width
+
+        # Walk through one "year" of the calendar looking for today's events.
+        # Days are compared exactly the way put() computed them, so that
+        # rounding can never move an event into a neighbouring day.
+        for day in range(self._day, self._day + nbuckets):
+            bucket = buckets[day % nbuckets]
+
+            if bucket and int(bucket[0][0] / width) <= day:
+                break
+
+        else:
+            # Nothing due this year, jump straight to the earliest event
+            first = min(b[0] for b in buckets if b)
+            day = int(first[0] / width)
+            bucket = buckets[day % nbuckets]
+
+        self._day = day
+        return bucket
+
+    def get(self):
+        entry = self._locate().pop(0)
+
+        self._last_time = entry[0]
+        self._size -= 1
+
+        if self._size < self._shrink_at:
+            self._resize(self._nbuckets // 2)
+
+        return entry[2]
+
+    def peek(self):
+        return self._locate()[0][2]
+
+    def discard_if(self, pred):
+        size = self._size
+
+        # Filtering keeps every bucket sorted
+        for i, bucket in enumerate(self._buckets):
+            self._buckets[i] = [entry for entry in bucket if not pred(entry[2])]
+
+        self._size = sum(len(b) for b in self._buckets)
+
+        if self._size < self._shrink_at:
+            self._resize(max(2, self._size))
+
+        return size - self._size
+
+
+class _Rung(object):
+    """A single rung of the ladder: an array of equal width buckets."""
+
+    def __init__(self, start, width, nbuckets):
+        self.start = start
+        self.width = width
+        self.buckets = [[] for _ in range(nbuckets)]
+
+        # Index of the bucket that will be dequeued next
+        self.cur = 0
+
+    def cur_start(self):
+        """Return the earliest time that still belongs to this rung."""
+        return self.start + self.cur * self.width
+
+    def index(self, t):
+        """Return the bucket that time t falls into."""
+        i = int((t - self.start) / self.width)
+
+        # Guard against rounding errors pushing an entry out of range
+        return max(0, min(i, len(self.buckets) - 1))
+
+
+class LadderQueue(Scheduler):
+    """
+    Ladder queue, as described by W. T. Tang et al. (2005).
+
+    Far-future events are appended unsorted to "top". When the near future
+    runs dry, top is spread over a rung of buckets; crowded buckets are
+    spread over finer child rungs, and only small buckets are ever sorted
+    (into "bottom"). This gives O(1) amortised cost that is insensitive to
+    the distribution of event times.
+    """
+
+    # Buckets with more entries than this are split into a new rung
+    THRESHOLD = 50
+
+    # Maximum number of rungs on the ladder
+    MAX_RUNGS = 8
+
+    def __init__(self):
+        super(LadderQueue, self).__init__()
+
+        # Unsorted list of events at or after top_start
+        self._top = []
+        self._top_min = float("inf")
+        self._top_max = float("-inf")
+        self._top_start = float("-inf")
+
+        # Rungs, coarsest first
+        self._rungs = []
+
+        # Small heap of the events that are due next
+        self._bottom = []
+
+    def put(self, ev):
+        entry = (ev.run_at, next(self._seq), ev)
+        t = entry[0]
+
+        self._size += 1
+
+        if t >= self._top_start:
+            self._top.append(entry)
+
+            if t < self._top_min:
+                self._top_min = t
+            if t > self._top_max:
+                self._top_max = t
+
+            return
+
+        # Rungs are dropped once used up (see _refill), so rung.cur always
+        # points at a real bucket. Comparing bucket indices rather than times keeps the
+        # routing consistent with how each rung spread out its entries.
+        for rung in self._rungs:
+            i = rung.index(t)
+
+            if i >= rung.cur:
+                rung.buckets[i].append(entry)
+                return
+
+        heapq.heappush(self._bottom, entry)
+
+    def _spawn(self, entries, start, width):
+        """Spread entries over a new rung of len(entries) buckets."""
+
+        rung = _Rung(start, width / len(entries), len(entries))
+
+        for entry in entries:
+            rung.buckets[rung.index(entry[0])].append(entry)
+
+        self._rungs.append(rung)
+
+    def _refill(self):
+        """Move the next batch of due events into bottom."""
+
+        while True:
+
+            if not self._rungs:
+                top = self._top
+
+                start = self._top_min
+                span = self._top_max - self._top_min
+
+                self._top = []
+                self._top_start = self._top_max
+                self._top_min = float("inf")
+                self._top_max = float("-inf")
+
+                if len(top) <= self.THRESHOLD or span == 0:
+                    heapq.heapify(top)
+                    self._bottom = top
+                    return
+
+                # One extra bucket so that top_max has a place to go
+                self._spawn(top, start, span * (1 + 1 / len(top)))
+                continue
+
+            rung = self._rungs[-1]
+
+            while rung.cur < len(rung.buckets) and not rung.buckets[rung.cur]:
+                rung.cur += 1
+
+            # This rung is used up, continue with its parent
+            if rung.cur == len(rung.buckets):
+                self._rungs.pop()
+                continue
+
+            bucket = rung.buckets[rung.cur]
+            rung.buckets[rung.cur] = []
+            start = rung.cur_start()
+            rung.cur += 1
+
+            # Drop a rung as soon as its last bucket is taken, so that put()
+            # never routes new entries into a bucket that's already gone
+            if rung.cur == len(rung.buckets):
+                self._rungs.pop()
+
+            if len(bucket) > self.THRESHOLD and len(self._rungs) < self.MAX_RUNGS:
+                self._spawn(bucket, start, rung.width)
+                continue
+
+            heapq.heapify(bucket)
+            self._bottom = bucket
+            return
+
+    def get(self):
+        if not self._size:
+            raise IndexError("get from an empty scheduler")
+
+        if not self._bottom:
+            self._refill()
+
+        self._size -= 1
+        return heapq.heappop(self._bottom)[2]
+
+    def peek(self):
+        if not self._size:
+            raise IndexError("peek at an empty scheduler")
+
+        if not self._bottom:
+            self._refill()
+
+        return self._bottom[0][2]
+
+    def discard_if(self, pred):
+        size = self._size
+
+        def keep(entries):
+            return [entry for entry in entries if not pred(entry[2])]
+
+        # top_min & top_max are only bounds, they needn't be exact
+        self._top = keep(self._top)
+
+        for rung in self._rungs:
+            rung.buckets = [keep(b) for b in rung.buckets]
+
+        self._bottom = keep(self._bottom)
+        heapq.heapify(self._bottom)
+
+        self._size = (len(self._top) + len(self._bottom) +
+                      sum(len(b) for r in self._rungs for b in r.buckets))
+
+        return size - self._size
+
+
+# Backends that can be chosen from the command line
+SCHEDULERS = {
+    "heap": HeapScheduler,
+    "calendar": CalendarQueue,
+    "ladder": LadderQueue,
+}
@@ -6,25 +6,50 @@ Using nodes, blocks, and events.
 
 # Python's stdlib
 import os
+import time
 import random
+import itertools
+import contextlib
+
+from bisect import bisect_right
+
+import numpy as np
 
-from queue import PriorityQueue
 from collections import Counter
 
 # Our custom code
+import checkpoint
+import export
 import events as EV
 from node import Node
+from block import BLOCK_HEADER_SIZE, TX_SIZE, TransactionStore
+from latency import LatencyEngine, MSG_SIZE
+from scheduler import SCHEDULERS
+from streams import Streams
+from topology import TOPOLOGIES, is_connected
 
 # Change this to configure where the output graphs are stored
 OUT_DIR = "output"
 
+# How many events to run between checks of the wall-clock budget
+WALL_CHECK_EVERY = 1024
+
+# Cancelled events are purged from the queue once there are more than this
+# many of them, and they make up over half of the queue
+COMPACT_MIN = 1024
+
 if not os.path.isdir(OUT_DIR):
     os.makedirs(OUT_DIR)
 
 
 class Simulator(object):
 
-    def __init__(self, n, z, tm, bm):
+    def __init__(self, n, z, tm, bm, scheduler="heap", seed=None,
+                 topology="dense", degree=8, block_size=10 ** 6,
+                 mempool_order="age", tx_store=False, multicast=False,
+                 relay="flood", arrivals="per-node", hash_power="equal",
+                 tx_rate="equal", orphan_limit=100, orphan_eviction="oldest",
+                 per_node_streams=False):
 
         # Total number of nodes
         self.n = n
@@ -38,58 +63,221 @@ class Simulator(object):
         # Mean block interarrival time
         self.bm = bm
 
+        # Shape of the peer graph & average number of peers of a node
+        # (see topology.py for the available generators)
+        self.topology = topology
+        self.degree = degree
+
+        # Maximum size of a block in bytes, and the transactions that fit in it
+        self.block_size = block_size
+        self.block_txns = max(1, (block_size - BLOCK_HEADER_SIZE) // TX_SIZE)
+
+        # Which transactions miners pick first: oldest or highest fee
+        self.mempool_order = mempool_order
+
+        # Send a message to all peers as one Multicast event, not one per peer
+        self.multicast = multicast
+
+        # How payloads spread: "flood" sends them to every peer, "inv" only
+        # announces them, and peers request what they don't have
+        self.relay = relay
+
+        # Messages & bytes sent by the inv protocol, and what flooding would've sent
+        self.relay_stats = Counter()
+
+        # Blocks each node keeps while waiting for their parent, and which of
+        # them it throws away when that's too many (see orphans.py)
+        self.orphan_limit = orphan_limit
+        self.orphan_eviction = orphan_eviction
+
+        # Blocks that arrived as orphans, that were connected later & evicted
+        self.orphan_stats = Counter()
+
+        # "per-node" schedules mining & transactions separately for every node,
+        # "global" runs one Poisson process for each (see events.BlockClock)
+        self.arrivals = arrivals
+
+        # Optional compact record of every transaction created, by id
+        # (which needs ids handed out in order, see new_trans_id)
+        if tx_store and per_node_streams:
+            raise ValueError("tx_store can't be used with per_node_streams")
+
+        self.tx_store = TransactionStore() if tx_store else None
+
+        # Metrics.Metrics following the run in progress, if any (see run)
+        self.metrics = None
+
+        # Seed that all the randomness of the simulation is derived from
+        self.seed = seed if seed is not None else random.getrandbits(64)
+
+        # Independent random streams for each part of the simulation: the
+        # "topology", the "nodes" (coins & weights), "mining", "transactions"
+        # and "orphans", and seeds for "propagation" & "queuing" delays.
+        # Optionally, nodes get their own stream of each (see streams.py), and
+        # then also their own queuing delays & block / transaction ids, so
+        # that nothing a node does depends on the order other nodes run in
+        self.stream = Streams(self.seed, per_node_streams)
+
         # The event queue prioritised by the scheduled time of the event
-        self.events = PriorityQueue()
+        # (see scheduler.py for the available backends)
+        self.events = SCHEDULERS[scheduler]()
+
+        # Number of cancelled events still in the queue, and of those
+        # removed from it by compaction
+        self.stale_events = 0
+        self.compacted = 0
+
+        # Wall-clock seconds spent in each phase of the setup (see bench.py)
+        self.setup_time = {}
 
         # All nodes in the simulation
-        self.nodes = self.create_nodes(n, z)
+        with self.setup_phase("create_nodes"):
+            self.nodes = self.create_nodes(n, z)
+
+        # Hashing power & transaction rate of each node ("equal", "random"
+        # or a list of weights), and their running totals for picking nodes
+        for node, h, r in zip(self.nodes, self.weights(hash_power),
+                              self.weights(tx_rate)):
+            node.hash_power = h
+            node.tx_rate = r
+
+        self.hash_power_cum = list(itertools.accumulate(
+            node.hash_power for node in self.nodes
+        ))
+        self.tx_rate_cum = list(itertools.accumulate(
+            node.tx_rate for node in self.nodes
+        ))
 
         # Randomize peers of each node!
-        self.set_random_peers()
+        with self.setup_phase("set_random_peers"):
+            self.set_random_peers()
 
-        # TODO: Use itertools.count for these
-        # Block id
+        # Id of the next block & transaction, which also count how many were
+        # created (see new_block_id for the ids with per-node streams)
         self.block_id = 1
-
-        # Transaction id
         self.trans_id = 1
 
         # Current time of the simulation
         self.curr_time = 0
 
-        # Set propagation delays between each pair of nodes
-        self.prop_delay = [
-            # From assignment:
-            # Pij can be chosen from a uniform distribution between 10ms and 500ms
-            [random.uniform(10, 501) / 1000 for _ in range(0, n)]
-            for _ in range(0, n)
-        ]
+        # Propagation delays are only stored for links of the peer graph, and
+        # generated from their own seed when a link is first used. Queuing
+        # delays are drawn from a generator seeded from their stream.
+        # Node ids double as indices into self.nodes and the latency arrays
+        with self.setup_phase("latency"):
+            self.links = LatencyEngine(
+                [node.is_fast for node in self.nodes],
+                [[peer.id for peer in node.peers] for node in self.nodes],
+                self.stream.seed_for("propagation"),
+                np.random.default_rng(self.stream.seed_for("queuing")),
+            )
 
         # Add some intial events
-        self.seed_events_queue()
+        with self.setup_phase("seed_events_queue"):
+            self.seed_events_queue()
+
+    @contextlib.contextmanager
+    def setup_phase(self, name):
+        """Time a phase of the setup, into self.setup_time."""
+
+        started = time.perf_counter()
+        yield
+        self.setup_time[name] = time.perf_counter() - started
 
-    def transaction_delay(self):
-        """Use an exponential distribution for interarrival between transactions."""
-        return random.expovariate(1 / self.tm)
+    def __getstate__(self):
+        state = dict(self.__dict__)
 
-    def block_delay(self):
-        """Use an exponential distribution for interarrival between blocks."""
-        return random.expovariate(1 / self.bm)
+        # Instrumentation & metrics of a run in progress aren't part of the state
+        state.pop("latency", None)
+        state["metrics"] = None
+
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault("metrics", None)
+        self.__dict__.update(state)
+
+        # Nodes are pickled with the ids of their peers (see Node.__getstate__)
+        for node in self.nodes:
+            node.peers = [self.nodes[i] for i in node.peers]
+
+    def reseed(self, seed):
+        """
+        Draw all randomness from a new seed from now on (see checkpoint.fork).
+        Link delays already belong to the network, so they stay.
+        """
+
+        self.seed = seed
+        self.stream.reseed(seed)
+        self.links.reseed_queuing(np.random.default_rng(self.stream.seed_for("queuing")))
+
+    def transaction_delay(self, node=None):
+        """
+        Use an exponential distribution for interarrival between transactions.
+
+        Without a node, this is the interarrival time of all nodes together.
+        """
+
+        if node is None:
+            return self.stream("transactions").expovariate(self.tx_rate_cum[-1] / self.tm)
+
+        return self.stream("transactions", node.id).expovariate(node.tx_rate / self.tm)
+
+    def block_delay(self, node=None):
+        """
+        Use an exponential distribution for interarrival between blocks.
+
+        Without a node, this is the interarrival time of all nodes together.
+        """
+
+        if node is None:
+            return self.stream("mining").expovariate(self.hash_power_cum[-1] / self.bm)
+
+        return self.stream("mining", node.id).expovariate(node.hash_power / self.bm)
+
+    def weights(self, spec):
+        """Return per-node weights, scaled to an average of 1."""
+
+        if spec == "equal":
+            return [1.0] * self.n
+
+        if spec == "random":
+            rng = self.stream("nodes")
+            spec = [rng.expovariate(1) for _ in range(self.n)]
+
+        if len(spec) != self.n or min(spec) <= 0:
+            raise ValueError("need a positive weight for each node")
+
+        total = sum(spec)
+        return [w * self.n / total for w in spec]
+
+    def pick_node(self, cum_weights, stream):
+        """
+        Pick a random node id, with probability proportional to its weight,
+        using the named random stream.
+        """
+
+        i = bisect_right(cum_weights, self.stream(stream).random() * cum_weights[-1])
+        return min(i, self.n - 1)
+
+    def transaction_fee(self, node=None):
+        """Simulated fee offered by a transaction (of node), in coins."""
+        return self.stream("transactions", None if node is None else node.id).uniform(0, 0.1)
 
     def create_nodes(self, n, z):
         """Create n nodes z% of which are slow."""
 
-        slow_nodes = [
-            Node(node_id=i, initial_coins=random.randrange(11, 31), is_fast=False)
-            for i in range(0, int(n * z))
-        ]
+        rng = self.stream("nodes")
 
-        fast_nodes = [
-            Node(node_id=i, initial_coins=random.randrange(11, 31), is_fast=True)
-            for i in range(int(n * z), n)
+        return [
+            Node(node_id=i, initial_coins=rng.randrange(11, 31),
+                 is_fast=i >= int(n * z), mempool_order=self.mempool_order,
+                 orphan_limit=self.orphan_limit,
+                 orphan_eviction=self.orphan_eviction,
+                 orphan_rng=self.stream("orphans", i))
+            for i in range(n)
         ]
 
-        return slow_nodes + fast_nodes
 
     def set_random_peers(self):
         """
@@ -99,129 +287,305 @@ class Simulator(object):
         that every node can send messages to every other node.
         """
 
-        for me in self.nodes:
-            # This ensures that network graph remains connected
-            # But this doesn't consider all possible connected graphs!
-            num_peers = random.randint(1 + self.n // 2, self.n - 1)
+        # Every node needs at least one peer for the graph to be connected
+        if self.degree < 1:
+            raise ValueError("degree must be at least 1, not %r" % self.degree)
+
+        adj = TOPOLOGIES[self.topology](self.n, self.degree, self.stream("topology"))
 
-            all_but_me = list(set(self.nodes) - set([me]))
+        # Generators repair connectivity themselves, this is just a sanity check
+        if not is_connected(adj):
+            raise RuntimeError("%s topology is not connected" % self.topology)
 
-            me.peers = random.sample(all_but_me, num_peers)
+        for me, peers in zip(self.nodes, adj):
+            me.peers = [self.nodes[i] for i in peers]
 
     def seed_events_queue(self):
         """Seed the events queue with BlockGenerate & TransactionGenerate events."""
 
+        if self.arrivals == "global":
+            if self.nodes:
+                self.events.put(EV.BlockClock(-1, -1, 0, self.block_delay()))
+                self.events.put(EV.TransactionClock(-1, -1, 0, self.transaction_delay()))
+
+            return
+
         for node in self.nodes:
-            self.events.put(EV.BlockGenerate(
-                node.id, node.id, 0, self.block_delay()
-            ))
+            self.restart_mining(node, 0)
 
             self.events.put(EV.TransactionGenerate(
-                node.id, node.id, 0, self.transaction_delay()
+                node.id, node.id, 0, self.transaction_delay(node)
             ))
 
-    def run(self, until=100, quiet=False):
-        """Run all events until some max number of events."""
+    def restart_mining(self, node, now):
+        """
+        Schedule a new BlockGenerate event for node, cancelling its pending one.
+
+        Cancelled events stay in the queue, and are dropped in O(1) when they
+        come up (see BlockGenerate.run) or when the queue is compacted.
+        """
+
+        if node.mining:
+            self.stale_events += 1
+
+            if (self.stale_events > COMPACT_MIN and
+                    2 * self.stale_events > len(self.events)):
+                self.compact_events()
+
+        node.epoch += 1
+        node.mining = True
+
+        self.events.put(EV.BlockGenerate(
+            node.id, node.id, now, now + self.block_delay(node), node.epoch
+        ))
+
+    def compact_events(self):
+        """Remove all cancelled events from the queue."""
+
+        removed = self.events.discard_if(
+            lambda ev: isinstance(ev, EV.BlockGenerate) and ev.stale(self)
+        )
+
+        self.stale_events -= removed
+        self.compacted += removed
+
+    def run(self, until=100, quiet=False, until_time=None, wall_time=None,
+            checkpoint_path=None, checkpoint_every=None, checkpoint_interval=None,
+            trace=None, instruments=None, metrics=None):
+        """
+        Run events until one of the budgets is used up.
+
+        until      -- maximum number of events to run (None for no limit)
+        until_time -- simulated time horizon (None for no limit)
+        wall_time  -- wall-clock budget in seconds (None for no limit)
+
+        With a checkpoint_path, a checkpoint (see checkpoint.py) is saved
+        there every checkpoint_every events and every checkpoint_interval
+        of simulated time (if given), and once the run stops.
+
+        Events are recorded to trace (a tracelog.TraceWriter) if given, which
+        is far cheaper than printing them, and measured by instruments (an
+        instrument.Instruments) if given. metrics (a metrics.Metrics) is kept
+        up to date as the run goes, and writes out its rows when they're due.
+
+        Returns a dict summarising the run.
+        """
 
         events = Counter()
         ev_count = 1
 
+        max_events = until if until is not None else float("inf")
+
+        start_time = self.curr_time
+        started = time.perf_counter()
+        deadline = started + wall_time if wall_time is not None else float("inf")
+
+        reason = "events"
+
+        # Events run & simulated time at which to save the next checkpoint
+        inf = float("inf")
+        if checkpoint_path is None:
+            next_count = next_time = inf
+        else:
+            next_count = checkpoint_every or inf
+            next_time = self.curr_time + checkpoint_interval if checkpoint_interval else inf
+
+        if instruments is not None:
+            instruments.attach(self)
+
+        # Simulated time of the next row of metrics
+        self.metrics = metrics
+        next_row = metrics.next_at if metrics is not None else inf
+
         if not quiet:
             print("     N |     t      |     Event")
             print("       |            |")
 
-        while ev_count <= until:
+        while ev_count <= max_events:
+
+            if self.events.empty():
+                reason = "queue empty"
+                break
+
+            # Reading the clock is cheap, but not free: only do it every so often
+            if (wall_time is not None and ev_count % WALL_CHECK_EVERY == 0 and
+                    time.perf_counter() >= deadline):
+                reason = "wall time"
+                break
+
+            # Leave events beyond the horizon in the queue, untouched
+            if until_time is not None and self.events.peek().run_at > until_time:
+                reason = "simulated time"
+                break
+
+            if ev_count > next_count or (next_time < inf and
+                                         self.events.peek().run_at >= next_time):
+                checkpoint.save(self, checkpoint_path)
+
+                if ev_count > next_count:
+                    next_count += checkpoint_every
+                while next_time <= self.events.peek().run_at:
+                    next_time += checkpoint_interval
 
             ev = self.events.get()
+
+            # Rows of metrics due before this event
+            if ev.run_at >= next_row:
+                metrics.tick(self, ev.run_at)
+                next_row = metrics.next_at
+
             self.curr_time = ev.run_at
 
             if not quiet:
                 print("%6d | %.8f | %s" % (ev_count, self.curr_time, ev))
 
-            ev.run(self)
+            if trace is not None:
+                trace.record(ev)
+
+            if instruments is None:
+                ev.run(self)
+            else:
+                instruments.run(ev, self)
 
             ev_count += 1
 
             # Keep track of which type of events run
-            ev_type = type(ev).__name__
-            events[ev_type] += 1
+            events[ev.label] += 1
+
+        elapsed = time.perf_counter() - started
+        sim_elapsed = self.curr_time - start_time
+
+        if instruments is not None:
+            instruments.detach(self)
+
+        self.metrics = None
+
+        if checkpoint_path is not None:
+            checkpoint.save(self, checkpoint_path)
+
+        summary = {
+            "events": ev_count - 1,
+            "stopped_by": reason,
+            "sim_time": sim_elapsed,
+            "wall_time": elapsed,
+            "events_per_sec": (ev_count - 1) / elapsed if elapsed else 0.0,
+            "sim_wall_ratio": sim_elapsed / elapsed if elapsed else 0.0,
+            "counts": dict(events),
+        }
 
         print("\n\nCounts of events run: \n")
         for e, c in sorted(events.items()):
             print("{:<19} | {}".format(e, c))
         print("{:^19} | {}".format("Total", ev_count - 1))
 
-    def latency(self, a, b, msg_type):
-        """Return latency between nodes a & b."""
+        print("\nStopped by: %s" % reason)
+        print("Simulated time: %.4f s in %.4f s of wall time" % (sim_elapsed, elapsed))
+        print("Events / second: %.1f" % summary["events_per_sec"])
+        print("Simulated / wall time: %.4f" % summary["sim_wall_ratio"])
 
-        i, j = self.nodes.index(a), self.nodes.index(b)
+        orphans = self.orphan_stats
+        summary["orphans"] = dict(orphans, pooled=sum(len(n.orphans) for n in self.nodes))
 
-        # Propagation delays p_ij chosen at start of simulation
-        p = self.prop_delay[i][j]
+        print("\nOrphan blocks: %d received, %d connected, %d evicted, %d still waiting" % (
+            orphans["orphaned"], orphans["connected"], orphans["evicted"],
+            summary["orphans"]["pooled"]
+        ))
 
-        # for a msg of only 1 transaction: assume that |m| = 0
-        if msg_type == "transaction":
-            m = 0
-        # for a msg of a block: assume that |m| = 1 MB (8 × 10**6 b)
-        elif msg_type == "block":
-            m = 8 * (10 ** 6)
-        else:
-            raise ValueError("msg_type")
+        if self.relay == "inv":
+            stats = self.relay_stats
+            summary["relay"] = dict(stats)
 
-        # c_ij is set to 100 Mbps if both i and j are fast
-        if a.is_fast and b.is_fast:
-            c = 100 * (10 ** 6)
-        # and 5 Mbps if either is slow
-        else:
-            c = 5 * (10 ** 6)
+            print("\nRelay (inv): %d messages, %d bytes" % (stats["messages"], stats["bytes"]))
+            print("Saved vs flooding: %d messages, %d bytes" % (
+                stats["flood_messages"] - stats["messages"],
+                stats["flood_bytes"] - stats["bytes"]
+            ))
+
+        if instruments is not None:
+            summary["instruments"] = instruments.report()
+            instruments.print_summary()
 
-        # mean of d_ij is set equal to 96kbit/c_ij
-        d_mean = 12 * 8 * (10 ** 3) / c
+        if metrics is not None:
+            row = summary["metrics"] = metrics.emit(self, self.curr_time)
 
-        # d_ij is the queuing delay on the path
-        # randomly chosen from an exponential distribution with above mean
-        d = random.expovariate(1 / d_mean)
+            print("\nBlocks: %d mined, fork rate %.4f, stale rate %.4f" % (
+                row["blocks"], row["fork_rate"], row["stale_rate"]))
+            print("Propagation to 50%% / 90%% / all nodes (median): %.4f / %.4f / %.4f" % (
+                row["prop50_p50"], row["prop90_p50"], row["prop100_p50"]))
+            print("Confirmation latency (median): %.4f" % row["confirm_p50"])
 
-        # latency is of the form p_ij + |m|/c_ij + d_ij
-        return (p + m / c + d)
+        return summary
 
-    def dump_node_chains(self, pruned=False):
+    def node_item_id(self, node):
         """
-        Save the blockchain tree of every node to .dot files.
+        Return an id for a new block or transaction of node, which depends
+        only on how many node has made before: (made * n) + node id + 1.
+        """
+
+        node.made += 1
+        return (node.made - 1) * self.n + node.id + 1
+
+    def new_block_id(self, node):
+        """Return the id of a new block created by node."""
+
+        self.block_id += 1
+
+        if self.stream.per_node:
+            return self.node_item_id(node)
 
-        Outputs are graphs in graphviz format:
-        https://en.wikipedia.org/wiki/DOT_(graph_description_language)
+        return self.block_id - 1
 
-        To convert them to png run:
+    def new_trans_id(self, node):
+        """Return the id of a new transaction created by node."""
+
+        self.trans_id += 1
+
+        if self.stream.per_node:
+            return self.node_item_id(node)
+
+        return self.trans_id - 1
+
+    def latency(self, a, b, msg_type, size=None):
         """
+        Return latency between nodes a & b.
 
-        for node in self.nodes:
+        size is the serialized size of the message in bytes; if not given,
+        the fixed size for msg_type is assumed.
+        """
 
-            node_type = "fast" if node.is_fast else "slow"
-            prune = "_pruned" if pruned else ""
+        if msg_type not in MSG_SIZE:
+            raise ValueError("msg_type")
 
-            file = "%d_%s%s.dot" % (node.id, node_type, prune)
+        m = MSG_SIZE[msg_type] if size is None else 8 * size
 
-            with open(os.path.join(OUT_DIR, file), "w+") as fh:
+        # With per-node streams, queuing delays come from the sender's stream
+        if self.stream.per_node:
+            q = self.stream("queuing", a.id).expovariate(1)
+            return self.links.latency(a.id, b.id, m, q)
 
-                # Graphviz header format
-                # TODO: Stylish graph nodes etc. (lookup gdot documentation)
-                fh.write("digraph G { \n")
-                fh.write('rankdir="LR";\n\n')
+        return self.links.latency(a.id, b.id, m)
 
-                # Draw edges of the blockchain tree
-                for block in node.blocks.values():
+    def dump_node_chains(self, pruned=False, nodes=None):
+        """
+        Save the blockchain tree of every node (or of the nodes with the
+        given ids) to .dot files, or only their longest chains if pruned.
 
-                    if block.prev_block_id != -1:
-                        edge = "\t%d -> %d\n" % (block.prev_block_id, block.id)
+        For all the nodes at once, export.write is far quicker; .dot files
+        can be drawn from its output later on (see export.py).
+        """
+
+        chosen = self.nodes if nodes is None else [self.nodes[i] for i in nodes]
 
-                        fh.write(edge)
+        for node in chosen:
+            blocks = node.ancestors() if pruned else node.blocks.values()
 
-                    # else:
-                    #     edge = "%d\n" % block.id
+            edges = [
+                (block.prev_block_id, block.id) for block in blocks
+                if block.prev_block_id != -1
+            ]
 
-                # Close the graph
-                fh.write("\n}")
+            path = os.path.join(OUT_DIR, export.dot_name(node.id, node.is_fast, pruned))
+            export.write_dot(path, edges)
 
     def dump_network(self):
         """
@@ -254,14 +618,6 @@ class Simulator(object):
 
             fh.write("\n}")
 
-    def prune_node_chains(self):
-        """
-        Remove all blocks except the longest chain.
-        """
-
-        for node in self.nodes:
-            node.blocks = {b.id: b for b in node.longest_chain()}
-
     def convert_graphs(self):
         """
         Convert all .dot files to .png files.
@@ -0,0 +1,92 @@
+"""
+Independent, named streams of random numbers, all derived from one seed.
+
+Every part of the simulation that draws random numbers uses its own stream
+(and optionally, one per node), so a run is fully determined by its seed,
+and a change in how one part uses randomness doesn't shift the draws of
+all the others.
+"""
+
+import hashlib
+import random
+
+
+def derive_seed(seed, *key):
+    """Return a 64 bit seed for the stream called key, from the root seed."""
+
+    # Unlike hash(), this is the same in every process and Python version
+    digest = hashlib.sha256(repr((seed,) + key).encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+class Streams(object):
+    """
+    Hands out random.Random streams by name, creating each on first use.
+
+    With per_node, stream(name, i) is a separate stream for node i; without
+    it, all nodes share the stream of that name (which keeps memory low for
+    very large networks: a random.Random holds a few KB of state).
+    """
+
+    def __init__(self, seed, per_node=False):
+        self.seed = seed
+        self.per_node = per_node
+
+        self._streams = {}
+
+        # Names of the streams that have been created for single nodes
+        self._node_names = set()
+
+    def seed_for(self, name):
+        """Return the seed of a named stream, for other kinds of generators."""
+        return derive_seed(self.seed, name)
+
+    def __call__(self, name, node_id=None):
+        key = (name, node_id) if self.per_node and node_id is not None else (name,)
+
+        stream = self._streams.get(key)
+
+        if stream is None:
+            stream = self._streams[key] = random.Random(derive_seed(self.seed, *key))
+
+            if len(key) == 2:
+                self._node_names.add(name)
+
+        return stream
+
+    def reseed(self, seed):
+        """
+        Derive every stream from a new seed, from now on. Streams are reseeded
+        in place, since other objects keep references to them.
+        """
+
+        self.seed = seed
+
+        for key, stream in self._streams.items():
+            stream.seed(derive_seed(seed, *key))
+
+    def save(self, node_id):
+        """Return the state of node_id's own streams, by name."""
+
+        saved = {}
+
+        for name in self._node_names:
+            stream = self._streams.get((name, node_id))
+
+            if stream is not None:
+                saved[name] = stream.getstate()
+
+        return saved
+
+    def restore(self, node_id, saved):
+        """Put node_id's streams back into a state returned by save."""
+
+        for name in self._node_names:
+            key = (name, node_id)
+
+            if name in saved:
+                self._streams[key].setstate(saved[name])
+
+            # Not created yet back then: it'll start over from its seed
+            elif key in self._streams:
+                del self._streams[key]
@@ -0,0 +1,289 @@
+"""
+Parameter sweeps & Monte Carlo replications, run in parallel.
+
+Every combination of the given n, z, tm & bm is simulated --reps times.
+Each job gets its own seed, spawned from --seed, so the jobs are
+independent of each other and of the order they run in. Results are
+appended to a JSON lines file as jobs finish; running the same sweep again
+skips the jobs already in it, so an interrupted sweep picks up where it
+stopped. Finally, the metrics of every parameter combination are merged
+into one table of means with 95% confidence intervals.
+
+For eg: python3 sweep.py --n 10 20 --z 0.3 0.5 --tm 3 --bm 10 --reps 20
+"""
+
+import io
+import os
+import json
+import math
+import zlib
+import argparse
+import itertools
+import contextlib
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from scheduler import SCHEDULERS
+from simulation import OUT_DIR, Simulator
+from topology import TOPOLOGIES
+
+# Parameters of a simulation that can be swept over
+PARAMS = ("n", "z", "tm", "bm")
+
+# Metrics reported for each job, and merged in the table
+METRICS = (
+    "events", "sim_time", "events_per_sec", "blocks", "height", "fork_rate",
+    "orphans",
+)
+
+# 97.5% quantiles of Student's t distribution, by degrees of freedom
+T_975 = (
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+)
+
+
+def t_975(df):
+    """Return the 97.5% quantile of the t distribution with df degrees of freedom."""
+    return T_975[df - 1] if df <= len(T_975) else 1.960
+
+
+def mean_ci(values):
+    """Return the mean of values, and the half width of its 95% CI."""
+
+    n = len(values)
+    mean = sum(values) / n
+
+    if n < 2:
+        return mean, float("nan")
+
+    var = sum((v - mean) ** 2 for v in values) / (n - 1)
+
+    return mean, t_975(n - 1) * math.sqrt(var / n)
+
+
+def job_key(job):
+    """Identify a job by its parameters, replication number & sweep seed."""
+    return tuple(job[p] for p in PARAMS) + (job["rep"], job["sweep_seed"])
+
+
+def make_jobs(args):
+    """Return the jobs of a sweep, each with its own seed."""
+
+    values = [getattr(args, p) for p in PARAMS]
+    points = zip(*values) if args.zip else itertools.product(*values)
+
+    jobs = [
+        dict(zip(PARAMS, point), rep=rep, sweep_seed=args.seed)
+        for point in points for rep in range(args.reps)
+    ]
+
+    # Independent streams for every job, from a single seed. They only
+    # depend on the job itself, so that extending a sweep with more values
+    # or replications leaves the seeds of the jobs already done unchanged
+    for job in jobs:
+        point = zlib.crc32(json.dumps([job[p] for p in PARAMS]).encode())
+        ss = np.random.SeedSequence([args.seed, point, job["rep"]])
+
+        job["seed"] = int(ss.generate_state(1, np.uint64)[0])
+
+    return jobs
+
+
+def run_job(job, options):
+    """Run a single simulation (in a worker process), return its metrics."""
+
+    # Workers run quietly: the summary of every run is in the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = Simulator(job["n"], job["z"], job["tm"], job["bm"],
+                        seed=job["seed"], **options["sim"])
+
+        summary = sim.run(options["until"], quiet=True,
+                          until_time=options["until_time"])
+
+    blocks = sim.block_id - 1
+    height = sum(node.height for node in sim.nodes) / len(sim.nodes)
+
+    result = dict(job)
+    result.update(
+        events=summary["events"],
+        sim_time=summary["sim_time"],
+        events_per_sec=summary["events_per_sec"],
+        blocks=blocks,
+        height=height,
+
+        # Share of the blocks mined that didn't end up in a longest chain
+        fork_rate=1 - height / blocks if blocks else 0.0,
+
+        orphans=summary["orphans"].get("orphaned", 0),
+    )
+
+    return result
+
+
+def load(path):
+    """Return the results already in a results file, by job key."""
+
+    done = {}
+
+    if os.path.exists(path):
+        with open(path) as fh:
+            for line in fh:
+                # A sweep killed mid-write can leave a partial last line
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+
+                done[job_key(result)] = result
+
+    return done
+
+
+def done_cleanly(path):
+    """Check whether a results file ends with a complete line."""
+
+    with open(path, "rb") as fh:
+        fh.seek(-1, os.SEEK_END)
+        return fh.read(1) == b"\n"
+
+
+def table(results):
+    """Merge the results of each parameter combination into table rows."""
+
+    groups = {}
+    for result in results:
+        groups.setdefault(job_key(result)[:-2], []).append(result)
+
+    rows = []
+    for point in sorted(groups):
+        group = groups[point]
+
+        row = dict(zip(PARAMS, point), reps=len(group))
+        for m in METRICS:
+            row[m] = mean_ci([r[m] for r in group])
+
+        rows.append(row)
+
+    return rows
+
+
+def print_table(rows):
+    head = ["%6s" % p for p in PARAMS] + ["%5s" % "reps"]
+    head += ["%23s" % m for m in METRICS]
+    print(" ".join(head))
+
+    for row in rows:
+        line = ["%6g" % row[p] for p in PARAMS] + ["%5d" % row["reps"]]
+        line += ["%12.4g ± %-8.3g" % row[m] for m in METRICS]
+        print(" ".join(line))
+
+
+def sweep(args):
+    jobs = make_jobs(args)
+
+    done = load(args.out)
+    todo = [job for job in jobs if job_key(job) not in done]
+
+    print(" >>>> %d jobs, %d already done, running %d on %s workers" % (
+        len(jobs), len(jobs) - len(todo), len(todo), args.jobs or "all"
+    ))
+
+    options = {
+        "until": args.until or None,
+        "until_time": args.until_time,
+        "sim": {
+            "scheduler": args.scheduler,
+            "topology": args.topology,
+            "degree": args.degree,
+        },
+    }
+
+    with open(args.out, "a") as fh, ProcessPoolExecutor(args.jobs) as pool:
+
+        # Don't append to a partial line left behind by a killed sweep
+        if fh.tell() and not done_cleanly(args.out):
+            fh.write("\n")
+
+        futures = [pool.submit(run_job, job, options) for job in todo]
+
+        for i, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+
+            # One line per job, flushed, so that finished jobs survive a kill
+            fh.write(json.dumps(result) + "\n")
+            fh.flush()
+
+            done[job_key(result)] = result
+            print(" >>>> [%d/%d] done: %s" % (i, len(todo), job_key(result)))
+
+    print()
+    rows = table(done[job_key(job)] for job in jobs)
+    print_table(rows)
+
+    return rows
+
+
+P = argparse.ArgumentParser(
+    description='Run parameter sweeps of the simulator in parallel.',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+
+P.add_argument('--n', type=int, nargs="+", default=[10],
+               help='Numbers of nodes')
+
+P.add_argument('--z', type=float, nargs="+", default=[0.4],
+               help='Fractions of slow nodes')
+
+P.add_argument('--tm', type=float, nargs="+", default=[5],
+               help='Mean transaction interarrival times')
+
+P.add_argument('--bm', type=float, nargs="+", default=[10],
+               help='Mean block interarrival times')
+
+P.add_argument('--zip', action="store_true",
+               help='Take the i-th value of every parameter together, '
+                    'instead of all combinations')
+
+P.add_argument('--reps', type=int, default=10,
+               help='Replications of each parameter combination')
+
+P.add_argument('--seed', type=int, default=0,
+               help='Seed that the seed of every job is derived from')
+
+P.add_argument('--until', type=int, default=0,
+               help='Maximum number of events of each run (0 for no limit)')
+
+P.add_argument('--until-time', type=float, default=100.0,
+               help='Simulated time of each run')
+
+P.add_argument('--scheduler', choices=sorted(SCHEDULERS), default="heap",
+               help='Event queue implementation')
+
+P.add_argument('--topology', choices=sorted(TOPOLOGIES), default="regular",
+               help='Shape of the peer-to-peer network')
+
+P.add_argument('--degree', type=int, default=8,
+               help='Average number of peers of a node')
+
+P.add_argument('--jobs', type=int, default=None,
+               help='Worker processes (all cores by default)')
+
+P.add_argument('--out', default=os.path.join(OUT_DIR, "sweep.jsonl"),
+               help='Results file, also used to resume an interrupted sweep')
+
+
+if __name__ == '__main__':
+
+    args = P.parse_args()
+
+    if args.zip and len(set(len(getattr(args, p)) for p in PARAMS)) > 1:
+        P.error("--zip needs the same number of values for n, z, tm & bm")
+
+    if args.degree < 1:
+        P.error("--degree must be at least 1")
+
+    sweep(args)
@@ -0,0 +1,58 @@
+"""
+Check the "global" arrivals mode: nodes are picked in proportion to their
+weights, and the clocks run at the total rate of all the nodes.
+"""
+
+from collections import Counter
+
+from simulation import Simulator
+
+
+def make_sim(hash_power="equal", tx_rate="equal"):
+    return Simulator(8, 0.5, 3, 10, seed=1, topology="regular", degree=3,
+                     arrivals="global", hash_power=hash_power, tx_rate=tx_rate)
+
+
+def test_pick_node():
+    weights = [1, 2, 3, 4, 6, 8, 0.5, 0.5]
+    sim = make_sim(hash_power=weights)
+
+    draws = 100000
+    picked = Counter(sim.pick_node(sim.hash_power_cum, "mining") for _ in range(draws))
+
+    total = sum(weights)
+    for i, w in enumerate(weights):
+        assert abs(picked[i] / draws - w / total) < 0.01, (i, picked[i])
+
+
+def test_total_rates():
+    sim = make_sim(hash_power="random", tx_rate="random")
+
+    # Weights are scaled to an average of 1, so the totals are n/bm & n/tm
+    assert abs(sim.hash_power_cum[-1] / sim.bm - sim.n / sim.bm) < 1e-9
+    assert abs(sim.tx_rate_cum[-1] / sim.tm - sim.n / sim.tm) < 1e-9
+
+    draws = 50000
+    mean_block = sum(sim.block_delay() for _ in range(draws)) / draws
+    mean_tx = sum(sim.transaction_delay() for _ in range(draws)) / draws
+
+    assert abs(mean_block - sim.bm / sim.n) < 0.05 * sim.bm / sim.n
+    assert abs(mean_tx - sim.tm / sim.n) < 0.05 * sim.tm / sim.n
+
+
+def test_no_block_generate():
+    sim = make_sim()
+    sim.run(until=2000, quiet=True)
+
+    # The BlockClock mines for every node, none of them restarts mining
+    assert sim.block_id > 1
+    assert all(node.epoch == 0 and not node.mining for node in sim.nodes)
+
+
+if __name__ == '__main__':
+
+    test_pick_node()
+    test_total_rates()
+    test_no_block_generate()
+
+    print("arrivals | ok")
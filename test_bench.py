@@ -0,0 +1,47 @@
+"""
+Check that benchmark scenarios run the same work every time, and that
+regressions against a baseline are flagged.
+"""
+
+from bench import compare, run_scenario
+
+
+def test_scenario():
+    result = run_scenario("n10-sparse", events=2000)
+    again = run_scenario("n10-sparse", events=2000)
+
+    assert result["events"] == again["events"] == 2000
+    assert result["sim_time"] == again["sim_time"]
+
+    assert result["events_per_sec"] > 0 and result["peak_rss_mb"] > 0
+    assert result["peak_queue_depth"] >= result["queue_depth"] > 0
+
+    assert set(result["setup"]) == {
+        "create_nodes", "set_random_peers", "latency", "seed_events_queue"}
+
+
+def test_compare():
+    base = {"scenario": "a", "events_per_sec": 1000.0, "peak_rss_mb": 100.0,
+            "setup_total": 1.0}
+    baseline = {"a": base}
+
+    # Within the threshold, or better: nothing to flag
+    same = dict(base, events_per_sec=950.0, peak_rss_mb=50.0, setup_total=0.5)
+    assert compare([same], baseline, 0.1) == []
+
+    slower = dict(base, events_per_sec=800.0, setup_total=1.5)
+    assert [r[:2] for r in compare([slower], baseline, 0.1)] == [
+        ("a", "events_per_sec"), ("a", "setup_total")]
+
+    # Scenarios not in the baseline, and tiny setups, aren't compared
+    quick = {"b": dict(base, scenario="b", setup_total=0.001)}
+    assert compare([dict(base, scenario="b", setup_total=0.01)], quick, 0.1) == []
+    assert compare([dict(base, scenario="c")], baseline, 0.1) == []
+
+
+if __name__ == '__main__':
+
+    test_scenario()
+    test_compare()
+
+    print("bench | ok")
@@ -0,0 +1,94 @@
+"""
+Check that a run resumed from a checkpoint carries on exactly as if it had
+never stopped, and that forks of a checkpoint are repeatable.
+"""
+
+import os
+import tempfile
+
+import checkpoint
+
+from simulation import Simulator
+from test_streams import snapshot
+
+
+def build(**kwargs):
+    return Simulator(20, 0.5, 1, 5, seed=7, topology="random", degree=4, **kwargs)
+
+
+def check_resume(**kwargs):
+    straight = build(**kwargs)
+    straight.run(until=None, until_time=20, quiet=True)
+
+    path = os.path.join(tempfile.mkdtemp(), "sim.ckpt")
+
+    # Stopped halfway, with periodic checkpoints along the way
+    first = build(**kwargs)
+    first.run(until=None, until_time=10, quiet=True, checkpoint_path=path,
+              checkpoint_every=500, checkpoint_interval=2.5)
+
+    resumed = checkpoint.load(path)
+    resumed.run(until=None, until_time=20, quiet=True)
+
+    assert snapshot(resumed) == snapshot(straight), kwargs
+    assert (resumed.block_id, resumed.trans_id) == (straight.block_id, straight.trans_id)
+
+    return resumed
+
+
+def test_resume():
+    for kwargs in ({}, {"scheduler": "calendar", "relay": "inv"},
+                   {"scheduler": "ladder", "multicast": True},
+                   {"per_node_streams": True}, {"arrivals": "global"}):
+        check_resume(**kwargs)
+
+
+def test_shared_blocks():
+    sim = check_resume()
+
+    # Blocks come back shared by the nodes, not one copy each
+    a, b = sim.nodes[0], sim.nodes[1]
+    shared = set(a.blocks) & set(b.blocks)
+
+    assert len(shared) > 1
+    assert all(a.blocks[i] is b.blocks[i] for i in shared)
+    assert all(peer is sim.nodes[peer.id] for node in sim.nodes for peer in node.peers)
+
+
+def test_fork():
+    path = os.path.join(tempfile.mkdtemp(), "warm.ckpt")
+
+    warm = build()
+    warm.run(until=None, until_time=10, quiet=True, checkpoint_path=path)
+
+    def branch(k):
+        sim = checkpoint.fork(path, k)
+        sim.run(until=None, until_time=20, quiet=True)
+        return snapshot(sim)
+
+    assert branch(1) == branch(1)
+    assert branch(1) != branch(2)
+
+
+def test_not_a_checkpoint():
+    path = os.path.join(tempfile.mkdtemp(), "junk.ckpt")
+
+    with open(path, "wb") as fh:
+        fh.write(b"not a checkpoint")
+
+    try:
+        checkpoint.load(path)
+    except ValueError:
+        pass
+    else:
+        assert False, "loaded junk"
+
+
+if __name__ == '__main__':
+
+    test_resume()
+    test_shared_blocks()
+    test_fork()
+    test_not_a_checkpoint()
+
+    print("checkpoint | ok")
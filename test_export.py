@@ -0,0 +1,105 @@
+"""
+Check that the export of all blockchains holds every node's tree, arrival
+times & longest chain, and that .dot files drawn from it match those drawn
+from the nodes themselves.
+"""
+
+import os
+import tempfile
+
+import export
+import simulation
+
+from simulation import Simulator
+
+
+def exported(**kwargs):
+    sim = Simulator(12, 0.5, 1, 2, seed=4, topology="random", degree=3, **kwargs)
+    sim.run(until=None, until_time=30, quiet=True)
+
+    path = os.path.join(tempfile.mkdtemp(), "chains.jsonl")
+    count = export.write(sim, path)
+
+    header, records = export.read(path)
+    records = list(records)
+
+    assert count == len(records)
+
+    return sim, header, records, path
+
+
+def test_round_trip():
+    for kwargs in ({}, {"relay": "inv", "multicast": True}):
+        sim, header, records, _ = exported(**kwargs)
+
+        assert header["n"] == sim.n
+        assert header["tips"] == [node.tip.id for node in sim.nodes]
+
+        # Parents come before their children
+        done = set()
+        for rec in records:
+            assert rec["prev"] == -1 or rec["prev"] in done
+            done.add(rec["id"])
+
+        for node in sim.nodes:
+            arrived = dict(
+                (rec["id"], rec["arrived"][rec["seen"].index(node.id)])
+                for rec in records if node.id in rec["seen"]
+            )
+            chain = set(rec["id"] for rec in records if node.id in rec["main"])
+
+            assert arrived == node.arrived_at
+            assert chain == set(bk.id for bk in node.ancestors())
+
+        # Some blocks didn't make it into the longest chains
+        assert any(len(rec["main"]) < len(rec["seen"]) for rec in records)
+
+
+def test_dot():
+    sim, _, _, path = exported()
+
+    out = tempfile.mkdtemp()
+    old_dir, simulation.OUT_DIR = simulation.OUT_DIR, out
+
+    try:
+        blocks = [len(node.blocks) for node in sim.nodes]
+
+        for pruned in (False, True):
+            sim.dump_node_chains(pruned=pruned, nodes=[1, 4])
+
+            # Drawing the pruned chains leaves the trees of the nodes alone
+            assert [len(node.blocks) for node in sim.nodes] == blocks
+
+            drawn = export.dot_from_export(path, [1, 4], tempfile.mkdtemp(), pruned)
+
+            for fn in drawn:
+                with open(fn) as a, open(os.path.join(out, os.path.basename(fn))) as b:
+                    assert sorted(a) == sorted(b)
+    finally:
+        simulation.OUT_DIR = old_dir
+
+    # The full & pruned chains of each of the two nodes
+    assert len(os.listdir(out)) == 4
+
+
+def test_not_an_export():
+    path = os.path.join(tempfile.mkdtemp(), "junk.jsonl")
+
+    with open(path, "w") as fh:
+        fh.write("junk\n")
+
+    try:
+        export.read(path)
+    except ValueError:
+        pass
+    else:
+        assert False, "read junk"
+
+
+if __name__ == '__main__':
+
+    test_round_trip()
+    test_dot()
+    test_not_an_export()
+
+    print("export | ok")
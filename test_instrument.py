@@ -0,0 +1,76 @@
+"""
+Check that instrumenting a run counts its events & queue operations right,
+and doesn't change how the run plays out.
+"""
+
+from simulation import Simulator
+from instrument import Instruments
+from test_streams import snapshot
+
+
+def build(**kwargs):
+    return Simulator(12, 0.5, 1, 5, seed=3, topology="random", degree=3, **kwargs)
+
+
+def instrumented(**kwargs):
+    sim = build(**kwargs)
+    queued = len(sim.events)
+
+    ins = Instruments()
+    summary = sim.run(until=None, until_time=20, quiet=True, instruments=ins)
+
+    return sim, ins.report(), summary, queued
+
+
+def test_counts():
+    for kwargs in ({}, {"relay": "inv"}, {"multicast": True}, {"arrivals": "global"}):
+        sim, report, summary, queued = instrumented(**kwargs)
+
+        runs = dict((label, k["runs"]) for label, k in report["kinds"].items())
+        assert runs == summary["counts"], kwargs
+        assert report["events"] == report["queue"]["pops"] == summary["events"]
+
+        # Everything pushed was either popped, compacted away or is still queued
+        queue = report["queue"]
+        assert queue["depth"] == len(sim.events)
+        assert queued + queue["pushes"] - queue["pops"] - sim.compacted == len(sim.events)
+        assert queue["peak_depth"] >= queue["depth"]
+
+        assert report["latency_calls"] > 0 and report["discarded"] > 0
+        assert "instruments" in summary
+
+
+def test_flood():
+    sim, report, _, _ = instrumented()
+    kinds = report["kinds"]
+
+    # Without multicast, every delivery was scheduled with its own latency
+    delivered = kinds["TransactionReceive"]["runs"] + kinds["BlockReceive"]["runs"]
+    assert report["latency_calls"] >= delivered
+
+    # A node takes in a transaction once: on arrival, or when it made it
+    taken = sum(len(node.transactions) for node in sim.nodes)
+    made = kinds["TransactionGenerate"]["runs"]
+    receive = kinds["TransactionReceive"]
+
+    assert receive["runs"] - receive["discarded"] == taken - made
+
+
+def test_unchanged():
+    for kwargs in ({}, {"relay": "inv", "scheduler": "calendar"}):
+        plain = build(**kwargs)
+        plain.run(until=None, until_time=20, quiet=True)
+
+        sim, _, _, _ = instrumented(**kwargs)
+
+        assert snapshot(sim) == snapshot(plain), kwargs
+        assert "latency" not in vars(sim)
+
+
+if __name__ == '__main__':
+
+    test_counts()
+    test_flood()
+    test_unchanged()
+
+    print("instrument | ok")
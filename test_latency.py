@@ -0,0 +1,26 @@
+"""
+Check that propagation delays don't change once a link has been used.
+"""
+
+from latency import LatencyEngine
+
+
+def test_prop_delay_stable():
+    peers = [[1, 2], [0, 2], [0, 1]]
+    links = LatencyEngine([True, False, True], peers, seed=7)
+
+    for i, p in enumerate(peers):
+        for j in p:
+            first = links.prop_delay(i, j)
+            assert links.prop_delay(i, j) == first
+
+    # Same seed, same delays, whatever order the links are used in
+    other = LatencyEngine([True, False, True], peers, seed=7)
+    assert other.prop_delay(2, 1) == links.prop_delay(2, 1)
+
+
+if __name__ == '__main__':
+
+    test_prop_delay_stable()
+
+    print("latency | ok")
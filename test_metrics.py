@@ -0,0 +1,145 @@
+"""
+Check the metrics kept as a run goes against the same figures worked out
+from the nodes once it's over, and the P2 quantile sketches against exact
+quantiles.
+"""
+
+import os
+import csv
+import json
+import math
+import random
+import tempfile
+
+import numpy as np
+
+from metrics import Metrics, P2Quantile
+from simulation import Simulator
+from test_streams import snapshot
+
+
+def build(**kwargs):
+    return Simulator(16, 0.4, 1, 3, seed=5, topology="random", degree=3, **kwargs)
+
+
+def followed(path=None, **kwargs):
+    sim = build(**kwargs)
+
+    metrics = Metrics(sim.n, path, every=5)
+    summary = sim.run(until=None, until_time=40, quiet=True, metrics=metrics)
+    metrics.close()
+
+    return sim, metrics, summary["metrics"]
+
+
+def test_p2():
+    rng = random.Random(1)
+
+    for draw in (rng.random, lambda: rng.expovariate(2), lambda: rng.gauss(5, 1)):
+        values = [draw() for _ in range(20000)]
+
+        for p in (0.5, 0.9, 0.99):
+            q = P2Quantile(p)
+            for v in values:
+                q.add(v)
+
+            exact = np.quantile(values, p)
+            spread = np.quantile(values, 0.999) - np.quantile(values, 0.001)
+
+            assert abs(q.value() - exact) < 0.02 * spread, (p, q.value(), exact)
+
+    # Exact for a handful of values
+    q = P2Quantile(0.5)
+    for v in (3, 1, 2):
+        q.add(v)
+
+    assert q.value() == 2
+    assert math.isnan(P2Quantile(0.9).value())
+
+
+def test_against_nodes():
+    for kwargs in ({}, {"relay": "inv"}, {"multicast": True}, {"arrivals": "global"}):
+        sim, metrics, row = followed(**kwargs)
+        n = sim.n
+
+        # Every block but genesis, and the times it reached nodes
+        known, blocks = {}, {}
+        for node in sim.nodes:
+            known.update(node.blocks)
+
+            for i, at in node.arrived_at.items():
+                if i:
+                    blocks.setdefault(i, []).append(at)
+
+        # Time for every block to reach half & all of the nodes
+        half, full = [], []
+        for i, times in blocks.items():
+            created = known[i].created_at
+
+            times.sort()
+            if len(times) >= math.ceil(n / 2):
+                half.append(times[math.ceil(n / 2) - 1] - created)
+            if len(times) == n:
+                full.append(times[-1] - created)
+
+        assert row["prop50_count"] == len(half) and row["prop100_count"] == len(full)
+        assert abs(row["prop50_max"] - max(half)) < 1e-9
+        assert abs(row["prop100_max"] - max(full)) < 1e-9
+        assert abs(row["prop100_mean"] - sum(full) / len(full)) < 1e-9
+        assert row["spreading"] == len(blocks) - len(full)
+
+        mined = len(blocks)
+        height = max(node.height for node in sim.nodes)
+        heights = {}
+        for bk in known.values():
+            heights.setdefault(len(bk), set()).add(bk.id)
+
+        assert row["blocks"] == mined and row["height"] == height, kwargs
+        assert row["stale_rate"] == (mined - height) / mined
+        assert row["forks"] == sum(1 for h, ids in heights.items() if h and len(ids) > 1)
+
+        assert 0 < row["chain_share_min"] <= row["chain_share_mean"] <= 1
+        assert 0 < row["tip_agreement"] <= 1
+
+        # Every transaction made is waiting for a block, or was put in one
+        assert row["confirm_count"] + row["unconfirmed"] == sim.trans_id - 1
+        assert row["confirm_count"] > 0
+
+
+def test_rows():
+    tmp = tempfile.mkdtemp()
+
+    for name in ("metrics.csv", "metrics.jsonl"):
+        path = os.path.join(tmp, name)
+        _, metrics, last = followed(path)
+
+        with open(path) as fh:
+            if name.endswith(".csv"):
+                rows = list(csv.DictReader(fh))
+            else:
+                rows = [json.loads(line) for line in fh]
+
+        # Every 5 units of time up to 40, and once the run stopped
+        assert len(rows) == metrics.rows == 8
+        assert [float(r["time"]) for r in rows[:-1]] == [5, 10, 15, 20, 25, 30, 35]
+        assert float(rows[-1]["blocks"]) == last["blocks"]
+
+
+def test_unchanged():
+    plain = build(relay="inv")
+    plain.run(until=None, until_time=40, quiet=True)
+
+    sim, _, _ = followed(relay="inv")
+
+    assert snapshot(sim) == snapshot(plain)
+    assert sim.metrics is None
+
+
+if __name__ == '__main__':
+
+    test_p2()
+    test_against_nodes()
+    test_rows()
+    test_unchanged()
+
+    print("metrics | ok")
@@ -0,0 +1,65 @@
+"""
+Check that restarting mining cancels the pending BlockGenerate events.
+"""
+
+from events import BlockGenerate
+from simulation import Simulator
+
+
+def drain(sim):
+    """Empty the queue, returning the BlockGenerate events that were in it."""
+
+    found = []
+
+    while not sim.events.empty():
+        ev = sim.events.get()
+
+        if isinstance(ev, BlockGenerate):
+            found.append(ev)
+
+    return found
+
+
+def test_one_live_event_per_node():
+    for scheduler in ("heap", "calendar", "ladder"):
+        sim = Simulator(10, 0.5, 1, 5, seed=3, scheduler=scheduler,
+                        topology="regular", degree=3)
+        sim.run(until=3000, quiet=True)
+
+        mining = [node.id for node in sim.nodes if node.mining]
+
+        events = drain(sim)
+        live = [ev.node_id for ev in events if not ev.stale(sim)]
+
+        assert sim.stale_events == len(events) - len(live)
+        assert sorted(live) == mining
+
+
+def run_compacted(compact):
+    sim = Simulator(10, 0.5, 2, 1, seed=4, topology="regular", degree=3)
+    sim.run(until=None, until_time=20, quiet=True)
+
+    if compact:
+        queued = len(sim.events)
+        sim.compact_events()
+
+        assert sim.stale_events == 0
+        assert len(sim.events) < queued
+
+    # Stale events don't use any randomness, so dropping them early
+    # mustn't change the rest of the run
+    sim.run(until=None, until_time=40, quiet=True)
+
+    return [(node.tip.id, node.coins) for node in sim.nodes]
+
+
+def test_compaction():
+    assert run_compacted(True) == run_compacted(False)
+
+
+if __name__ == '__main__':
+
+    test_one_live_event_per_node()
+    test_compaction()
+
+    print("mining | ok")
@@ -0,0 +1,37 @@
+"""
+Check that multicast fan-out gives exactly the same simulation as sending
+one event per peer, from the same seed.
+"""
+
+from simulation import Simulator
+
+
+def snapshot(sim):
+    return [
+        (node.tip.id, dict(node.arrived_at), sorted(node.mempool), node.coins)
+        for node in sim.nodes
+    ]
+
+
+def simulate(multicast, relay, seed):
+    sim = Simulator(12, 0.5, 1, 20, seed=seed, topology="regular", degree=4,
+                    multicast=multicast, relay=relay)
+
+    # Multicasts run as fewer events, so stop both at the same time instead
+    sim.run(until=None, until_time=15, quiet=True)
+
+    return snapshot(sim)
+
+
+def test_multicast_same_run():
+    for relay in ("flood", "inv"):
+        for seed in range(3):
+            expected = simulate(False, relay, seed)
+            assert simulate(True, relay, seed) == expected, (relay, seed)
+
+
+if __name__ == '__main__':
+
+    test_multicast_same_run()
+
+    print("multicast | ok")
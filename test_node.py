@@ -0,0 +1,124 @@
+"""
+Check the state a node keeps up to date as blocks arrive against the same
+state recomputed from scratch, on random block trees.
+"""
+
+import random
+
+from block import Block, Transaction
+from node import GENESIS, Node
+
+
+def full_scan(node):
+    """The tip as originally found: a scan over every block of the node."""
+
+    longest_bk = node.blocks[0]
+
+    for bk in node.blocks.values():
+
+        # Use block creation time to break ties in case of equal length
+        if ((len(bk) > len(longest_bk)) or ((len(bk) == len(longest_bk)) and
+                                            (bk.created_at < longest_bk.created_at))):
+            longest_bk = bk
+
+    return longest_bk
+
+
+def random_tree(rnd, size, txns=()):
+    """
+    Return size random blocks (genesis excluded) in an order in which they
+    could arrive, i.e. every block after its parent.
+
+    Blocks include a few of txns, never one already in their own chain (but
+    competing forks often include the same ones).
+    """
+
+    blocks = [GENESIS]
+
+    # Ids of the transactions in the chain ending at each block
+    spent = {0: frozenset()}
+
+    for i in range(1, size + 1):
+        # Prefer recent blocks as parents, so that some chains get long
+        prev = blocks[max(0, len(blocks) - 1 - int(rnd.expovariate(0.3)))]
+
+        unspent = [tx for tx in txns if tx.id not in spent[prev.id]]
+        chosen = rnd.sample(unspent, min(len(unspent), rnd.randint(0, 4)))
+
+        spent[i] = spent[prev.id] | set(tx.id for tx in chosen)
+
+        # Few distinct times, so that ties on created_at happen too
+        blocks.append(Block(i, rnd.randint(0, 20), rnd.randrange(5),
+                            prev.id, len(prev) + 1, chosen))
+
+    # Random arrival order that still has parents before their children
+    pending = blocks[1:]
+    arrived = {0}
+    order = []
+
+    while pending:
+        ready = [bk for bk in pending if bk.prev_block_id in arrived]
+        bk = rnd.choice(ready)
+
+        pending.remove(bk)
+        arrived.add(bk.id)
+        order.append(bk)
+
+    return order
+
+
+def test_tip():
+    for seed in range(50):
+        rnd = random.Random(seed)
+        node = Node(0, 0, True)
+
+        for bk in random_tree(rnd, 60):
+            node.add_block(bk)
+            assert node.tip is full_scan(node), seed
+
+
+def test_reorg_mempool():
+    for seed in range(50):
+        rnd = random.Random(seed)
+        node = Node(0, 0, True, mempool_order=rnd.choice(["age", "fee"]))
+
+        txns = [Transaction(i, 0, 1, 1, rnd.random()) for i in range(1, 40)]
+        blocks = random_tree(rnd, 60, txns)
+
+        # Mix the transactions in between the blocks, which keep their order
+        steps = [None] * len(blocks) + [("tx", tx) for tx in txns]
+        rnd.shuffle(steps)
+
+        it = iter(blocks)
+        steps = [s or ("block", next(it)) for s in steps]
+
+        for kind, item in steps:
+
+            if kind == "tx":
+                node.add_transaction(item)
+                continue
+
+            # As in BlockReceive: first learn the block's transactions
+            for tx in item.transactions:
+                if tx.id not in node.transactions:
+                    node.add_transaction(tx)
+
+            node.add_block(item)
+
+            confirmed = set(tx.id for bk in node.ancestors()
+                            for tx in bk.transactions)
+
+            assert node.confirmed == confirmed, seed
+            assert set(node.mempool) == set(node.transactions) - confirmed, seed
+
+            # The heap gives the same pick as sorting the whole pool
+            pool = sorted(node.mempool.txns.values(), key=node.mempool._key)
+            assert node.mempool.select(5) == pool[:5], seed
+
+
+if __name__ == '__main__':
+
+    test_tip()
+    test_reorg_mempool()
+
+    print("node | ok")
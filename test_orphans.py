@@ -0,0 +1,74 @@
+"""
+Check that blocks arriving before their parent are connected once it does.
+"""
+
+import random
+
+from block import Block
+from events import BlockReceive
+from node import GENESIS
+from orphans import OrphanPool
+from simulation import Simulator
+
+
+def chain(length, first_id=1, parent=GENESIS):
+    """Return a chain of blocks on top of parent."""
+
+    blocks = []
+
+    for i in range(length):
+        blocks.append(Block(first_id + i, float(i), 0, parent.id, len(parent) + 1))
+        parent = blocks[-1]
+
+    return blocks
+
+
+def test_pool_eviction():
+    blocks = chain(5)
+
+    pool = OrphanPool(limit=3)
+    for bk in blocks[:3]:
+        assert pool.add(bk) is None
+
+    # Full: the oldest one makes room
+    assert pool.add(blocks[3]) is blocks[0]
+    assert len(pool) == 3 and blocks[0].id not in pool
+
+    assert pool.pop_children(blocks[1].id) == [blocks[2]]
+    assert pool.pop_children(blocks[1].id) == []
+    assert len(pool) == 2
+
+    # A limit of 0 keeps nothing
+    assert OrphanPool(limit=0).add(blocks[4]) is blocks[4]
+
+
+def test_cascade():
+    sim = Simulator(4, 0.5, 5, 10, seed=5, topology="regular", degree=2)
+    node = sim.nodes[0]
+
+    # A main chain & a longer fork off its first block, all out of order
+    main = chain(4)
+    fork = chain(5, first_id=10, parent=main[0])
+
+    arrivals = main[1:] + fork[::-1]
+    random.Random(5).shuffle(arrivals)
+
+    for t, bk in enumerate(arrivals):
+        BlockReceive.receive(sim, bk, node.id, float(t))
+
+    assert node.tip is GENESIS
+    assert len(node.orphans) == len(arrivals)
+
+    BlockReceive.receive(sim, main[0], node.id, 100.0)
+
+    assert len(node.orphans) == 0
+    assert node.tip is fork[-1]
+    assert sim.orphan_stats["connected"] == len(arrivals)
+
+
+if __name__ == '__main__':
+
+    test_pool_eviction()
+    test_cascade()
+
+    print("orphans | ok")
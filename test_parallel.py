@@ -0,0 +1,53 @@
+"""
+Check that the parallel engine gives exactly the results of a sequential
+run from the same seed.
+"""
+
+from parallel import ParallelSimulator, node_state
+from simulation import Simulator
+
+ARGS = (16, 0.5, 1, 4)
+
+
+def sequential(until_time, **kwargs):
+    sim = Simulator(*ARGS, per_node_streams=True, **kwargs)
+    sim.run(until=None, until_time=until_time, quiet=True)
+
+    return dict((node.id, node_state(node)) for node in sim.nodes), sim
+
+
+def check_same(parts, until_time=20, **kwargs):
+    expected, sim = sequential(until_time, **kwargs)
+
+    par = ParallelSimulator(parts, *ARGS, **kwargs)
+    summary = par.run(until_time, quiet=True)
+
+    assert par.nodes == expected, (parts, kwargs)
+    assert summary["blocks"] == sim.block_id - 1
+
+    return summary
+
+
+def test_flood():
+    summary = check_same(3, seed=1, topology="regular", degree=3)
+
+    assert summary["messages"] > 0
+    assert summary["lookahead"] >= 0.0099
+
+
+def test_inv_multicast():
+    check_same(2, seed=2, topology="random", degree=3, relay="inv")
+    check_same(4, seed=3, topology="small-world", degree=4, multicast=True)
+
+
+def test_one_partition():
+    check_same(1, seed=4, topology="regular", degree=3)
+
+
+if __name__ == '__main__':
+
+    test_flood()
+    test_inv_multicast()
+    test_one_partition()
+
+    print("parallel | ok")
@@ -0,0 +1,123 @@
+"""
+Check that every scheduler backend pops events in the same order as heapq.
+
+Events must come out sorted by time, with ties broken first-in first-out.
+"""
+
+import heapq
+import random
+
+from scheduler import SCHEDULERS
+
+
+class Ev(object):
+
+    def __init__(self, run_at, seq):
+        self.run_at = run_at
+        self.seq = seq
+
+
+def check_order(name, seed, steps=5000):
+    """Interleave random puts and gets, comparing against a heapq reference."""
+
+    rnd = random.Random(seed)
+
+    queue = SCHEDULERS[name]()
+    ref = []
+
+    # Integer times give lots of ties, fractional ones exercise rounding
+    spread = rnd.choice([2, 20, 200])
+    fractional = seed % 2 == 1
+
+    now = 0
+    for seq in range(steps):
+
+        if rnd.random() < 0.5 or not ref:
+            t = now + rnd.randint(0, spread)
+            if fractional:
+                t += rnd.random()
+
+            queue.put(Ev(t, seq))
+            heapq.heappush(ref, (t, seq))
+
+        else:
+            assert queue.peek().seq == ref[0][1]
+
+            # Sometimes schedule an event before the one just peeked at
+            if rnd.random() < 0.2:
+                t = max(now, ref[0][0] - rnd.randint(0, spread))
+                if fractional:
+                    t += rnd.random() * (ref[0][0] - t)
+
+                queue.put(Ev(t, seq))
+                heapq.heappush(ref, (t, seq))
+
+            ev = queue.get()
+            now, expected = heapq.heappop(ref)
+
+            assert (ev.run_at, ev.seq) == (now, expected), (name, seed)
+
+    while ref:
+        ev = queue.get()
+        assert (ev.run_at, ev.seq) == heapq.heappop(ref), (name, seed)
+
+    assert queue.empty()
+
+
+def check_discard(name, seed, steps=2000):
+    """Discard random events halfway through, the rest must stay in order."""
+
+    rnd = random.Random(seed)
+
+    queue = SCHEDULERS[name]()
+    ref = []
+
+    for seq in range(steps):
+        t = rnd.randint(0, 100) + rnd.random()
+
+        queue.put(Ev(t, seq))
+        heapq.heappush(ref, (t, seq))
+
+        # Pop a few, so that the ladder has rungs & a bottom to filter
+        if seq == steps // 2:
+            for _ in range(10):
+                assert queue.get().seq == heapq.heappop(ref)[1]
+
+    gone = set(seq for t, seq in ref if rnd.random() < 0.7)
+
+    assert queue.discard_if(lambda ev: ev.seq in gone) == len(gone)
+    assert len(queue) == len(ref) - len(gone)
+
+    for t, seq in sorted(ref):
+        if seq not in gone:
+            assert queue.get().seq == seq, (name, seed)
+
+    assert queue.empty()
+
+
+def test_heap():
+    for seed in range(10):
+        check_order("heap", seed)
+        check_discard("heap", seed)
+
+
+def test_calendar():
+    for seed in range(10):
+        check_order("calendar", seed)
+        check_discard("calendar", seed)
+
+
+def test_ladder():
+    for seed in range(10):
+        check_order("ladder", seed)
+        check_discard("ladder", seed)
+
+
+if __name__ == '__main__':
+
+    for name in sorted(SCHEDULERS):
+        for seed in range(10):
+            check_order(name, seed)
+            check_discard(name, seed)
+
+        print("%-8s | ok" % name)
@@ -0,0 +1,48 @@
+"""
+Check that a run is fully determined by its seed, and that the random
+streams of different parts of the simulation don't affect each other.
+"""
+
+from simulation import Simulator
+
+
+def snapshot(sim):
+    return [
+        (node.coins, node.tip.id, sorted(node.arrived_at.items()), sorted(node.mempool))
+        for node in sim.nodes
+    ]
+
+
+def simulate(seed, tm=1, **kwargs):
+    sim = Simulator(12, 0.5, tm, 5, seed=seed, topology="random", degree=3,
+                    hash_power="random", **kwargs)
+    sim.run(until=None, until_time=20, quiet=True)
+
+    return sim
+
+
+def test_replay_identical():
+    for kwargs in ({}, {"per_node_streams": True}, {"arrivals": "global"}):
+        first = simulate(11, **kwargs)
+
+        assert snapshot(simulate(11, **kwargs)) == snapshot(first)
+        assert snapshot(simulate(12, **kwargs)) != snapshot(first)
+
+
+def test_streams_independent():
+    a, b = simulate(11), simulate(11, tm=3)
+
+    # Different transaction rates, but the same network & nodes
+    assert [[p.id for p in node.peers] for node in a.nodes] == \
+        [[p.id for p in node.peers] for node in b.nodes]
+    assert [node.hash_power for node in a.nodes] == [node.hash_power for node in b.nodes]
+    assert a.links.prop_delay(0, a.nodes[0].peers[0].id) == \
+        b.links.prop_delay(0, b.nodes[0].peers[0].id)
+
+
+if __name__ == '__main__':
+
+    test_replay_identical()
+    test_streams_independent()
+
+    print("streams | ok")
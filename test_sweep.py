@@ -0,0 +1,60 @@
+"""
+Check the bookkeeping of parameter sweeps: job seeds, resuming & the CIs.
+"""
+
+import json
+import os
+import tempfile
+
+from sweep import P, job_key, load, make_jobs, mean_ci, run_job
+
+
+def test_seeds_stable():
+    small = make_jobs(P.parse_args("--n 10 --reps 2".split()))
+    large = make_jobs(P.parse_args("--n 10 20 --z 0.3 0.4 --reps 5".split()))
+
+    seeds = dict((job_key(job), job["seed"]) for job in large)
+
+    # Extending a sweep doesn't change the seeds of the jobs in it already
+    for job in small:
+        assert seeds[job_key(job)] == job["seed"]
+
+    assert len(set(seeds.values())) == len(large)
+
+
+def test_mean_ci():
+    mean, half = mean_ci([1.0, 2.0, 3.0, 4.0])
+
+    assert mean == 2.5
+    assert abs(half - 3.182 * (5 / 3 / 4) ** 0.5) < 1e-9
+
+
+def test_resume():
+    args = P.parse_args("--n 6 --tm 1 --bm 3 --reps 2 --until-time 10 --degree 2".split())
+    job = make_jobs(args)[0]
+
+    options = {"until": None, "until_time": 10, "sim": {"topology": "regular", "degree": 2}}
+    result = run_job(job, options)
+
+    # Same seed, same run (apart from how fast it went)
+    again = run_job(job, options)
+    again["events_per_sec"] = result["events_per_sec"]
+
+    assert again == result
+
+    path = os.path.join(tempfile.mkdtemp(), "sweep.jsonl")
+    with open(path, "w") as fh:
+        fh.write(json.dumps(result) + "\n")
+        fh.write('{"n": 6, "z"')
+
+    # The partial line of a killed sweep is ignored
+    assert list(load(path)) == [job_key(job)]
+
+
+if __name__ == '__main__':
+
+    test_seeds_stable()
+    test_mean_ci()
+    test_resume()
+
+    print("sweep | ok")
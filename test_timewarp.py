@@ -0,0 +1,50 @@
+"""
+Check that optimistic (Time Warp) runs give exactly the results of a
+sequential run from the same seed, rollbacks and all.
+"""
+
+from test_parallel import ARGS, sequential
+from timewarp import TimeWarpSimulator
+
+
+def check_same(parts, until_time=10, tw_options=None, **kwargs):
+    expected, sim = sequential(until_time, **kwargs)
+
+    tw = TimeWarpSimulator(parts, *ARGS, checkpoint_every=16, **dict(tw_options or {}, **kwargs))
+    summary = tw.run(until_time, quiet=True)
+
+    assert tw.nodes == expected, (parts, kwargs)
+    assert summary["blocks"] == sim.block_id - 1
+    assert summary["events"] + summary["rolled_back"] == summary["processed"]
+
+    return summary
+
+
+def test_rollbacks():
+    summary = check_same(3, seed=1, topology="regular", degree=3,
+                         tw_options={"window": 0.5})
+
+    # A wide window lets workers run far ahead: there must have been stragglers
+    assert summary["rollbacks"] > 0
+    assert 0 < summary["efficiency"] < 1
+
+
+def test_inv_multicast():
+    check_same(2, seed=2, topology="random", degree=3, relay="inv",
+               tw_options={"batch": 300})
+    check_same(4, seed=3, topology="small-world", degree=4, multicast=True)
+
+
+def test_one_partition():
+    summary = check_same(1, seed=4, topology="regular", degree=3)
+
+    assert summary["rollbacks"] == 0
+
+
+if __name__ == '__main__':
+
+    test_rollbacks()
+    test_inv_multicast()
+    test_one_partition()
+
+    print("timewarp | ok")
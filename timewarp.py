@@ -0,0 +1,596 @@
+"""
+Optimistic (Time Warp) parallel execution of a simulation.
+
+As in parallel.py, the nodes are split into partitions, each simulated by
+its own worker process. But rather than waiting until it's safe, every
+worker runs its events as soon as it can, sending events for other
+partitions right away. When a message turns up for a time that a worker
+has already gone past (a straggler), the worker rolls back: it restores
+an earlier snapshot of its nodes, cancels the messages it sent since with
+anti-messages, and runs the events again.
+
+Snapshots are copy-on-write: a checkpoint is started every so many events,
+and a node is only copied into it right before the first event that
+changes the node after the checkpoint. Restoring a checkpoint puts back
+the copies of it and of every later checkpoint, newest first.
+
+Workers and the coordinating process work in rounds. The global virtual
+time (GVT), the earliest time of any unprocessed event or message in
+transit, is computed at the end of each round; nothing can roll back
+past it, so older snapshots, events & messages are freed (fossil
+collection), and the events before it are committed. Each round, workers
+only run events up to a window past GVT: the further they run ahead, the
+more of what they do is rolled back.
+
+Rather than rolling back to the checkpoint itself, a worker runs the
+events between the checkpoint and the straggler again without sending
+anything (coasting forward), so only the events it actually overtook are
+undone and cancelled.
+
+Like the conservative engine, this needs per-node random streams and
+gives exactly the results of a sequential run from the same seed.
+"""
+
+import time
+import traceback
+import multiprocessing
+
+from collections import Counter
+
+from events import Multicast
+from parallel import lookahead, node_state, partition
+from simulation import Simulator
+
+
+class _Checkpoint(object):
+
+    __slots__ = ("index", "sim_state", "nodes")
+
+    def __init__(self, index, sim_state):
+        # Number of processed events before the checkpoint
+        self.index = index
+
+        # Simulator counters at the checkpoint
+        self.sim_state = sim_state
+
+        # Saved state of the nodes changed since, by id: (node, streams)
+        self.nodes = {}
+
+
+class _Processed(object):
+
+    __slots__ = ("ev", "children", "sent")
+
+    def __init__(self, ev):
+        self.ev = ev
+
+        # Events it scheduled locally
+        self.children = []
+
+        # (partition, message id, time) of the events it sent to others
+        self.sent = []
+
+
+class LogicalProcess(object):
+    """
+    One partition of a Time Warp run, with its own copy of the simulator.
+
+    It also stands in for the simulator's event queue, so that it sees every
+    event the handlers schedule.
+    """
+
+    def __init__(self, part, parts, args, kwargs, checkpoint_every):
+        self.sim = sim = Simulator(*args, **kwargs)
+
+        self.part = part
+        self.owner = partition(sim.n, parts)
+
+        # Every worker builds the whole network, but only runs its own nodes
+        sim.events.discard_if(lambda ev: self.owner[ev.node_id] != part)
+        self.queue = sim.events
+        sim.events = self
+
+        # Events that were cancelled, but are still in the queue
+        self.cancelled = set()
+
+        # Processed events (since the last fossil collection), in order
+        self.processed = []
+        self.done = set()
+
+        # Checkpoints, oldest first. The first is never after GVT
+        self.checkpoint_every = checkpoint_every
+        self.checkpoints = [_Checkpoint(0, self.sim_state())]
+
+        # Received events by message id, and message ids of received events
+        self.by_msg = {}
+        self.msg_of = {}
+
+        self.outbox = []
+        self.next_msg = 0
+
+        # Record of the event being run, and whether it's only being rerun
+        # to rebuild the state after a rollback
+        self.current = None
+        self.coasting = False
+
+        # (time, traceback) of an event that failed, see run
+        self.error = None
+
+        self.stats = Counter()
+        self.committed = Counter()
+
+    # -- Event queue interface, for the event handlers
+
+    def __len__(self):
+        return len(self.queue)
+
+    def empty(self):
+        return self.peek() is None
+
+    def discard_if(self, pred):
+        # Whether an event is stale can change again after a rollback, so the
+        # queue is never compacted
+        return 0
+
+    def put(self, ev):
+
+        # Already scheduled the first time the event ran
+        if self.coasting:
+            return
+
+        # Deliver multicasts one by one, as a Multicast changes as it runs
+        if isinstance(ev, Multicast):
+            for run_at, node_id in ev.arrivals:
+                self.put(ev.kind(ev.payload, node_id, ev.creator_id,
+                                 ev.created_at, run_at))
+            return
+
+        dest = self.owner[ev.node_id]
+
+        if dest == self.part:
+            self.queue.put(ev)
+            self.current.children.append(ev)
+            return
+
+        msg_id = (self.part, self.next_msg)
+        self.next_msg += 1
+
+        self.outbox.append((dest, "event", msg_id, ev))
+        self.current.sent.append((dest, msg_id, ev.run_at))
+
+    def peek(self):
+        """Return the next event that hasn't been cancelled, or None."""
+
+        queue = self.queue
+
+        while not queue.empty():
+            ev = queue.peek()
+
+            if ev not in self.cancelled:
+                return ev
+
+            self.cancelled.discard(queue.get())
+
+        return None
+
+    # -- State saving
+
+    def sim_state(self):
+        sim = self.sim
+        return (sim.block_id, sim.trans_id, sim.curr_time, Counter(sim.relay_stats),
+                Counter(sim.orphan_stats))
+
+    def save_node(self, node_id):
+        """Copy a node into the current checkpoint, before its first change."""
+
+        saved = self.checkpoints[-1].nodes
+
+        if node_id not in saved:
+            sim = self.sim
+            saved[node_id] = (sim.nodes[node_id].save(), sim.stream.save(node_id))
+
+    def rollback(self, t):
+        """Undo every processed event at or after time t."""
+
+        processed = self.processed
+
+        if not processed or processed[-1].ev.run_at < t:
+            return
+
+        first = len(processed)
+        while first and processed[first - 1].ev.run_at >= t:
+            first -= 1
+
+        # Go back to the latest checkpoint before the first of these
+        while len(self.checkpoints) > 1 and self.checkpoints[-1].index > first:
+            self.restore(self.checkpoints.pop())
+
+        cp = self.checkpoints[-1]
+        self.restore(cp)
+        cp.nodes = {}
+
+        undone = processed[first:]
+        del processed[first:]
+
+        self.error = None
+
+        # Then coast forward: run the events before t again, only to rebuild
+        # the state. What they scheduled & sent the first time still stands
+        self.coasting = True
+        for rec in processed[cp.index:]:
+            self.save_node(rec.ev.node_id)
+            self.sim.curr_time = rec.ev.run_at
+            rec.ev.run(self.sim)
+        self.coasting = False
+
+        children = set()
+        for rec in undone:
+            children.update(rec.children)
+
+            for dest, msg_id, run_at in rec.sent:
+                self.outbox.append((dest, "cancel", msg_id, run_at))
+                self.stats["anti_messages"] += 1
+
+        # Scheduled by undone events: they'll be scheduled again if need be
+        for ev in children:
+            self.cancelled.add(ev)
+
+        for rec in undone:
+            self.done.discard(rec.ev)
+
+            if rec.ev in children:
+                self.cancelled.discard(rec.ev)
+            else:
+                self.queue.put(rec.ev)
+
+        self.stats["rollbacks"] += 1
+        self.stats["rolled_back"] += len(undone)
+        self.stats["coasted"] += len(processed) - cp.index
+
+    def restore(self, cp):
+        sim = self.sim
+
+        for node_id, (node, streams) in cp.nodes.items():
+            sim.nodes[node_id].restore(node)
+            sim.stream.restore(node_id, streams)
+
+        (sim.block_id, sim.trans_id, sim.curr_time, relay, orphans) = cp.sim_state
+        sim.relay_stats = Counter(relay)
+        sim.orphan_stats = Counter(orphans)
+
+    # -- Messages from other partitions
+
+    def receive(self, kind, msg_id, data):
+        if kind == "event":
+            ev = data
+            self.rollback(ev.run_at)
+
+            self.by_msg[msg_id] = ev
+            self.msg_of[ev] = msg_id
+            self.queue.put(ev)
+
+        else:
+            ev = self.by_msg.pop(msg_id)
+            del self.msg_of[ev]
+
+            if ev in self.done:
+                self.rollback(ev.run_at)
+
+            self.cancelled.add(ev)
+
+    # -- Running
+
+    def lvt(self):
+        """Return the time of the next event to run (infinite if none)."""
+
+        if self.error is not None:
+            return self.error[0]
+
+        ev = self.peek()
+        return ev.run_at if ev is not None else float("inf")
+
+    def run(self, horizon, limit):
+        """Optimistically run up to limit events, up to time horizon."""
+
+        sim = self.sim
+
+        for _ in range(limit):
+            if self.error is not None:
+                break
+
+            ev = self.peek()
+
+            if ev is None or ev.run_at > horizon:
+                break
+
+            self.queue.get()
+
+            if len(self.processed) - self.checkpoints[-1].index >= self.checkpoint_every:
+                self.checkpoints.append(_Checkpoint(len(self.processed), self.sim_state()))
+
+            self.save_node(ev.node_id)
+
+            self.current = _Processed(ev)
+            self.processed.append(self.current)
+            self.done.add(ev)
+
+            sim.curr_time = ev.run_at
+
+            # Running ahead, a node can be sent messages that don't fit its
+            # state (say, a block built on another version of one it has),
+            # until the anti-messages catch up. So an error only stops this
+            # partition until a rollback undoes the event; it's only real
+            # if GVT gets to the event (see check_error)
+            try:
+                ev.run(sim)
+            except Exception:
+                self.error = (ev.run_at, traceback.format_exc())
+
+            self.stats["processed"] += 1
+
+    def check_error(self, gvt):
+        """Raise the error of a failed event that can't be rolled back anymore."""
+
+        if self.error is not None and self.error[0] <= gvt:
+            raise RuntimeError("event at %r failed:\n%s" % self.error)
+
+    def fossil_collect(self, gvt):
+        """Commit (and forget) everything that can't be rolled back anymore."""
+
+        processed = self.processed
+
+        # Rollbacks only undo events at or after gvt, so they never go back
+        # further than the latest checkpoint before the first of those
+        first = 0
+        while first < len(processed) and processed[first].ev.run_at < gvt:
+            first += 1
+
+        keep = 0
+        while keep + 1 < len(self.checkpoints) and self.checkpoints[keep + 1].index <= first:
+            keep += 1
+
+        cut = self.checkpoints[keep].index
+
+        # Events before that checkpoint are final
+        for rec in processed[:cut]:
+            ev = rec.ev
+            self.committed[ev.label] += 1
+            self.done.discard(ev)
+
+            msg_id = self.msg_of.pop(ev, None)
+            if msg_id is not None:
+                del self.by_msg[msg_id]
+
+        del processed[:cut]
+        del self.checkpoints[:keep]
+
+        for cp in self.checkpoints:
+            cp.index -= cut
+
+    def results(self):
+        sim = self.sim
+        self.fossil_collect(float("inf"))
+
+        for rec in self.processed:
+            self.committed[rec.ev.label] += 1
+
+        return {
+            "nodes": dict((node.id, node_state(node)) for node in sim.nodes
+                          if self.owner[node.id] == self.part),
+            "counts": self.committed,
+            "stats": self.stats,
+            "relay": sim.relay_stats,
+            "orphans": sim.orphan_stats,
+            "blocks": sim.block_id - 1,
+            "transactions": sim.trans_id - 1,
+            "sim_time": sim.curr_time,
+        }
+
+
+def _work(conn, part, parts, args, kwargs, checkpoint_every):
+    lp = LogicalProcess(part, parts, args, kwargs, checkpoint_every)
+
+    conn.send((lookahead(lp.sim, lp.owner, part), lp.lvt()))
+
+    while True:
+        msg = conn.recv()
+
+        if msg[0] == "finish":
+            break
+
+        _, incoming, gvt, horizon, limit = msg
+
+        lp.fossil_collect(gvt)
+
+        for kind, msg_id, data in incoming:
+            lp.receive(kind, msg_id, data)
+
+        lp.check_error(gvt)
+
+        lp.run(horizon, limit)
+
+        outbox, lp.outbox = lp.outbox, []
+        conn.send((outbox, lp.lvt()))
+
+    conn.send(lp.results())
+
+
+def _worker(conn, part, parts, args, kwargs, checkpoint_every):
+    try:
+        _work(conn, part, parts, args, kwargs, checkpoint_every)
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+
+
+class TimeWarpSimulator(object):
+    """
+    Runs a Simulator(*args, **kwargs) optimistically over worker processes.
+
+    batch            -- events each worker runs per round, at most
+    window           -- how far past GVT workers may run, in simulated time
+                        (by default, 5 times the smallest delay of a link
+                        between two partitions)
+    checkpoint_every -- events between two checkpoints of a worker
+
+    With no bound on how far ahead they run, workers mostly compute
+    futures that are rolled back: it takes a message a single link
+    delay to reach another partition, and each one can undo everything
+    the receiver did after it.
+    """
+
+    def __init__(self, partitions, *args, **kwargs):
+
+        self.batch = kwargs.pop("batch", 2000)
+        self.window = kwargs.pop("window", None)
+        self.checkpoint_every = kwargs.pop("checkpoint_every", 64)
+
+        if kwargs.get("arrivals", "per-node") != "per-node":
+            raise ValueError("parallel runs need per-node arrivals")
+
+        if kwargs.get("seed") is None:
+            raise ValueError("parallel runs need a seed, shared by all workers")
+
+        kwargs["per_node_streams"] = True
+
+        # Number of worker processes
+        self.partitions = partitions
+
+        self.args = args
+        self.kwargs = kwargs
+
+        # Final state of each node (see parallel.node_state), by id, once run
+        self.nodes = {}
+
+    def _recv(self, conn):
+        msg = conn.recv()
+
+        if isinstance(msg, tuple) and msg and msg[0] == "error":
+            raise RuntimeError("worker failed:\n" + msg[1])
+
+        return msg
+
+    def run(self, until_time, quiet=False):
+        """Run all events up to simulated time until_time, return a summary."""
+
+        started = time.perf_counter()
+        parts = self.partitions
+
+        conns, procs = [], []
+        for part in range(parts):
+            parent, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(
+                target=_worker,
+                args=(child, part, parts, self.args, self.kwargs, self.checkpoint_every)
+            )
+            proc.start()
+
+            conns.append(parent)
+            procs.append(proc)
+
+        results = None
+        try:
+            hello = [self._recv(conn) for conn in conns]
+
+            L = min(h[0] for h in hello)
+            window = self.window if self.window is not None else 5 * L
+
+            gvt = min(h[1] for h in hello)
+
+            pending = [[] for _ in range(parts)]
+            rounds = sent = 0
+
+            while gvt <= until_time:
+
+                for conn, incoming in zip(conns, pending):
+                    conn.send(("round", incoming, gvt, min(until_time, gvt + window),
+                               self.batch))
+
+                pending = [[] for _ in range(parts)]
+                lvts = []
+
+                # Gathered in partition order, so deliveries are deterministic
+                for conn in conns:
+                    outbox, lvt = self._recv(conn)
+                    lvts.append(lvt)
+
+                    for dest, kind, msg_id, data in outbox:
+                        pending[dest].append((kind, msg_id, data))
+                        sent += 1
+
+                # Messages in transit count too, anti-messages included
+                in_transit = [
+                    data.run_at if kind == "event" else data
+                    for msgs in pending for kind, msg_id, data in msgs
+                ]
+
+                gvt = min(lvts + in_transit)
+                rounds += 1
+
+            for conn in conns:
+                conn.send(("finish",))
+
+            results = [self._recv(conn) for conn in conns]
+
+        finally:
+            for proc in procs:
+                # After a failure, the other workers still wait for messages
+                if results is None:
+                    proc.terminate()
+                proc.join()
+
+        elapsed = time.perf_counter() - started
+
+        counts, stats, relay, orphans = Counter(), Counter(), Counter(), Counter()
+
+        for result in results:
+            self.nodes.update(result["nodes"])
+            counts.update(result["counts"])
+            stats.update(result["stats"])
+            relay.update(result["relay"])
+            orphans.update(result["orphans"])
+
+        events = sum(counts.values())
+        processed = stats["processed"]
+
+        summary = {
+            "events": events,
+            "processed": processed,
+            "rollbacks": stats["rollbacks"],
+            "rolled_back": stats["rolled_back"],
+            "anti_messages": stats["anti_messages"],
+
+            # Rolled back events per processed one, and the useful share
+            "rollback_rate": stats["rolled_back"] / processed if processed else 0.0,
+            "efficiency": events / processed if processed else 1.0,
+
+            "sim_time": max(r["sim_time"] for r in results),
+            "wall_time": elapsed,
+            "events_per_sec": events / elapsed if elapsed else 0.0,
+            "counts": dict(counts),
+            "blocks": sum(r["blocks"] for r in results),
+            "transactions": sum(r["transactions"] for r in results),
+            "orphans": dict(orphans),
+            "relay": dict(relay),
+            "partitions": parts,
+            "window": window,
+            "rounds": rounds,
+            "messages": sent,
+        }
+
+        if not quiet:
+            print("\nCounts of events committed: \n")
+            for e, c in sorted(counts.items()):
+                print("{:<19} | {}".format(e, c))
+            print("{:^19} | {}".format("Total", events))
+
+            print("\nPartitions: %d, window: %.4f s" % (parts, window))
+            print("Rounds: %d, messages: %d (%d anti-messages)" % (
+                rounds, sent, summary["anti_messages"]))
+            print("Rollbacks: %d, events rolled back: %d (rate %.4f)" % (
+                summary["rollbacks"], summary["rolled_back"], summary["rollback_rate"]))
+            print("Efficiency (committed / processed): %.4f" % summary["efficiency"])
+            print("Simulated time: %.4f s in %.4f s of wall time" % (
+                summary["sim_time"], elapsed))
+            print("Events / second: %.1f" % summary["events_per_sec"])
+
+        return summary
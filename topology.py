@@ -0,0 +1,267 @@
+"""
+Generators for the peer-to-peer network graph.
+
+Every generator takes the number of nodes n, a target degree d and a source
+of randomness (anything with the interface of the random module), and
+returns a list with the peer ids of each node.
+
+Apart from dense, which is the original (directed) topology of the
+assignment, these are undirected and run in time linear in the number of
+edges. Connectivity is checked (and repaired if needed) in a single
+O(V + E) pass.
+"""
+
+import math
+
+
+def is_connected(adj):
+    """Check whether every node is reachable from node 0."""
+    return len(components(adj)[0]) == len(adj) if adj else True
+
+
+def components(adj):
+    """Return the connected components of the graph, in one BFS pass."""
+
+    seen = [False] * len(adj)
+    comps = []
+
+    for root in range(len(adj)):
+
+        if seen[root]:
+            continue
+
+        seen[root] = True
+        comp = [root]
+
+        # comp doubles as the BFS queue
+        for u in comp:
+            for v in adj[u]:
+                if not seen[v]:
+                    seen[v] = True
+                    comp.append(v)
+
+        comps.append(comp)
+
+    return comps
+
+
+def connect(adj, rng):
+    """Join the components of an undirected graph with one edge each."""
+
+    comps = components(adj)
+
+    for a, b in zip(comps, comps[1:]):
+        u, v = rng.choice(a), rng.choice(b)
+
+        adj[u].append(v)
+        adj[v].append(u)
+
+    return adj
+
+
+def complete(n):
+    return [[j for j in range(n) if j != i] for i in range(n)]
+
+
+def dense(n, d, rng):
+    """
+    The original topology: every node picks between n/2 + 1 & n - 1 peers.
+
+    This ensures that network graph remains connected, but it doesn't
+    consider all possible connected graphs and costs O(n^2).
+    """
+
+    adj = []
+
+    for me in range(n):
+        num_peers = rng.randint(1 + n // 2, n - 1)
+
+        all_but_me = [i for i in range(n) if i != me]
+        adj.append(rng.sample(all_but_me, num_peers))
+
+    return adj
+
+
+def _from_edges(n, edges):
+    adj = [[] for _ in range(n)]
+
+    for u, v in edges:
+        adj[u].append(v)
+        adj[v].append(u)
+
+    return adj
+
+
+def random_regular(n, d, rng):
+    """
+    Random d-regular graph, using the pairing (configuration) model.
+
+    Stubs are paired up at random; pairs that would create a self loop or a
+    duplicate edge are fixed by swapping with a random existing edge.
+    """
+
+    if n <= d + 1:
+        return complete(n)
+
+    stubs = [i for i in range(n) for _ in range(d)]
+
+    # n * d has to be even: give one node an extra peer
+    if len(stubs) % 2:
+        stubs.append(rng.randrange(n))
+
+    rng.shuffle(stubs)
+
+    edges = []
+    seen = set()
+    leftover = []
+
+    for u, v in zip(stubs[::2], stubs[1::2]):
+        e = (min(u, v), max(u, v))
+
+        if u != v and e not in seen:
+            seen.add(e)
+            edges.append(e)
+        else:
+            leftover.append((u, v))
+
+    # Swap (u, v) & (x, y) into (u, x) & (v, y), keeping all degrees the same
+    tries = 0
+    while leftover and tries < 100 * len(stubs):
+        tries += 1
+
+        u, v = leftover[-1]
+        k = rng.randrange(len(edges))
+        x, y = edges[k]
+
+        a, b = (min(u, x), max(u, x)), (min(v, y), max(v, y))
+
+        if u == x or v == y or a == b or a in seen or b in seen:
+            continue
+
+        leftover.pop()
+        seen.remove(edges[k])
+        seen.add(a)
+        seen.add(b)
+
+        edges[k] = a
+        edges.append(b)
+
+    return connect(_from_edges(n, edges), rng)
+
+
+def erdos_renyi(n, d, rng):
+    """
+    Erdos-Renyi G(n, p) graph with expected degree d.
+
+    Uses the geometric skipping method of Batagelj & Brandes (2005), so
+    only the edges that exist are ever generated. Components are then
+    joined together to repair connectivity.
+    """
+
+    if n <= d + 1:
+        return complete(n)
+
+    p = d / (n - 1)
+    lp = math.log(1 - p)
+
+    edges = []
+
+    v, w = 1, -1
+    while v < n:
+        w += 1 + int(math.log(1 - rng.random()) / lp)
+
+        while w >= v and v < n:
+            w -= v
+            v += 1
+
+        if v < n:
+            edges.append((v, w))
+
+    return connect(_from_edges(n, edges), rng)
+
+
+def barabasi_albert(n, d, rng):
+    """
+    Barabasi-Albert preferential attachment graph with average degree ~d.
+
+    Every new node attaches to m = d / 2 existing nodes, chosen with
+    probability proportional to their degree, so the graph is connected.
+    """
+
+    m = max(1, d // 2)
+
+    if n <= m + 1:
+        return complete(n)
+
+    edges = []
+
+    # Every node appears here once for each edge it has
+    repeated = []
+
+    targets = list(range(m))
+
+    for source in range(m, n):
+
+        for t in targets:
+            edges.append((source, t))
+
+        repeated.extend(targets)
+        repeated.extend([source] * m)
+
+        chosen = set()
+        while len(chosen) < m:
+            chosen.add(rng.choice(repeated))
+
+        targets = list(chosen)
+
+    return _from_edges(n, edges)
+
+
+def small_world(n, d, rng, beta=0.1):
+    """
+    Watts-Strogatz small-world graph.
+
+    Starts from a ring where every node links to its d nearest neighbours,
+    then rewires each edge to a random node with probability beta.
+    """
+
+    k = max(2, d - d % 2)
+
+    if n <= k + 1:
+        return complete(n)
+
+    adj = [set() for _ in range(n)]
+
+    for u in range(n):
+        for j in range(1, k // 2 + 1):
+            v = (u + j) % n
+            adj[u].add(v)
+            adj[v].add(u)
+
+    for u in range(n):
+        for j in range(1, k // 2 + 1):
+            v = (u + j) % n
+
+            if rng.random() >= beta or v not in adj[u]:
+                continue
+
+            w = rng.randrange(n)
+            if w == u or w in adj[u]:
+                continue
+
+            adj[u].discard(v)
+            adj[v].discard(u)
+            adj[u].add(w)
+            adj[w].add(u)
+
+    return connect([sorted(s) for s in adj], rng)
+
+
+# Topologies that can be chosen from the command line
+TOPOLOGIES = {
+    "dense": dense,
+    "regular": random_regular,
+    "random": erdos_renyi,
+    "scale-free": barabasi_albert,
+    "small-world": small_world,
+}
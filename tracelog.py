@@ -0,0 +1,294 @@
+"""
+Binary traces of the events of a run, and a reader & CLI for them.
+
+A trace is a small JSON header followed by fixed width records, one per
+event run (or one in every so many, when sampled):
+
+    time     float64  when the event ran
+    item     int64    id of the block / transaction it's about (-1 if none)
+    seq      uint32   number of the event in the run, from 1
+    node     int32    node it ran on
+    creator  int32    node that created it
+    kind     uint8    index of its label in the header's "kinds"
+
+Records are packed on the simulation's thread, and written out in large
+chunks by a background thread, which costs far less than printing every
+event. Files are read back through a memory map, so even huge traces can
+be filtered without loading them.
+
+For eg: python3 tracelog.py output/trace.bin --node 3 --kind BlockReceive --start 10
+"""
+
+import sys
+import json
+import queue
+import struct
+import argparse
+import threading
+
+import numpy as np
+
+import events as EV
+
+MAGIC = b"BTRACE\x00\x01"
+
+# Layout of a record, for writing & for reading
+RECORD = struct.Struct("<dqIiiB3x")
+RECORD_DTYPE = np.dtype([
+    ("time", "<f8"), ("item", "<i8"), ("seq", "<u4"), ("node", "<i4"),
+    ("creator", "<i4"), ("kind", "u1"), ("pad", "V3"),
+])
+
+# Records are handed to the writer thread in chunks of (about) this many bytes
+CHUNK = 1 << 20
+
+# Chunks waiting to be written, at most: if the disk can't keep up, the
+# simulation waits rather than filling up the memory
+MAX_CHUNKS = 16
+
+# Kinds of events, by their code in the records
+KINDS = (
+    EV.TransactionGenerate, EV.TransactionReceive, EV.BlockGenerate,
+    EV.BlockReceive, EV.Inv, EV.GetData, EV.Data, EV.TransactionClock,
+    EV.BlockClock,
+)
+
+CODES = dict((kind, code) for code, kind in enumerate(KINDS))
+
+# (kind code, item id) of an event, by its type
+DESCRIBE = {
+    EV.TransactionGenerate: lambda ev: (CODES[EV.TransactionGenerate], -1),
+    EV.BlockGenerate: lambda ev: (CODES[EV.BlockGenerate], -1),
+    EV.TransactionClock: lambda ev: (CODES[EV.TransactionClock], -1),
+    EV.BlockClock: lambda ev: (CODES[EV.BlockClock], -1),
+
+    EV.TransactionReceive: lambda ev: (CODES[EV.TransactionReceive], ev.transaction.id),
+    EV.BlockReceive: lambda ev: (CODES[EV.BlockReceive], ev.block.id),
+    EV.Inv: lambda ev: (CODES[EV.Inv], ev.payload[1].id),
+    EV.GetData: lambda ev: (CODES[EV.GetData], ev.payload[1].id),
+    EV.Data: lambda ev: (CODES[EV.Data], ev.payload[1].id),
+
+    # Multicasts are recorded as the delivery that's about to run
+    EV.Multicast: lambda ev: (CODES[ev.kind], ev.payload.id),
+}
+
+
+class TraceWriter(object):
+    """
+    Records events to a trace file, see Simulator.run.
+
+    every -- only record one in every so many events
+    meta  -- anything else (JSON serialisable) to keep in the header
+    """
+
+    def __init__(self, path, every=1, meta=None):
+
+        if every < 1:
+            raise ValueError("every must be at least 1")
+
+        self.path = path
+        self.every = every
+
+        # Events seen, and recorded
+        self.seen = 0
+        self.recorded = 0
+
+        self._buf = bytearray()
+        self._fh = open(path, "wb")
+
+        header = json.dumps({
+            "kinds": [kind.__name__ for kind in KINDS],
+            "every": every,
+            "meta": meta or {},
+        }).encode()
+
+        # Records start 8 byte aligned
+        header += b" " * (-(len(MAGIC) + 4 + len(header)) % 8)
+        self._fh.write(MAGIC + struct.pack("<I", len(header)) + header)
+
+        self._chunks = queue.Queue(MAX_CHUNKS)
+        self._error = None
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self):
+        while True:
+            chunk = self._chunks.get()
+
+            if chunk is None:
+                break
+
+            # After a failed write (say, a full disk), keep taking chunks so
+            # that the simulation doesn't block; close raises the error
+            if self._error is None:
+                try:
+                    self._fh.write(chunk)
+                except OSError as e:
+                    self._error = e
+
+    def record(self, ev):
+        """Record an event, before it runs."""
+
+        self.seen += 1
+
+        if self.every > 1 and self.seen % self.every:
+            return
+
+        code, item = DESCRIBE[type(ev)](ev)
+
+        self._buf += RECORD.pack(ev.run_at, item, self.seen & 0xFFFFFFFF,
+                                 ev.node_id, ev.creator_id, code)
+        self.recorded += 1
+
+        if len(self._buf) >= CHUNK:
+            self._chunks.put(bytes(self._buf))
+            self._buf = bytearray()
+
+    def close(self):
+        """Write out everything recorded, and close the file."""
+
+        if self._fh.closed:
+            return
+
+        self._chunks.put(bytes(self._buf))
+        self._chunks.put(None)
+        self._thread.join()
+
+        self._buf = bytearray()
+        self._fh.close()
+
+        if self._error is not None:
+            raise self._error
+
+
+class TraceReader(object):
+    """A trace file, with its records memory-mapped as a NumPy array."""
+
+    def __init__(self, path):
+
+        with open(path, "rb") as fh:
+            if fh.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not an event trace" % path)
+
+            size, = struct.unpack("<I", fh.read(4))
+            header = json.loads(fh.read(size))
+
+            offset = len(MAGIC) + 4 + size
+            end = fh.seek(0, 2)
+
+        self.kinds = header["kinds"]
+        self.every = header["every"]
+        self.meta = header["meta"]
+
+        # A trace cut short (say, by a crash) can end with a partial record
+        count = (end - offset) // RECORD_DTYPE.itemsize
+
+        if count:
+            self.records = np.memmap(path, RECORD_DTYPE, "r", offset, (count,))
+        else:
+            self.records = np.empty(0, RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def select(self, nodes=None, kinds=None, start=None, end=None, item=None):
+        """
+        Return the records of events on any of nodes, of any of kinds (by
+        label), about item, and at a time in [start, end].
+        """
+
+        recs = self.records
+        mask = np.ones(len(recs), dtype=bool)
+
+        if nodes is not None:
+            mask &= np.isin(recs["node"], list(nodes))
+
+        if kinds is not None:
+            unknown = set(kinds) - set(self.kinds)
+            if unknown:
+                raise ValueError("unknown kinds of events: %s" % ", ".join(sorted(unknown)))
+
+            mask &= np.isin(recs["kind"], [self.kinds.index(k) for k in kinds])
+
+        if item is not None:
+            mask &= recs["item"] == item
+
+        if start is not None:
+            mask &= recs["time"] >= start
+
+        if end is not None:
+            mask &= recs["time"] <= end
+
+        return recs[mask]
+
+    def format(self, rec):
+        """Return a record as a line of text, like the log printed by a run."""
+
+        item = " #%d" % rec["item"] if rec["item"] >= 0 else ""
+
+        return "%6d | %.8f | %s on %d by %d%s" % (
+            rec["seq"], rec["time"], self.kinds[rec["kind"]], rec["node"],
+            rec["creator"], item,
+        )
+
+
+P = argparse.ArgumentParser(
+    description='Filter & print the events of a trace.',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+
+P.add_argument('path', help='Trace file written by a run (see run.py --trace)')
+
+P.add_argument('--node', type=int, nargs="+", default=None,
+               help='Only events on these nodes')
+
+P.add_argument('--kind', nargs="+", default=None,
+               help='Only events of these kinds, eg: BlockReceive')
+
+P.add_argument('--item', type=int, default=None,
+               help='Only events about the block / transaction with this id')
+
+P.add_argument('--start', type=float, default=None,
+               help='Only events at or after this simulated time')
+
+P.add_argument('--end', type=float, default=None,
+               help='Only events at or before this simulated time')
+
+P.add_argument('--limit', type=int, default=0,
+               help='Print at most this many events (0 for no limit)')
+
+P.add_argument('--count', action="store_true",
+               help='Only print how many events of each kind matched')
+
+
+if __name__ == '__main__':
+
+    args = P.parse_args()
+
+    reader = TraceReader(args.path)
+
+    try:
+        recs = reader.select(args.node, args.kind, args.start, args.end, args.item)
+    except ValueError as e:
+        P.error(str(e))
+
+    if args.count:
+        codes, counts = np.unique(recs["kind"], return_counts=True)
+
+        for code, count in zip(codes, counts):
+            print("{:<19} | {}".format(reader.kinds[code], count))
+        print("{:^19} | {}".format("Total", len(recs)))
+
+        sys.exit()
+
+    if args.limit:
+        recs = recs[:args.limit]
+
+    for rec in recs:
+        print(reader.format(rec))